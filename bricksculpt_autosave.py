@@ -0,0 +1,173 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# System imports
+import json
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+# Blender imports
+# NONE!
+
+# Addon imports
+# NONE!
+
+
+AUTOSAVE_VERSION = 1
+
+
+def copyEntry(brickD):
+    """ copy of bricksDict entry that later edits of the entry (including lists changed in place) don't affect """
+    return {f: list(v) if isinstance(v, (list, tuple)) else v for f, v in brickD.items()}
+
+
+def readAutosave(filepath:str):
+    """ get (model name, entries) from autosave journal, with the latest entry per key (None for removed keys) """
+    entries = OrderedDict()
+    model = None
+    with open(filepath, "r") as f:
+        for i, line in enumerate(f):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # last line was cut off by the crash
+                break
+            if i == 0:
+                if record.get("version") != AUTOSAVE_VERSION:
+                    raise ValueError("Autosave journal '%(filepath)s' has unsupported version %(version)s" % {"filepath": filepath, "version": record.get("version")})
+                model = record["model"]
+            else:
+                entries.update(record["entries"])
+    return model, entries
+
+
+def applyAutosave(bricksDict:dict, entries:dict):
+    """ write entries from 'readAutosave' into bricksDict """
+    for key, brickD in entries.items():
+        if brickD is not None:
+            bricksDict[key] = brickD
+        elif key in bricksDict:
+            del bricksDict[key]
+
+
+class AutosaveJournal:
+    """ append-only journal of bricksDict edits, written on a worker thread
+
+    Keys edited during a stroke are collected with 'mark'; 'endStroke' copies
+    their entries and queues them, so the modal handler never waits on the
+    file. The worker appends one JSON line per stroke after a header line
+    naming the model, and every 'compactEvery' strokes rewrites the journal
+    with only the latest entry per key. A journal left by an interrupted
+    session is replaced, unless 'continueJournal' is set (after its edits
+    were recovered) and it belongs to the same model, in which case it is
+    appended to so it keeps covering the recovered edits.
+    """
+
+    def __init__(self, filepath:str, model:str, compactEvery:int=50, continueJournal:bool=False):
+        self.filepath = filepath
+        self.model = model
+        self.compactEvery = compactEvery
+        self.continueJournal = continueJournal
+        self.marked = OrderedDict()
+        self.numStrokes = 0
+        self.numCompactions = 0
+        self.error = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="BrickSculptAutosave", daemon=True)
+        self.thread.start()
+
+    def mark(self, keys:iter):
+        for key in keys:
+            self.marked[key] = None
+
+    def endStroke(self, bricksDict:dict):
+        """ queue entries of keys marked since the last call """
+        if not self.marked or self.error is not None:
+            return
+        entries = OrderedDict((key, copyEntry(bricksDict[key]) if key in bricksDict else None) for key in self.marked)
+        self.marked.clear()
+        self.queue.put(entries)
+
+    def stop(self):
+        """ write queued strokes and stop the worker """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def discard(self):
+        """ stop the worker and remove the journal (once edits are committed) """
+        self.stop()
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
+    # worker thread
+
+    def run(self):
+        try:
+            f = self.open()
+            numSinceCompaction = 0
+            while True:
+                entries = self.queue.get()
+                if entries is None:
+                    break
+                f.write(json.dumps({"entries": entries}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                self.numStrokes += 1
+                numSinceCompaction += 1
+                if numSinceCompaction >= self.compactEvery:
+                    f.close()
+                    self.compact()
+                    f = open(self.filepath, "a")
+                    numSinceCompaction = 0
+            f.close()
+        except (OSError, ValueError) as e:
+            # keep sculpting without autosave; the error is reported by 'stats'
+            self.error = str(e)
+
+    def open(self):
+        """ open journal for appending, starting a new one unless continuing a recovered session of the same model """
+        if self.continueJournal and os.path.exists(self.filepath):
+            try:
+                model, entries = readAutosave(self.filepath)
+            except ValueError:
+                model = None
+            if model == self.model:
+                # drop a line cut off by a crash, so appended lines start on a line of their own
+                with open(self.filepath, "rb+") as f:
+                    f.truncate(f.read().rfind(b"\n") + 1)
+                return open(self.filepath, "a")
+        f = open(self.filepath, "w")
+        f.write(json.dumps({"version": AUTOSAVE_VERSION, "model": self.model}) + "\n")
+        return f
+
+    def compact(self):
+        """ rewrite journal with the latest entry per key (replacing the file atomically) """
+        model, entries = readAutosave(self.filepath)
+        tmpPath = self.filepath + ".tmp"
+        with open(tmpPath, "w") as f:
+            f.write(json.dumps({"version": AUTOSAVE_VERSION, "model": model}) + "\n")
+            f.write(json.dumps({"entries": entries}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, self.filepath)
+        self.numCompactions += 1
+
+    def stats(self):
+        return {"strokes": self.numStrokes, "queued": self.queue.qsize(), "compactions": self.numCompactions, "error": self.error}
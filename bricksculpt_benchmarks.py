@@ -0,0 +1,497 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" benchmarks for the BrickSculpt hot paths (run from Blender's Python console; each prints a summary table and returns its results as a dict) """
+
+# System imports
+import json
+import math
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+# Blender imports
+import bpy
+from mathutils import Matrix, Vector
+
+# Addon imports
+from ....functions.common import *
+from .bricksculpt_events import *
+from .bricksculpt_keys import *
+from .bricksculpt_raycast import *
+from .bricksculpt_store import *
+
+
+class _BenchmarkBrick:
+    """ stand-in for brick objects that are never created in the scene """
+    matrix_world = Matrix.Identity(4)
+
+
+class _SyntheticBrickGrid(BrickGrid):
+    """ grid engine that treats every drawn cell as a visible brick """
+    def getVisibleBrick(self, name:str):
+        return _BenchmarkBrick
+
+
+def makeSyntheticBricksDict(numBricks:int, fill:float=0.5, seed:int=0):
+    """ build bricksDict with 'numBricks' drawn 1x1x1 bricks scattered through a cube of cells """
+    rand = random.Random(seed)
+    side = int(math.ceil((numBricks / fill) ** (1 / 3)))
+    cells = rand.sample(range(side ** 3), numBricks)
+    bricksDict = {}
+    for c in cells:
+        x, y, z = c % side, (c // side) % side, c // side ** 2
+        key = "%(x)s,%(y)s,%(z)s" % locals()
+        bricksDict[key] = {"name": "Bricker_benchmark__" + key, "draw": True, "parent": "self", "co": (x, y, z)}
+    return bricksDict, side
+
+
+def makeBenchmarkRays(side:int, numRays:int, seed:int=0):
+    """ rays from a sphere around the cube of cells toward random points inside of it """
+    rand = random.Random(seed)
+    center = Vector((side / 2,) * 3)
+    rays = []
+    for i in range(numRays):
+        origin = center + Vector([rand.gauss(0, 1) for j in range(3)]).normalized() * side * 2
+        target = Vector([rand.uniform(0, side) for j in range(3)])
+        rays.append((origin, (target - origin).normalized()))
+    return rays
+
+
+def _timeRays(castFn, rays:list):
+    """ returns per-ray latencies (in ms) of castFn(origin, direction) """
+    times = []
+    for origin, direction in rays:
+        t0 = time.perf_counter()
+        castFn(origin, direction)
+        times.append((time.perf_counter() - t0) * 1000)
+    return times
+
+
+def _createBenchmarkScene(bricksDict:dict):
+    """ link one cube object per brick to the scene (all sharing a single mesh) """
+    h = 0.5
+    verts = [(x, y, z) for x in (-h, h) for y in (-h, h) for z in (-h, h)]
+    faces = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    mesh = bpy.data.meshes.new("Bricker_benchmark_mesh")
+    mesh.from_pydata(verts, [], faces)
+    objs = []
+    for brickD in bricksDict.values():
+        obj = bpy.data.objects.new(brickD["name"], mesh)
+        obj.location = brickD["co"]
+        link_object(obj)
+        objs.append(obj)
+    _updateScene()
+    return objs, mesh
+
+
+def _updateScene():
+    """ evaluate scene as the viewport would between modal events """
+    if b280():
+        bpy.context.view_layer.update()
+    else:
+        bpy.context.scene.update()
+
+
+def _sceneRayCast(origin:Vector, direction:Vector, distance:float=1000000):
+    scn = bpy.context.scene
+    if b280():
+        return scn.ray_cast(bpy.context.view_layer, origin, direction, distance=distance)
+    else:
+        return scn.ray_cast(origin, origin + direction * distance)
+
+
+def summarize(times:list):
+    """ latency percentiles (in ms) for list of per-call latencies """
+    a = np.array(times)
+    return {"mean": float(a.mean()), "p50": float(np.percentile(a, 50)), "p95": float(np.percentile(a, 95)), "p99": float(np.percentile(a, 99))}
+
+
+def benchmarkPicking(counts:iter=(10000, 100000, 1000000), numRays:int=500, maxSceneBricks:int=100000):
+    """ compare hover picking latency of grid DDA ('GRID') against scene.ray_cast ('SCENE')
+
+    The scene path creates real (linked duplicate) cube objects, so it is skipped
+    for counts above 'maxSceneBricks' to keep benchmark setup time reasonable:
+    in Blender, a million brick objects take minutes and gigabytes to create,
+    and the headless stand-in scene ray casts by brute force (about 0.3 ms per
+    object per ray, so run it headless with 'maxSceneBricks' around 1000).
+    """
+    results = {}
+    print("%10s %8s %10s %10s %10s" % ("bricks", "mode", "mean (ms)", "p95 (ms)", "p99 (ms)"))
+    for numBricks in counts:
+        bricksDict, side = makeSyntheticBricksDict(numBricks)
+        rays = makeBenchmarkRays(side, numRays)
+        grid = _SyntheticBrickGrid(bricksDict)
+        results[numBricks] = {"GRID": summarize(_timeRays(grid.ray_cast, rays))}
+        if numBricks <= maxSceneBricks:
+            objs, mesh = _createBenchmarkScene(bricksDict)
+            try:
+                results[numBricks]["SCENE"] = summarize(_timeRays(_sceneRayCast, rays))
+            finally:
+                delete(objs)
+                bpy.data.meshes.remove(mesh)
+        for mode, stats in results[numBricks].items():
+            print("%10d %8s %10.4f %10.4f %10.4f" % (numBricks, mode, stats["mean"], stats["p95"], stats["p99"]))
+    return results
+
+
+class _BenchmarkEvent:
+    """ stand-in for a plain (no modifier keys) mouse move event """
+    type = "MOUSEMOVE"
+    value = "NOTHING"
+    alt = shift = ctrl = oskey = False
+    mouse_x = mouse_y = mouse_region_x = mouse_region_y = 0
+
+
+def _getTopFaceHits(sculptOp, numHits:int):
+    """ hover states on the top faces of bricks with nothing drawn above them """
+    grid = sculptOp.getGridEngine()
+    up = Vector(grid.normalMatrix @ np.array((0, 0, 1 / grid.spacing[2]))).normalized()
+    hits = []
+    for key, brickD in sculptOp.bricksDict.items():
+        if not brickD["draw"] or brickD["parent"] != "self":
+            continue
+        loc = getDictLoc(sculptOp.bricksDict, key)
+        size = brickD["size"]
+        aboveD = sculptOp.bricksDict.get("%d,%d,%d" % (loc[0], loc[1], loc[2] + size[2]))
+        obj = bpy.data.objects.get(brickD["name"])
+        if (aboveD is not None and aboveD["draw"]) or obj is None:
+            continue
+        top = grid.toWorld(np.array((loc[0] + 0.5, loc[1] + 0.5, loc[2] + size[2]), dtype=np.float64))
+        hits.append((obj, top, up, key, loc, size))
+        if len(hits) == numHits:
+            break
+    return hits
+
+
+def benchmarkStrokeCommit(sculptOp, numCells:int=100):
+    """ compare per-stroke wall time of DRAW strokes adding bricks immediately vs. deferred to release
+
+    'sculptOp' is a running BrickSculpt operator (the bricks added by the benchmark
+    are committed to its model). Each stroke adds bricks on top of 'numCells'
+    different exposed bricks, with a scene update after every simulated event.
+    """
+    scn, cm, n = getActiveContextInfo()
+    hits = _getTopFaceHits(sculptOp, numCells * 2)
+    deferStrokeCommit = sculptOp.deferStrokeCommit
+    event = _BenchmarkEvent()
+    results = {}
+    try:
+        for deferred, strokeHits in ((False, hits[:numCells]), (True, hits[numCells:])):
+            sculptOp.deferStrokeCommit = deferred
+            t0 = time.perf_counter()
+            for obj, loc, normal, key, curLoc, size in strokeHits:
+                sculptOp.obj, sculptOp.loc, sculptOp.normal = obj, loc, normal
+                if not sculptOp.deferStrokeAction("ADD", event, key, curLoc, size):
+                    sculptOp.addBrick(cm, n, key, curLoc, size)
+                _updateScene()
+            sculptOp.commitStrokeTransaction(cm, n)
+            _updateScene()
+            results["DEFERRED" if deferred else "IMMEDIATE"] = (time.perf_counter() - t0) * 1000
+    finally:
+        sculptOp.deferStrokeCommit = deferStrokeCommit
+    for mode, ms in results.items():
+        print("%10s stroke over %d cells: %10.2f ms" % (mode, len(hits) // 2, ms))
+    return results
+
+
+class _ReplayRegion:
+    type = "WINDOW"
+
+    def __init__(self):
+        self.x = self.y = 0
+        self.width, self.height = 1920, 1080
+
+
+class _ReplayRegionView3D:
+    """ view matrices of the recorded viewport """
+
+    def __init__(self):
+        self.view_matrix = Matrix.Identity(4)
+        self.perspective_matrix = Matrix.Identity(4)
+        self.view_perspective = "PERSP"
+        self.is_perspective = True
+
+
+class _ReplaySpace:
+    type = "VIEW_3D"
+    region_quadviews = ()
+
+    def __init__(self, rv3d):
+        self.region_3d = rv3d
+
+
+class _ReplaySpaces:
+    def __init__(self, space):
+        self.active = space
+
+
+class _ReplayArea:
+    type = "VIEW_3D"
+
+    def __init__(self, region, space):
+        self.regions = [region]
+        self.spaces = _ReplaySpaces(space)
+
+    def header_text_set(self, *args, **kwargs):
+        pass
+
+
+class _ReplayScreen:
+    def __init__(self, area):
+        self.areas = [area]
+
+    def as_pointer(self):
+        return id(self)
+
+
+class _ReplayWindow:
+    def __init__(self, screen):
+        self.screen = screen
+
+    def cursor_set(self, cursor):
+        pass
+
+
+class _ReplayWindowManager:
+    def event_timer_add(self, time_step, window=None):
+        return object()
+
+    def event_timer_remove(self, timer):
+        pass
+
+
+class ReplayContext:
+    """ stand-in for the context of the recorded 3D viewport (needs no window, so it works in background mode) """
+
+    def __init__(self):
+        self.region = _ReplayRegion()
+        self.region_data = _ReplayRegionView3D()
+        self.space_data = _ReplaySpace(self.region_data)
+        self.area = _ReplayArea(self.region, self.space_data)
+        self.screen = _ReplayScreen(self.area)
+        self.window = _ReplayWindow(self.screen)
+        self.window_manager = _ReplayWindowManager()
+        self.scene = bpy.context.scene
+        self.view_layer = bpy.context.view_layer if b280() else None
+
+    def setView(self, view:dict):
+        """ apply view stored with a recorded event """
+        self.region.x, self.region.y, self.region.width, self.region.height = view["region"]
+        self.region_data.view_matrix = Matrix(view["view_matrix"])
+        self.region_data.perspective_matrix = Matrix(view["perspective_matrix"])
+        self.region_data.view_perspective = view["view_perspective"]
+        self.region_data.is_perspective = view["is_perspective"]
+
+
+def replaySession(sculptOp, filepath:str, realTime:bool=True):
+    """ feed events recorded by EventRecorder into sculptOp.modal; returns per-event latencies (in ms) by mode
+
+    'sculptOp' is an initialized BrickSculpt operator for the recorded model.
+    Its bricksDict is replaced by the one saved with the recording (if any).
+    With 'realTime', events are fed at their recorded pace so mouse move
+    coalescing behaves as it did in the session. Otherwise they are fed
+    back to back.
+    """
+    mode, bricksDict, events = loadEventRecording(filepath)
+    context = ReplayContext()
+    sculptOp.mode = mode
+    if bricksDict is not None:
+        sculptOp.bricksDict = bricksDict
+    times = {}
+    t0 = time.perf_counter()
+    for event in events:
+        if event.view is not None:
+            context.setView(event.view)
+        if realTime:
+            time.sleep(max(0, event.time - (time.perf_counter() - t0)))
+        curMode = sculptOp.mode
+        t1 = time.perf_counter()
+        result = sculptOp.modal(context, event)
+        times.setdefault(curMode, []).append((time.perf_counter() - t1) * 1000)
+        if result & {"FINISHED", "CANCELLED"}:
+            break
+    return times
+
+
+def benchmarkReplay(sculptOp, filepaths:iter, realTime:bool=True):
+    """ replay recorded sessions (e.g. one each of DRAW, PAINT and MERGE/SPLIT) and report latency per event by mode """
+    results = {}
+    print("%30s %12s %8s %10s %10s %10s %10s" % ("recording", "mode", "events", "p50 (ms)", "p95 (ms)", "p99 (ms)", "mean (ms)"))
+    for filepath in filepaths:
+        times = replaySession(sculptOp, filepath, realTime=realTime)
+        results[filepath] = {mode: summarize(t) for mode, t in times.items()}
+        for mode, stats in results[filepath].items():
+            print("%30s %12s %8d %10.4f %10.4f %10.4f %10.4f" % (os.path.basename(filepath)[-30:], mode, len(times[mode]), stats["p50"], stats["p95"], stats["p99"], stats["mean"]))
+    return results
+
+
+def getTopView(region:tuple=(0, 0, 1920, 1080), pixelsPerCell:int=10):
+    """ view (as stored by EventRecorder) of an orthographic viewport looking down on the grid, with cell x,y under pixel x,y * pixelsPerCell """
+    width, height = region[2], region[3]
+    a, b = width / (2 * pixelsPerCell), height / (2 * pixelsPerCell)
+    # inverse of the perspective matrix maps normalized device coordinates to world space (rays start at z=100)
+    persInv = Matrix(((a, 0, 0, a), (0, b, 0, b), (0, 0, -50, 50), (0, 0, 0, 1)))
+    return {"region": list(region), "view_matrix": [list(row) for row in Matrix.Identity(4)],
+            "perspective_matrix": [list(row) for row in persInv.inverted()], "view_perspective": "ORTHO", "is_perspective": False}
+
+
+def makeStrokeRecording(filepath:str, mode:str, side:int=32, numStrokes:int=8, pixelsPerCell:int=10, eventInterval:float=1 / 120):
+    """ write EventRecorder file of 'numStrokes' left to right strokes in mode over a side x side layer of 1x1 bricks, seen from getTopView()
+
+    For replaying without a recorded session (e.g. benchmarking on a machine
+    without Blender). Each stroke is followed by a timer event, as merges
+    queued on release are applied on the events after it.
+    """
+    scn, cm, n = getActiveContextInfo()
+    bricksDict = {}
+    for x in range(side):
+        for y in range(side):
+            for z in range(2):
+                key = "%(x)s,%(y)s,%(z)s" % locals()
+                bricksDict[key] = {"name": "Bricker_%(n)s__%(key)s" % locals(), "draw": z == 0, "parent": "self" if z == 0 else None,
+                                   "size": [1, 1, 1], "mat_name": "ABS Plastic Red", "co": [x, y, z], "type": "BRICK"}
+    recorder = EventRecorder(mode, bricksDict)
+    view = getTopView(pixelsPerCell=pixelsPerCell)
+    def addEvent(type, value, x, y):
+        data = {"type": type, "value": value, "alt": False, "shift": False, "ctrl": False, "oskey": False,
+                "mouse_x": x * pixelsPerCell, "mouse_y": y * pixelsPerCell, "mouse_region_x": x * pixelsPerCell, "mouse_region_y": y * pixelsPerCell,
+                "time": len(recorder.events) * eventInterval}
+        if not recorder.events:
+            data["view"] = view
+        recorder.events.append(data)
+    for i in range(numStrokes):
+        y = (i * 2) % side
+        addEvent("MOUSEMOVE", "NOTHING", 0, y)
+        addEvent("LEFTMOUSE", "PRESS", 0, y)
+        for x in range(1, side):
+            addEvent("MOUSEMOVE", "NOTHING", x, y)
+        addEvent("LEFTMOUSE", "RELEASE", side - 1, y)
+        addEvent("TIMER", "NOTHING", side - 1, y)
+    recorder.save(filepath)
+    return filepath
+
+
+def benchmarkNeighborLookups(counts:iter=(10000, 100000, 1000000), numLookups:int=100000, seed:int=0):
+    """ compare face neighbor lookups with 'x,y,z' string keys against packed int keys (no Blender data needed) """
+    results = {}
+    print("%10s %8s %14s" % ("bricks", "keys", "per cell (us)"))
+    for numBricks in counts:
+        bricksDict, side = makeSyntheticBricksDict(numBricks)
+        keys = random.Random(seed).sample(list(bricksDict.keys()), min(numLookups, numBricks))
+        packedDict = {strToPacked(k): v for k, v in bricksDict.items()}
+        packedKeys = [strToPacked(k) for k in keys]
+        # string keys are split and rebuilt for each neighbor
+        t0 = time.perf_counter()
+        for key in keys:
+            x, y, z = (int(c) for c in key.split(","))
+            for nx, ny, nz in ((x - 1, y, z), (x + 1, y, z), (x, y - 1, z), (x, y + 1, z), (x, y, z - 1), (x, y, z + 1)):
+                bricksDict.get("%(nx)s,%(ny)s,%(nz)s" % locals())
+        strTime = time.perf_counter() - t0
+        # packed keys only add offsets
+        t0 = time.perf_counter()
+        for key in packedKeys:
+            for offset in NEIGHBOR_OFFSETS:
+                packedDict.get(key + offset)
+        packedTime = time.perf_counter() - t0
+        results[numBricks] = {"STRING": strTime / len(keys) * 1e6, "PACKED": packedTime / len(keys) * 1e6}
+        for mode, us in results[numBricks].items():
+            print("%10d %8s %14.4f" % (numBricks, mode, us))
+    return results
+
+
+def _tracedBytes(buildFn):
+    """ returns (result of buildFn(), bytes allocated by it that are still in use) """
+    tracemalloc.start()
+    try:
+        result = buildFn()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmarkSessionStore(counts:iter=(10000, 100000, 1000000), numLookups:int=100000, seed:int=0):
+    """ compare memory and field lookups of a plain bricksDict against a ColumnarBricksDict (no Blender data needed) """
+    results = {}
+    print("%10s %9s %12s %16s" % ("bricks", "store", "memory (MB)", "per lookup (us)"))
+    for numBricks in counts:
+        def build():
+            bricksDict, side = makeSyntheticBricksDict(numBricks)
+            for brickD in bricksDict.values():
+                brickD.update({"size": [1, 1, 1], "mat_name": "ABS Plastic Red", "type": "BRICK"})
+            return bricksDict
+        bricksDict, dictBytes = _tracedBytes(build)
+        store, storeBytes = _tracedBytes(lambda: ColumnarBricksDict(bricksDict))
+        keys = random.Random(seed).sample(list(bricksDict.keys()), min(numLookups, numBricks))
+        results[numBricks] = {}
+        for mode, d, nbytes in (("DICT", bricksDict, dictBytes), ("COLUMNAR", store, storeBytes)):
+            t0 = time.perf_counter()
+            for key in keys:
+                d[key]["size"]
+                d[key]["draw"]
+            results[numBricks][mode] = {"MB": nbytes / 1e6, "us": (time.perf_counter() - t0) / len(keys) * 1e6}
+        # vectorized read of the same field over the looked up rows
+        t0 = time.perf_counter()
+        store.size[store.getRows(keys)]
+        results[numBricks]["COLUMNAR_VECTORIZED"] = {"MB": storeBytes / 1e6, "us": (time.perf_counter() - t0) / len(keys) * 1e6}
+        for mode, r in results[numBricks].items():
+            print("%10d %9s %12.1f %16.4f" % (numBricks, mode[:9], r["MB"], r["us"]))
+    return results
+
+
+def benchmarkPersistence(counts:iter=(10000, 100000, 1000000), numEdits:int=100, seed:int=0):
+    """ compare saving/loading bricksDict as JSON against binary memory-mapped files (no Blender data needed) """
+    results = {}
+    print("%10s %7s %10s %10s %14s %10s" % ("bricks", "format", "save (s)", "load (s)", "first edit (s)", "size (MB)"))
+    with tempfile.TemporaryDirectory() as tmpDir:
+        for numBricks in counts:
+            bricksDict, side = makeSyntheticBricksDict(numBricks)
+            for brickD in bricksDict.values():
+                brickD.update({"size": [1, 1, 1], "mat_name": "ABS Plastic Red", "type": "BRICK"})
+            keys = random.Random(seed).sample(list(bricksDict.keys()), min(numEdits, numBricks))
+            jsonPath = os.path.join(tmpDir, "bricksDict.json")
+            binPath = os.path.join(tmpDir, "bricksDict.bin")
+            results[numBricks] = {}
+            for fmt, path in (("JSON", jsonPath), ("BINARY", binPath)):
+                t0 = time.perf_counter()
+                if fmt == "JSON":
+                    with open(path, "w") as f:
+                        json.dump(bricksDict, f)
+                else:
+                    saveBricksDict(bricksDict, path)
+                saveTime = time.perf_counter() - t0
+                t0 = time.perf_counter()
+                if fmt == "JSON":
+                    with open(path, "r") as f:
+                        loaded = json.load(f)
+                else:
+                    loaded = loadBricksDict(path)
+                loadTime = time.perf_counter() - t0
+                # edit a few entries, as a short sculpt session would
+                t0 = time.perf_counter()
+                for key in keys:
+                    loaded[key]["mat_name"] = "ABS Plastic Blue"
+                    loaded[key]["size"] = [1, 1, 3]
+                editTime = time.perf_counter() - t0
+                results[numBricks][fmt] = {"save": saveTime, "load": loadTime, "edit": editTime, "MB": os.path.getsize(path) / 1e6}
+                del loaded
+            for fmt, r in results[numBricks].items():
+                print("%10d %7s %10.3f %10.3f %14.5f %10.1f" % (numBricks, fmt, r["save"], r["load"], r["edit"], r["MB"]))
+    return results
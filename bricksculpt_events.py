@@ -0,0 +1,159 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# System imports
+import json
+import time
+
+# Blender imports
+# NONE!
+
+# Addon imports
+# NONE!
+
+
+MOUSE_MOVE_EVENTS = ("MOUSEMOVE", "INBETWEEN_MOUSEMOVE")
+
+
+class CoalescedEvent:
+    """ timer event standing in for the mouse move events folded into it """
+
+    def __init__(self, event):
+        self._event = event
+        self.type = "MOUSEMOVE"
+        self.value = "NOTHING"
+
+    def __getattr__(self, attr):
+        # every event carries the current mouse position and modifier keys
+        return getattr(self._event, attr)
+
+
+class EventSnapshot:
+    """ copy of the event attributes read by the framework (safe to keep after the modal call returns) """
+
+    attrs = ("type", "value", "alt", "shift", "ctrl", "oskey", "mouse_x", "mouse_y", "mouse_region_x", "mouse_region_y")
+
+    def __init__(self, event):
+        for attr in self.attrs:
+            setattr(self, attr, getattr(event, attr))
+
+
+class MouseMoveCoalescer:
+    """ folds bursts of mouse move events into at most one update per frame budget
+
+    Moves arriving within 'frameBudget' seconds of the last processed move are
+    dropped and the most recent one is replayed on the next timer tick instead.
+    """
+
+    def __init__(self, frameBudget:float=1 / 60):
+        self.frameBudget = frameBudget
+        self.lastProcessTime = 0
+        self.pending = False
+        self.timer = None
+        self.numReceived = 0
+        self.numProcessed = 0
+
+    def start(self, context):
+        """ add timer used to flush pending mouse moves (and to drive other deferred work) """
+        if self.timer is None:
+            self.timer = context.window_manager.event_timer_add(self.frameBudget or 1 / 60, window=context.window)
+
+    def stop(self, context):
+        if self.timer is not None:
+            context.window_manager.event_timer_remove(self.timer)
+            self.timer = None
+
+    def filter(self, event):
+        """ returns event to process now, or None if it was folded into a later update """
+        if event.type in MOUSE_MOVE_EVENTS:
+            self.numReceived += 1
+            now = time.perf_counter()
+            if now - self.lastProcessTime < self.frameBudget:
+                self.pending = True
+                return None
+        elif event.type == "TIMER":
+            if not self.pending:
+                return None
+            now = time.perf_counter()
+            event = CoalescedEvent(event)
+        else:
+            return event
+        self.pending = False
+        self.lastProcessTime = now
+        self.numProcessed += 1
+        return event
+
+
+class EventRecorder:
+    """ records the events (and view changes) of a sculpt session for replaying it later
+
+    Each event is stored with the EventSnapshot attributes and its time in
+    seconds since the recorder was created. The region size and view matrices
+    are stored with the first event and again whenever they change.
+    """
+
+    version = 1
+
+    def __init__(self, mode:str, bricksDict:dict=None):
+        self.mode = mode
+        # copied now, since the session edits bricksDict in place
+        self.bricksDict = json.loads(json.dumps(bricksDict)) if bricksDict is not None else None
+        self.startTime = time.perf_counter()
+        self.events = []
+        self.lastView = None
+
+    def getView(self, context):
+        region, rv3d = context.region, context.region_data
+        if region is None or rv3d is None:
+            return None
+        return {
+            "region": [region.x, region.y, region.width, region.height],
+            "view_matrix": [list(row) for row in rv3d.view_matrix],
+            "perspective_matrix": [list(row) for row in rv3d.perspective_matrix],
+            "view_perspective": rv3d.view_perspective,
+            "is_perspective": rv3d.is_perspective,
+        }
+
+    def record(self, context, event):
+        data = {attr: getattr(event, attr) for attr in EventSnapshot.attrs}
+        data["time"] = time.perf_counter() - self.startTime
+        view = self.getView(context)
+        if view != self.lastView:
+            data["view"] = view
+            self.lastView = view
+        self.events.append(data)
+
+    def save(self, filepath:str):
+        with open(filepath, "w") as f:
+            json.dump({"version": self.version, "mode": self.mode, "bricksDict": self.bricksDict, "events": self.events}, f)
+
+
+class RecordedEvent:
+    """ event read back from an EventRecorder file ('time' and 'view' are set like the other attributes) """
+
+    def __init__(self, data:dict):
+        self.view = None
+        self.__dict__.update(data)
+
+
+def loadEventRecording(filepath:str):
+    """ read file written by EventRecorder.save; returns (mode, bricksDict, list of RecordedEvent) """
+    with open(filepath, "r") as f:
+        recording = json.load(f)
+    if recording.get("version") != EventRecorder.version:
+        raise ValueError("Unsupported event recording version: " + str(recording.get("version")))
+    return recording["mode"], recording["bricksDict"], [RecordedEvent(data) for data in recording["events"]]
@@ -16,33 +16,34 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # System imports
-# NONE!
+import os
+import numpy as np
 
 # Blender imports
 import bpy
-from bpy_extras.view3d_utils import region_2d_to_origin_3d, region_2d_to_vector_3d
 
 # Addon imports
 from ....lib.bricksDict.functions import *
 from ....functions.common.blender import *
+from .bricksculpt_autosave import *
+from .bricksculpt_events import *
+from .bricksculpt_interface import *
+from .bricksculpt_keys import *
+from .bricksculpt_layers import *
+from .bricksculpt_merge import *
+from .bricksculpt_occupancy import *
+from .bricksculpt_pool import *
+from .bricksculpt_profiling import *
+from .bricksculpt_raycast import *
+from .bricksculpt_session import *
+from .bricksculpt_store import *
 
 
 def get_quadview_index(context, x, y):
-    for area in context.screen.areas:
-        if area.type != 'VIEW_3D':
-            continue
-        is_quadview = len(area.spaces.active.region_quadviews) == 0
-        i = -1
-        for region in area.regions:
-            if region.type == 'WINDOW':
-                i += 1
-                if (x >= region.x and
-                    y >= region.y and
-                    x < region.width + region.x and
-                    y < region.height + region.y):
-
-                    return (area.spaces.active, None if is_quadview else i)
-    return (None, None)
+    """ get space and quadview index of the VIEW_3D region under window coordinate x,y """
+    if not hasattr(get_quadview_index, "regionIndex"):
+        get_quadview_index.regionIndex = RegionIndex()
+    return get_quadview_index.regionIndex.lookup(context.screen, x, y)
 
 
 class bricksculpt_framework:
@@ -52,31 +53,79 @@ class bricksculpt_framework:
     # Blender Operator methods
 
     def modal(self, context, event):
+        # Bricker's tools hold entries across other lookups, so no chunk of a chunked session store is evicted mid-event
+        if isinstance(self.bricksDict, ChunkedBricksDict):
+            with self.bricksDict.pinned():
+                return self.modalEvent(context, event)
+        return self.modalEvent(context, event)
+
+    def modalEvent(self, context, event):
         try:
+            # move the active model's bricksDict into the columnar (or chunked) session store
+            if (self.columnarBricksDict or self.chunkedBricksDict) and not isinstance(self.bricksDict, (ColumnarBricksDict, ChunkedBricksDict)):
+                self.loadSessionStore(self.storeBuildBudget if self.spreadStoreBuild else None)
+
+            # recycle bricks deleted by Bricker's actions through the object pool
+            if self.poolBrickObjects and self.brickPool is None:
+                self.getBrickPool()
+
+            # record raw events for replaying the session later
+            if self.recordEventsTo is not None:
+                self.getEventRecorder().record(context, event)
+
+            # apply merges queued on stroke release a few groups per event
+            if self.mergeQueue is not None and self.mergeQueue.busy() and not self.left_click:
+                self.applyQueuedMerges()
+
+            # push header/cursor changes held back since the last frame
+            if self.uiPresenter is not None:
+                self.uiPresenter.flush()
+
+            # fold bursts of mouse moves into at most one update per frame
+            event = self.getEventCoalescer(context).filter(event)
+            if event is None:
+                return {"PASS_THROUGH"}
+
+            # Blender sets its own cursor outside the region, so push the UI state again when the mouse enters or leaves it
+            inRegion = 0 <= event.mouse_region_x < context.region.width and 0 <= event.mouse_region_y < context.region.height
+            if inRegion != self.mouseInRegion:
+                self.mouseInRegion = inRegion
+                if self.uiPresenter is not None:
+                    self.uiPresenter.reset()
+
             # commit changes on 'ret' key press
             if (event.type == "RET" or (event.type == "ESC" and self.layerSolod is None)) and event.value == "PRESS":
-                bpy.context.window.cursor_set("DEFAULT")
+                context.window.cursor_set("DEFAULT")
+                scn, cm, n = getActiveContextInfo()
+                self.commitStrokeTransaction(cm, n)
+                if self.mergeQueue is not None:
+                    self.applyQueuedMerges(wait=True)
                 self.cancel(context)
-                self.commitChanges()
+                self.commitSessionChanges()
                 return{"FINISHED"}
 
-            # block undo action
+            # run session undo/redo instead of global undo
             if event.type == "Z" and (event.ctrl or event.oskey):
+                if event.value == "PRESS" and not self.left_click:
+                    # finish the last stroke's queued merges, so its undo step is complete
+                    if self.mergeQueue is not None:
+                        self.applyQueuedMerges(wait=True)
+                    self.undoSculpt(redo=event.shift)
                 return {"RUNNING_MODAL"}
 
             # switch mode
             if not self.left_click and event.value == "PRESS":
                 if event.type == "D" and self.mode != "DRAW":
                     self.mode = "DRAW"
-                    self.addedBricks = []
-                    tag_redraw_areas("VIEW_3D")
+                    self.getStrokeState().clear(("addedBricks",))
+                    self.tagRedraw()
                 elif event.type == "M" and self.mode != "MERGE/SPLIT":
                     self.mode = "MERGE/SPLIT"
-                    self.addedBricks = []
-                    tag_redraw_areas("VIEW_3D")
+                    self.getStrokeState().clear(("addedBricks",))
+                    self.tagRedraw()
                 elif event.type == "P" and self.mode != "PAINT":
                     self.mode = "PAINT"
-                    tag_redraw_areas("VIEW_3D")
+                    self.tagRedraw()
 
             # check if function key pressed
             if event.type in ("LEFT_CTRL", "RIGHT_CTRL") and event.value == "PRESS":
@@ -93,7 +142,7 @@ class bricksculpt_framework:
             if (self.layerSolod is not None and
                 ((event.type == "ESC" and event.value == "PRESS") or
                  (event.type in ("LEFT_CTRL", "RIGHT_CTRL") and event.value == "RELEASE" and (time.time() - self.ctrlClickTime < 0.2)))):
-                self.unSoloLayer()
+                self.unSoloBrickLayer()
                 self.layerSolod = None
                 self.possibleCtrlDisable = False
                 return {"RUNNING_MODAL"}
@@ -101,16 +150,26 @@ class bricksculpt_framework:
             # check if left_click is pressed
             if event.type == "LEFTMOUSE":
                 if event.value == "PRESS":
+                    # finish the last stroke's queued merges before its undo step is closed
+                    if self.mergeQueue is not None:
+                        self.applyQueuedMerges(wait=True)
                     self.left_click = True
+                    self.lastStrokeLoc = None
+                    # re-push UI state in case Blender changed it since the last push
+                    self.getUIPresenter().reset()
+                    self.getUIPresenter().beginStroke()
                     # block left_click if not in 3D viewport
                     space, i = get_quadview_index(context, event.mouse_x, event.mouse_y)
                     if space is None:
                         return {"RUNNING_MODAL"}
                 elif event.value == "RELEASE":
                     self.left_click = False
+                    self.lastStrokeLoc = None
+                    self.getUIPresenter().endStroke()
                     self.releaseTime = time.time()
                     # clear bricks added from delete's auto update
-                    self.addedBricksFromDelete = []
+                    self.getStrokeState().endStroke()
+                    self.getStrokeState().clear(("addedBricksFromDelete",))
 
             # cast ray to calculate mouse position and travel
             if event.type in ('MOUSEMOVE', 'LEFT_CTRL', 'RIGHT_CTRL') or self.left_click:
@@ -121,50 +180,25 @@ class bricksculpt_framework:
                 # self.update_ui_mouse_pos()
                 # run solo layer functionality
                 if event.ctrl and (not self.left_click or event.type in ("LEFT_CTRL", "RIGHT_CTRL")) and not (self.possibleCtrlDisable and time.time() - self.ctrlClickTime < 0.2) and self.mouseTravel > 10 and time.time() > self.releaseTime + 0.75:
-                    if len(self.hiddenBricks) > 0:
-                        self.unSoloLayer()
-                        self.hover_scene(context, self.mouse.x, self.mouse.y, n, update_header=self.left_click)
+                    if self.layerIndex is not None and self.layerIndex.soloed is not None:
+                        # pick brick in any layer without showing the layers hidden by solo
+                        self.hover_scene(context, self.mouse.x, self.mouse.y, n, update_header=self.left_click, includeHidden=True)
                     if self.obj is not None:
                         self.lastMouse = self.mouse
-                        curKey = getDictKey(self.obj.name)
-                        curLoc = getDictLoc(self.bricksDict, curKey)
-                        objSize = self.bricksDict[curKey]["size"]
-                        self.layerSolod = self.soloLayer(cm, curKey, curLoc, objSize)
+                        curKey, curLoc, objSize = self.resolveBrick(self.obj)
+                        self.layerSolod = self.soloBrickLayer(curLoc[2])
                 elif self.obj is None:
-                    bpy.context.window.cursor_set("DEFAULT")
+                    self.getUIPresenter().setCursor(context.window, "DEFAULT")
                     return {"RUNNING_MODAL"}
                 else:
-                    bpy.context.window.cursor_set("PAINT_BRUSH")
+                    self.getUIPresenter().setCursor(context.window, "PAINT_BRUSH")
 
             # draw/remove bricks on left_click & drag
             if self.left_click and (event.type == 'LEFTMOUSE' or (event.type == "MOUSEMOVE" and (not event.alt or self.mouseTravel > 5))):
-                # determine which action (if any) to run at current mouse position
-                addBrick = not (event.alt or event.shift or self.obj.name in self.keysToMergeOnRelease) and self.mode == "DRAW"
-                removeBrick = self.mode == "DRAW" and (event.alt or event.shift) and self.mouseTravel > 10
-                changeMaterial = self.obj.name not in self.addedBricks and self.mode == "PAINT"
-                splitBrick = self.mode == "MERGE/SPLIT" and (event.alt or event.shift)
-                mergeBrick = self.obj.name not in self.addedBricks and self.mode == "MERGE/SPLIT" and not event.alt
-                # get key/loc/size of brick at mouse position
-                if addBrick or removeBrick or changeMaterial or splitBrick or mergeBrick:
-                    self.lastMouse = self.mouse
-                    curKey = getDictKey(self.obj.name)
-                    curLoc = getDictLoc(self.bricksDict, curKey)
-                    objSize = self.bricksDict[curKey]["size"]
-                # add brick next to existing brick
-                if addBrick and self.bricksDict[curKey]["name"] not in self.addedBricks:
-                    self.addBrick(cm, n, curKey, curLoc, objSize)
-                # remove existing brick
-                elif removeBrick:
-                    self.removeBrick(cm, n, event, curKey, curLoc, objSize)
-                # change material
-                elif changeMaterial and self.bricksDict[curKey]["mat_name"] != self.matName:
-                    self.changeMaterial(cm, n, curKey, curLoc, objSize)
-                # split current brick
-                elif splitBrick:
-                    self.splitBrick(cm, event, curKey, curLoc, objSize)
-                # add current brick to 'self.keysToMerge'
-                elif mergeBrick:
-                    self.mergeBrick(cm, n, curKey, curLoc, objSize, mode=self.mode, state="DRAG")
+                # run action on bricks in grid cells skipped between the last processed and current mouse positions
+                if event.type == "MOUSEMOVE" and self.mode in ("DRAW", "PAINT"):
+                    self.resampleStroke(cm, n, event)
+                self.runStrokeAction(cm, n, event)
                 return {"RUNNING_MODAL"}
 
             # clean up after splitting bricks
@@ -174,11 +208,30 @@ class bricksculpt_framework:
             # merge bricks in 'self.keysToMerge'
             if event.type == "LEFTMOUSE" and event.value == "RELEASE" and self.mode in ("DRAW", "MERGE/SPLIT"):
                 scn, cm, n = getActiveContextInfo()
-                self.mergeBrick(cm, n, mode=self.mode, state="RELEASE")
+                self.commitStrokeTransaction(cm, n)
+                mergedKeys = [getDictKey(name) for name in self.keysToMergeOnRelease]
+                if self.spreadMerge:
+                    # merge groups of touching bricks on later events
+                    self.getMergeQueue().submit(self.bricksDict, mergedKeys, self.mode)
+                    self.getStrokeState().clear(("keysToMergeOnRelease",))
+                else:
+                    self.getUndoJournal().capture(self.bricksDict, mergedKeys)
+                    with self.timePhase("mergeBrick"):
+                        self.mergeBrick(cm, n, mode=self.mode, state="RELEASE")
+                    self.recordEdit("merged", mergedKeys)
+                    if self.bvhEngine is not None:
+                        self.bvhEngine.markDirty(mergedKeys)
+
+            # close undo step for the finished stroke (after its queued merges, if any)
+            if event.type == "LEFTMOUSE" and event.value == "RELEASE":
+                if self.mergeQueue is None or not self.mergeQueue.busy():
+                    self.getUndoJournal().end(self.bricksDict)
+                self.shareQueuedMeshes()
+                self.autosaveEdits()
 
             return {"PASS_THROUGH" if event.type.startswith("NUMPAD") or event.type in ("Z", "TRACKPADZOOM", "TRACKPADPAN", "MOUSEMOVE", "NDOF_BUTTON_PANZOOM", "INBETWEEN_MOUSEMOVE", "MOUSEROTATE", "WHEELUPMOUSE", "WHEELDOWNMOUSE", "WHEELINMOUSE", "WHEELOUTMOUSE") else "RUNNING_MODAL"}
         except:
-            bpy.context.window.cursor_set("DEFAULT")
+            context.window.cursor_set("DEFAULT")
             self.cancel(context)
             bricker_handle_exception()
             return {"CANCELLED"}
@@ -189,30 +242,139 @@ class bricksculpt_framework:
     BrickSculptInstalled = True
     BrickSculptLoaded = True
 
+    # ray cast against 'SCENE' (scene.ray_cast), 'BVH' (cached BVH over active model only)
+    # or 'GRID' (voxel marching through bricksDict occupancy)
+    rayCastMode = "BVH"
+    bvhEngine = None
+    gridEngine = None
+
+    # mouse moves are processed at most once per 'frameBudget' seconds (0 to disable)
+    frameBudget = 1 / 60
+    eventCoalescer = None
+    # bricks in grid cells skipped between processed mouse moves get the stroke action too, up to this many cells per move
+    maxStrokeResamples = 16
+    lastStrokeLoc = None
+
+    # bricks added by DRAW strokes are previewed during the stroke and committed to Bricker geometry on release
+    deferStrokeCommit = False
+    strokeTransaction = None
+    strokeProxies = None
+
+    # merge on release one group of touching bricks at a time, spending up to 'mergeFrameBudget'
+    # seconds per event (at least one group is merged per event, groups are cut to 'maxMergeKeys' bricks);
+    # the stroke's undo step stays open until its last group is merged
+    spreadMerge = True
+    mergeFrameBudget = 1 / 60
+    maxMergeKeys = 64
+    mergeQueue = None
+
+    # in-session undo/redo of bricksDict deltas (oldest steps dropped beyond these limits)
+    maxUndoSteps = 100
+    maxUndoBytes = 16 * 1024 * 1024
+    undoJournal = None
+
+    # bricksDict keys by layer, for soloing layers by toggling whole layers
+    layerIndex = None
+
+    # NumPy mirror of bricksDict occupancy for vectorized neighborhood queries (built on first use)
+    occupancyGrid = None
+
+    # brush radius in grid cells for DRAW/PAINT actions (0 acts on the brick under the mouse only), and its
+    # shape: 'SPHERE' or 'CYLINDER' (the layers of the brick under the mouse)
+    brushRadius = 0
+    brushShape = "SPHERE"
+
+    # keep bricksDict in a ColumnarBricksDict during the session (converted back to plain dicts on commit)
+    columnarBricksDict = False
+    modelBricksDict = None
+
+    # keep bricksDict in a ColumnarBricksDict, materializing plain dicts per spatial chunk on first access
+    # (chunks have 'bricksDictChunkSize' cells per side; beyond 'maxResidentChunks', least recently used chunks are evicted)
+    chunkedBricksDict = False
+    bricksDictChunkSize = 16
+    maxResidentChunks = 64
+
+    # copy bricksDict into the session store a slice of entries per event, spending up to 'storeBuildBudget'
+    # seconds per event (the plain bricksDict is used until the store is complete)
+    spreadStoreBuild = True
+    storeBuildBudget = 1 / 120
+    storeBuilder = None
+
+    # path of a journal that each stroke's bricksDict edits are appended to in the background, for
+    # recovering the session after a crash ('recoverAutosave'); None to disable autosave
+    autosaveTo = None
+    autosaveCompactEvery = 50
+    autosaveJournal = None
+    # whether 'recoverAutosave' replayed the journal this session (the journal is then continued instead of replaced)
+    autosaveRecovered = False
+
+    # path to save the session's events to (for replay benchmarks); None to disable recording
+    recordEventsTo = None
+    eventRecorder = None
+
+    # time phases of the modal loop (report printed and exported to 'profileExportTo', if set, when the session ends)
+    profilePhases = False
+    profileExportTo = None
+    profiler = None
+
+    # recycle removed brick objects instead of deleting them (up to 'maxPooledBricks')
+    poolBrickObjects = True
+    maxPooledBricks = 256
+    brickPool = None
+
+    # link bricks with identical geometry to one mesh (up to 'maxSharedMeshes' brick signatures)
+    shareBrickMeshes = True
+    maxSharedMeshes = 128
+    meshCache = None
+
+    # commit only the cells edited this session ('editedKeys') and their neighbors, instead of running
+    # Bricker's 'commitChanges' over the whole model
+    incrementalCommit = True
+    editedKeys = None
+
+    # cached brick object name -> (key, loc, size) lookups
+    brickResolver = None
+
+    # brick names and keys collected during strokes (check 'strokeState.lastStroke' for set sizes)
+    strokeState = None
+
+    # header text and cursor shape, pushed only when changed
+    uiPresenter = None
+    mouseInRegion = None
+
+    # inverted view matrices for mouse rays, recomputed only when the view changes
+    viewRayCache = None
+
     #############################################
     # class methods
 
     # from CG Cookie's retopoflow plugin
-    def hover_scene(self, context, x, y, source_name, update_header=True):
-        """ casts ray through point x,y and sets self.obj if obj intersected """
+    def hover_scene(self, context, x, y, source_name, update_header=True, includeHidden=False):
+        """ casts ray through point x,y and sets self.obj if obj intersected (hidden bricks only hit if 'includeHidden') """
         scn = context.scene
         self.region = context.region
         self.r3d = context.space_data.region_3d
         # TODO: Use custom view layer with only current model instead?
-        if b280(): view_layer = bpy.context.window.view_layer
+        if b280(): view_layer = context.view_layer
         rv3d = context.region_data
         if rv3d is None:
             return None
         coord = x, y
         ray_max = 1000000  # changed from 10000 to 1000000 to increase accuracy
-        view_vector = region_2d_to_vector_3d(self.region, rv3d, coord)
-        ray_origin = region_2d_to_origin_3d(self.region, rv3d, coord)
+        ray_origin, view_vector = self.getViewRayCache().getRay(self.region, rv3d, coord)
         ray_target = ray_origin + (view_vector * ray_max)
 
-        if b280():
-            result, loc, normal, idx, obj, mx = scn.ray_cast(view_layer, ray_origin, ray_target)
-        else:
-            result, loc, normal, idx, obj, mx = scn.ray_cast(ray_origin, ray_target)
+        with self.timePhase("rayCast"):
+            if includeHidden:
+                result, loc, normal, idx, obj, mx = self.getGridEngine().ray_cast(ray_origin, view_vector, ray_max, includeHidden=True)
+            elif self.rayCastMode == "BVH":
+                result, loc, normal, idx, obj, mx = self.getRayEngine().ray_cast(ray_origin, view_vector, ray_max)
+            elif self.rayCastMode == "GRID":
+                result, loc, normal, idx, obj, mx = self.getGridEngine().ray_cast(ray_origin, view_vector, ray_max)
+            elif b280():
+                result, loc, normal, idx, obj, mx = scn.ray_cast(view_layer, ray_origin, ray_target)
+            else:
+                result, loc, normal, idx, obj, mx = scn.ray_cast(ray_origin, ray_target)
 
         if result and obj.name.startswith('Bricker_' + source_name):
             self.obj = obj
@@ -222,10 +384,649 @@ class bricksculpt_framework:
             self.obj = None
             self.loc = None
             self.normal = None
-            if b280():
-                context.area.header_text_set(text=None)
+            self.getUIPresenter().setHeader(context.area, None)
+
+    def getRayEngine(self):
+        """ get BVH ray cast engine for active model (built on first use) """
+        if self.bvhEngine is None or self.bvhEngine.bricksDict is not self.bricksDict:
+            self.bvhEngine = BrickBVH(self.bricksDict)
+        return self.bvhEngine
+
+    def getGridEngine(self):
+        """ get grid space ray cast engine for active model (built on first use) """
+        if self.gridEngine is None or self.gridEngine.bricksDict is not self.bricksDict:
+            self.gridEngine = BrickGrid(self.bricksDict, getModelMatrix(self.bricksDict))
+        return self.gridEngine
+
+    def getViewRayCache(self):
+        """ get view ray cache for this session (check 'hits'/'misses' to verify it holds during strokes) """
+        if self.viewRayCache is None:
+            self.viewRayCache = ViewRayCache()
+        return self.viewRayCache
+
+    def invalidateRayEngine(self):
+        """ rebuild all BVH chunks on next ray cast (e.g. after brick visibility changes) """
+        if self.bvhEngine is not None:
+            self.bvhEngine.invalidate()
+
+    def getLayerIndex(self):
+        if self.layerIndex is None or self.layerIndex.bricksDict is not self.bricksDict:
+            self.layerIndex = BrickLayerIndex(self.bricksDict)
+        return self.layerIndex
+
+    def loadSessionStore(self, budget=None):
+        """ move bricksDict into the session store (with a time budget, copy a slice of it per call and switch to the store once it is complete) """
+        if isinstance(self.bricksDict, ColumnarBricksDict):
+            store = self.bricksDict
+        else:
+            if self.storeBuilder is None:
+                self.storeBuilder = SessionStoreBuilder(self.bricksDict)
+            if not self.storeBuilder.step(budget):
+                return
+            # switch between strokes with no layer soloed, as the engines and layer index are rebuilt for the store
+            if budget is not None and (self.left_click or self.layerSolod is not None or (self.mergeQueue is not None and self.mergeQueue.busy())):
+                return
+            # copy entries edited since they were copied again, with the cells actions on them may have edited too
+            editedKeys = self.editedKeys or set()
+            keys = set(editedKeys)
+            for key in editedKeys:
+                if key in self.bricksDict:
+                    keys.update(self.getNeighborhoodKeys(getDictLoc(self.bricksDict, key), self.bricksDict[key]["size"]))
+            self.storeBuilder.refresh(keys | self.getParentKeys(k for k in keys if k in self.bricksDict))
+            store = self.storeBuilder.store
+            self.storeBuilder = None
+            # keep the model's bricksDict, so an incremental commit only writes the edited entries back into it
+            self.modelBricksDict = self.bricksDict
+        self.bricksDict = ChunkedBricksDict(store, self.bricksDictChunkSize, self.maxResidentChunks) if self.chunkedBricksDict else store
+
+    def getSessionStoreStats(self):
+        """ chunk residency and eviction stats of the chunked session store (None if not in use) """
+        return self.bricksDict.stats() if isinstance(self.bricksDict, ChunkedBricksDict) else None
+
+    def unloadSessionStore(self, keys=None):
+        """ switch back to a plain dict bricksDict (with 'keys', only their entries are copied into the model's bricksDict) """
+        if isinstance(self.bricksDict, (ColumnarBricksDict, ChunkedBricksDict)):
+            if keys is None or self.modelBricksDict is None:
+                self.bricksDict = self.bricksDict.toDict()
+            else:
+                store = getBackingStore(self.bricksDict)
+                for key in keys:
+                    row = store.getRow(key)
+                    if row is None:
+                        self.modelBricksDict.pop(key, None)
+                    else:
+                        self.modelBricksDict[key] = store.getEntryDict(row)
+                self.bricksDict = self.modelBricksDict
+        self.modelBricksDict = None
+
+    def getPlainBricksDict(self):
+        """ bricksDict as plain dicts (for serializing) """
+        return self.bricksDict.toDict() if isinstance(self.bricksDict, (ColumnarBricksDict, ChunkedBricksDict)) else self.bricksDict
+
+    def getOccupancyGrid(self):
+        if self.occupancyGrid is None or self.occupancyGrid.bricksDict is not self.bricksDict:
+            self.occupancyGrid = OccupancyGrid(self.bricksDict)
+        return self.occupancyGrid
+
+    def soloBrickLayer(self, z):
+        """ show only bricks in layer z (switching from another soloed layer only toggles those two layers) """
+        self.markLayersDirty(self.getLayerIndex().solo(z))
+        return z
+
+    def unSoloBrickLayer(self):
+        if self.layerIndex is not None:
+            self.markLayersDirty(self.layerIndex.unsolo())
+
+    def markLayersDirty(self, layers):
+        """ rebuild ray cast engine for bricks in layers whose visibility changed """
+        if self.bvhEngine is not None and layers:
+            self.bvhEngine.markDirty(key for z in layers for key in self.layerIndex.layers[z])
+
+    def getStrokeState(self):
+        if self.strokeState is None:
+            self.strokeState = StrokeState()
+        return self.strokeState
+
+    # stroke bookkeeping lives in 'strokeState' (lists assigned by Bricker are converted)
+    @property
+    def addedBricks(self):
+        return self.getStrokeState().addedBricks
+
+    @addedBricks.setter
+    def addedBricks(self, items):
+        self.getStrokeState().set("addedBricks", items)
+
+    @property
+    def addedBricksFromDelete(self):
+        return self.getStrokeState().addedBricksFromDelete
+
+    @addedBricksFromDelete.setter
+    def addedBricksFromDelete(self, items):
+        self.getStrokeState().set("addedBricksFromDelete", items)
+
+    @property
+    def keysToMergeOnRelease(self):
+        return self.getStrokeState().keysToMergeOnRelease
+
+    @keysToMergeOnRelease.setter
+    def keysToMergeOnRelease(self, items):
+        self.getStrokeState().set("keysToMergeOnRelease", items)
+
+    def runStrokeAction(self, cm, n, event):
+        """ run action for current mode (if any) on brick under the mouse """
+        if self.obj is None:
+            return
+        # determine which action (if any) to run at current mouse position
+        addBrick = not (event.alt or event.shift or self.obj.name in self.keysToMergeOnRelease) and self.mode == "DRAW"
+        removeBrick = self.mode == "DRAW" and (event.alt or event.shift) and self.mouseTravel > 10
+        changeMaterial = self.obj.name not in self.addedBricks and self.mode == "PAINT"
+        splitBrick = self.mode == "MERGE/SPLIT" and (event.alt or event.shift)
+        mergeBrick = self.obj.name not in self.addedBricks and self.mode == "MERGE/SPLIT" and not event.alt
+        # get key/loc/size of brick at mouse position
+        if addBrick or removeBrick or changeMaterial or splitBrick or mergeBrick:
+            self.lastMouse = self.mouse
+            with self.timePhase("keyLookup"):
+                curKey, curLoc, objSize = self.resolveBrick(self.obj)
+            self.lastStrokeLoc = curLoc
+            if self.brushRadius > 0 and (addBrick or removeBrick or changeMaterial):
+                self.runBrushAction(cm, n, event, "ADD" if addBrick else ("REMOVE" if removeBrick else "RECOLOR"), curLoc, objSize)
+                return
+            if addBrick or removeBrick or changeMaterial or splitBrick:
+                self.captureUndo(curLoc, objSize)
+        numAdded, numAddedFromDelete = len(self.addedBricks), len(self.addedBricksFromDelete)
+        edited = False
+        # add brick next to existing brick
+        if addBrick and getBrickField(self.bricksDict, curKey, "name") not in self.addedBricks:
+            if not self.deferStrokeAction("ADD", event, curKey, curLoc, objSize):
+                with self.timePhase("addBrick"):
+                    self.addBrick(cm, n, curKey, curLoc, objSize)
+                self.journalEdit("ADD", curLoc, objSize, numAdded, numAddedFromDelete)
+                edited = True
+        # remove existing brick
+        elif removeBrick:
+            with self.timePhase("removeBrick"):
+                self.removeBrick(cm, n, event, curKey, curLoc, objSize)
+            self.journalEdit("REMOVE", curLoc, objSize, numAdded, numAddedFromDelete)
+            edited = True
+        # change material
+        elif changeMaterial and getBrickField(self.bricksDict, curKey, "mat_name") != self.matName:
+            with self.timePhase("changeMaterial"):
+                self.changeMaterial(cm, n, curKey, curLoc, objSize)
+            self.journalEdit("RECOLOR", curLoc, objSize, numAdded, numAddedFromDelete)
+        # split current brick
+        elif splitBrick:
+            with self.timePhase("splitBrick"):
+                self.splitBrick(cm, event, curKey, curLoc, objSize)
+            self.journalEdit("SPLIT", curLoc, objSize, numAdded, numAddedFromDelete)
+            edited = True
+        # add current brick to 'self.keysToMerge'
+        elif mergeBrick:
+            with self.timePhase("mergeBrick"):
+                self.mergeBrick(cm, n, curKey, curLoc, objSize, mode=self.mode, state="DRAG")
+        # rebuild ray cast engine around bricks that changed
+        if self.bvhEngine is not None and edited:
+            self.bvhEngine.markDirtyAround(curLoc, objSize)
+
+    def runBrushAction(self, cm, n, event, action, curLoc, objSize):
+        """ run 'ADD'/'REMOVE'/'RECOLOR' action as one batch on the bricks in the brush around brick at curLoc
+
+        Undo state is captured once over the box covering the brush bricks and
+        their neighbors, and edits are journaled and marked dirty in the BVH
+        once for the batch (cells filled by 'ADD' are marked occupied as they
+        are filled, so later bricks in the batch don't fill them again). Bricks are read from the bricksDict by key; brick
+        objects are only looked up for bricks the action runs on.
+        """
+        with self.timePhase("brushSelect"):
+            brushKeys = self.getOccupancyGrid().getBricksInBrush(curLoc, self.brushRadius, self.brushShape, objSize[2])
+        if not brushKeys:
+            return
+        bricks = [(key, getDictLoc(self.bricksDict, key), getBrickField(self.bricksDict, key, "size")) for key in brushKeys]
+        self.getUndoJournal().capture(self.bricksDict, self.getBoxKeys(*self.getNeighborhoodBox(bricks)))
+        grid = self.getGridEngine() if action == "ADD" else None
+        hoverName, hoverLoc, hoverNormal = self.obj.name, self.loc, self.normal
+        hoverGridLoc = grid.toGrid(hoverLoc) if grid is not None else None
+        numAdded, numAddedFromDelete = len(self.addedBricks), len(self.addedBricksFromDelete)
+        edited = []
+        for key, brickLoc, brickSize in bricks:
+            # skip bricks replaced by earlier actions in this batch
+            if not getBrickField(self.bricksDict, key, "draw") or getBrickField(self.bricksDict, key, "parent") not in ("self", None):
+                continue
+            name = getBrickField(self.bricksDict, key, "name")
+            if action != "REMOVE" and name in self.addedBricks:
+                continue
+            if action == "RECOLOR" and getBrickField(self.bricksDict, key, "mat_name") == self.matName:
+                continue
+            brickSize = getBrickField(self.bricksDict, key, "size")
+            if action == "ADD":
+                # move the hit to the same face of this brick, and skip bricks already covered on that face
+                self.loc = grid.toWorld(hoverGridLoc + np.array(brickLoc) - np.array(curLoc))
+                cell, size = grid.getAdjacentCell(self.loc, hoverNormal, brickLoc, brickSize)
+                if self.getOccupancyGrid().isOccupied(cell):
+                    continue
+            self.obj = bpy.data.objects.get(name)
+            if self.obj is None:
+                continue
+            if action == "ADD" and self.deferStrokeAction(action, event, key, brickLoc, brickSize):
+                continue
+            if action == "ADD":
+                with self.timePhase("addBrick"):
+                    self.addBrick(cm, n, key, brickLoc, brickSize)
+                # the batch is journaled at its end, so mark the filled cell now for the bricks after this one
+                self.getOccupancyGrid().update(["%d,%d,%d" % tuple(cell)])
+            elif action == "REMOVE":
+                with self.timePhase("removeBrick"):
+                    self.removeBrick(cm, n, event, key, brickLoc, brickSize)
             else:
-                context.area.header_text_set()
+                with self.timePhase("changeMaterial"):
+                    self.changeMaterial(cm, n, key, brickLoc, brickSize)
+            edited.append((key, brickLoc, brickSize))
+        if edited:
+            self.journalEdits(action, edited, numAdded, numAddedFromDelete)
+            if self.bvhEngine is not None and action != "RECOLOR":
+                lo, hi = self.getBrickBox(edited)
+                self.bvhEngine.markDirtyAround(lo, [h - l for l, h in zip(lo, hi)])
+        # restore hover state (the hovered brick may have been removed)
+        self.obj = bpy.data.objects.get(hoverName)
+        self.loc, self.normal = hoverLoc, hoverNormal
+
+    def resampleStroke(self, cm, n, event):
+        """ run stroke action on bricks in the grid cells between the last stroke brick and the brick under the mouse (no extra ray casts) """
+        if self.lastStrokeLoc is None or self.obj is None:
+            return
+        grid = self.getGridEngine()
+        curKey, curLoc, objSize = self.resolveBrick(self.obj)
+        cells = grid.getLineCells(self.lastStrokeLoc, curLoc)[:self.maxStrokeResamples]
+        if not cells:
+            return
+        hoverName, hoverLoc, hoverNormal = self.obj.name, self.loc, self.normal
+        hoverGridLoc = grid.toGrid(hoverLoc)
+        lastName = None
+        for cell in cells:
+            name = grid.getBrickName("%d,%d,%d" % tuple(cell))
+            # skip empty cells and further cells of the brick just processed
+            if name is None or name == lastName:
+                continue
+            lastName = name
+            obj = grid.getVisibleBrick(name)
+            if obj is None:
+                continue
+            # move the hit by the offset of the cell, on the same face as the hit under the mouse
+            self.obj, self.loc, self.normal = obj, grid.toWorld(hoverGridLoc + np.array(cell) - np.array(curLoc)), hoverNormal
+            self.runStrokeAction(cm, n, event)
+        # restore hover state (the hovered brick may have been removed)
+        self.obj = bpy.data.objects.get(hoverName)
+        self.loc, self.normal = hoverLoc, hoverNormal
+
+    def deferStrokeAction(self, action, event, curKey, curLoc, objSize):
+        """ record 'ADD' action in stroke transaction instead of adding the brick (returns False if not deferred)
+
+        'REMOVE' actions aren't deferred: a brick hidden until release would let
+        ray casts pass through to the bricks behind it.
+        """
+        if not self.deferStrokeCommit or action != "ADD":
+            return False
+        if self.strokeTransaction is None:
+            self.strokeTransaction = StrokeTransaction()
+            self.strokeProxies = StrokeProxyDrawer()
+            self.strokeProxies.start()
+        grid = self.getGridEngine()
+        cell, size = grid.getAdjacentCell(self.loc, self.normal, curLoc, objSize)
+        if self.strokeTransaction.record(action, cell, self.obj.name, self.loc.copy(), self.normal.copy(), EventSnapshot(event), curKey, curLoc, objSize):
+            # preview added bricks with proxy boxes
+            self.strokeProxies.addBox(grid.getCellCorners(cell, size))
+            self.tagRedraw()
+        return True
+
+    def commitStrokeTransaction(self, cm, n):
+        """ add bricks recorded during the stroke to real Bricker geometry in one batch """
+        if not self.strokeTransaction:
+            return
+        lastHover = self.obj.name if self.obj is not None else None, self.loc, self.normal
+        for a in self.strokeTransaction.actions:
+            obj = bpy.data.objects.get(a.objName)
+            # skip actions on bricks replaced by earlier actions in this stroke
+            if obj is None:
+                continue
+            self.obj, self.loc, self.normal = obj, a.loc, a.normal
+            numAdded, numAddedFromDelete = len(self.addedBricks), len(self.addedBricksFromDelete)
+            self.captureUndo(a.curLoc, a.objSize)
+            with self.timePhase("addBrick"):
+                self.addBrick(cm, n, a.key, a.curLoc, a.objSize)
+            self.journalEdit(a.action, a.curLoc, a.objSize, numAdded, numAddedFromDelete)
+            if self.bvhEngine is not None:
+                self.bvhEngine.markDirtyAround(a.curLoc, a.objSize)
+        # restore hover state (the hovered brick may have been removed)
+        name, self.loc, self.normal = lastHover
+        self.obj = bpy.data.objects.get(name) if name is not None else None
+        self.strokeTransaction.clear()
+        self.strokeProxies.clear()
+        self.tagRedraw()
+
+    def getMergeQueue(self):
+        if self.mergeQueue is None:
+            self.mergeQueue = MergeQueue(self.maxMergeKeys)
+        return self.mergeQueue
+
+    def applyQueuedMerges(self, wait=False):
+        """ merge groups of bricks queued on release (within 'mergeFrameBudget' unless 'wait'), closing the stroke's undo step after the last one """
+        if not self.mergeQueue.busy():
+            return
+        scn, cm, n = getActiveContextInfo()
+        # mergeBrick merges the keys in 'self.keysToMergeOnRelease'
+        strokeKeys = self.keysToMergeOnRelease
+        for keys, mode in self.mergeQueue.pop(self.bricksDict, None if wait else self.mergeFrameBudget):
+            self.keysToMergeOnRelease = PackedKeySet(keys)
+            self.getUndoJournal().capture(self.bricksDict, keys)
+            with self.timePhase("mergeBrick"):
+                self.mergeBrick(cm, n, mode=mode, state="RELEASE")
+            self.recordEdit("merged", keys)
+            if self.bvhEngine is not None:
+                self.bvhEngine.markDirty(keys)
+        self.keysToMergeOnRelease = strokeKeys
+        if not self.mergeQueue.busy():
+            self.getUndoJournal().end(self.bricksDict)
+        self.shareQueuedMeshes()
+        self.autosaveEdits()
+        self.tagRedraw()
+
+    def resolveBrick(self, obj):
+        """ get (key, loc, size) of brick object (check 'brickResolver.stats()' for the cache hit rate) """
+        if self.brickResolver is None or self.brickResolver.bricksDict is not self.bricksDict:
+            self.brickResolver = BrickResolver(self.bricksDict)
+        return self.brickResolver.resolve(obj.name)
+
+    def recordEdit(self, kind, keys):
+        """ update session caches for keys edited by kind of edit, and queue bricks drawn at them for mesh sharing """
+        keys = list(keys)
+        if self.editedKeys is None:
+            self.editedKeys = set()
+        self.editedKeys.update(keys)
+        if self.brickResolver is not None:
+            self.brickResolver.invalidate(keys)
+        if self.occupancyGrid is not None:
+            self.occupancyGrid.update(keys)
+        if self.layerIndex is not None and self.layerIndex.soloed is not None and kind != "removed":
+            # bricks drawn in other layers than the soloed one stay hidden
+            self.markLayersDirty(self.layerIndex.hideOutsideSolo(keys))
+        if self.shareBrickMeshes and kind != "removed":
+            self.getMeshCache().queue(keys)
+        if self.autosaveTo is not None:
+            self.getAutosaveJournal().mark(keys)
+
+    def getMeshCache(self):
+        if self.meshCache is None:
+            self.meshCache = SharedMeshCache(self.maxSharedMeshes)
+        return self.meshCache
+
+    def shareQueuedMeshes(self):
+        """ switch bricks drawn since the last call to shared meshes of identical bricks """
+        if self.meshCache is not None and self.meshCache.pending:
+            scn, cm, n = getActiveContextInfo()
+            self.meshCache.shareMeshes(cm, self.bricksDict)
+
+    def journalEdit(self, action, curLoc, objSize, numAdded, numAddedFromDelete):
+        """ record keys edited by action on brick at curLoc ('numAdded*' are list lengths from before the action) """
+        self.journalEdits(action, [(None, curLoc, objSize)], numAdded, numAddedFromDelete)
+
+    def journalEdits(self, action, bricks, numAdded, numAddedFromDelete):
+        """ record keys edited by action on bricks, a list of (key, loc, size), in one batch ('numAdded*' are list lengths from before the batch) """
+        if action == "ADD":
+            self.recordEdit("added", [getDictKey(name) for name in self.addedBricks[numAdded:]])
+            return
+        brickKeys = [k for key, loc, size in bricks for k in self.getBoxKeys(loc, [c + s for c, s in zip(loc, size)])]
+        if action == "REMOVE":
+            self.recordEdit("removed", brickKeys)
+            # Bricker redraws exposed bricks around the removed ones, not only those in 'addedBricksFromDelete'
+            self.recordEdit("redrawn", [k for k in self.getBoxKeys(*self.getNeighborhoodBox(bricks)) if k in self.bricksDict])
+        elif action == "RECOLOR":
+            self.recordEdit("recolored", brickKeys)
+        elif action == "SPLIT":
+            self.recordEdit("split", brickKeys)
+
+    def getUndoJournal(self):
+        if self.undoJournal is None:
+            self.undoJournal = UndoJournal(self.maxUndoSteps, self.maxUndoBytes)
+        return self.undoJournal
+
+    def getNeighborhoodKeys(self, curLoc, objSize):
+        """ keys of cells an action on brick at curLoc may edit (the brick and its neighbors) """
+        return self.getBoxKeys(*self.getNeighborhoodBox([(None, curLoc, objSize)]))
+
+    def getNeighborhoodBox(self, bricks):
+        """ (min, max) corners of the box of cells actions on bricks, a list of (key, loc, size), may edit """
+        lo = [min(loc[0] - 1 for key, loc, size in bricks), min(loc[1] - 1 for key, loc, size in bricks), min(loc[2] - size[2] for key, loc, size in bricks)]
+        hi = [max(loc[0] + size[0] + 1 for key, loc, size in bricks), max(loc[1] + size[1] + 1 for key, loc, size in bricks), max(loc[2] + 2 * size[2] for key, loc, size in bricks)]
+        return lo, hi
+
+    def getBrickBox(self, bricks):
+        """ (min, max) corners of the box of cells covered by bricks, a list of (key, loc, size) """
+        return [min(loc[i] for key, loc, size in bricks) for i in range(3)], [max(loc[i] + size[i] for key, loc, size in bricks) for i in range(3)]
+
+    def getBoxKeys(self, lo, hi):
+        """ keys of cells from corner lo up to (not including) corner hi """
+        return ["%d,%d,%d" % (x, y, z) for x in range(lo[0], hi[0]) for y in range(lo[1], hi[1]) for z in range(lo[2], hi[2])]
+
+    def captureUndo(self, curLoc, objSize):
+        """ capture undo state of cells an action on brick at curLoc may edit """
+        self.getUndoJournal().capture(self.bricksDict, self.getNeighborhoodKeys(curLoc, objSize))
+
+    def getParentKeys(self, keys):
+        """ get keys of drawn parent bricks for cells at keys """
+        parentKeys = set()
+        for key in keys:
+            brickD = self.bricksDict[key]
+            if brickD["draw"]:
+                parentKeys.add(key if brickD["parent"] == "self" else brickD["parent"])
+        return parentKeys
+
+    def getBrickPool(self):
+        if self.brickPool is None:
+            self.brickPool = BrickObjectPool(self.maxPooledBricks, self.getBrickObjSignature)
+            # Bricker's 'delete'/'duplicate' (used by its add, remove, split and merge) go through the pool,
+            # if it has them; otherwise only bricks removed and redrawn by session undo are pooled
+            self.brickPool.hook()
+        return self.brickPool
+
+    def getBrickSignature(self, key):
+        return (tuple(getBrickField(self.bricksDict, key, "size")), getBrickField(self.bricksDict, key, "type"))
+
+    def getBrickObjSignature(self, obj):
+        """ pool signature of brick object of the active model (None for other objects) """
+        key = getDictKey(obj.name)
+        brickD = self.bricksDict.get(key)
+        if brickD is None or brickD["name"] != obj.name:
+            return None
+        return self.getBrickSignature(key)
+
+    def recycleBricks(self, parentKeys):
+        """ remove brick objects of bricks at parentKeys (into the object pool, if enabled) """
+        for key in parentKeys:
+            obj = bpy.data.objects.get(self.bricksDict[key]["name"])
+            if obj is None:
+                continue
+            if self.poolBrickObjects:
+                self.getBrickPool().release(obj, self.getBrickSignature(key))
+            else:
+                delete(obj)
+
+    def reuseBricks(self, parentKeys):
+        """ give bricks about to be drawn at parentKeys pooled objects (Bricker draws into existing objects of the same name) """
+        if not self.poolBrickObjects or not self.brickPool:
+            return
+        for key in parentKeys:
+            if bpy.data.objects.get(self.bricksDict[key]["name"]) is None:
+                self.brickPool.acquire(self.getBrickSignature(key), self.bricksDict[key]["name"])
+
+    def undoSculpt(self, redo=False):
+        """ restore bricksDict entries and bricks from the last undo (or redo) step of this session """
+        states = self.getUndoJournal().pop(redo=redo)
+        if states is None:
+            return
+        def restore():
+            for key, state in states:
+                setUndoState(self.bricksDict[key], state)
+        self.restoreBricks([key for key, state in states], restore)
+        self.autosaveEdits()
+
+    def restoreBricks(self, keys, restore):
+        """ redraw bricks at keys after 'restore()' rewrites their bricksDict entries """
+        scn, cm, n = getActiveContextInfo()
+        # remove bricks drawn at restored keys
+        oldParentKeys = self.getParentKeys(k for k in keys if k in self.bricksDict)
+        self.recycleBricks(oldParentKeys)
+        restore()
+        keys = [k for k in keys if k in self.bricksDict]
+        # redraw bricks at restored keys (and bricks removed above that kept their entries)
+        parentKeys = self.getParentKeys(keys) | set(k for k in oldParentKeys if k in self.bricksDict and self.bricksDict[k]["draw"] and self.bricksDict[k]["parent"] == "self")
+        self.reuseBricks(parentKeys)
+        # bricks next to restored cells are redrawn too, as their exposure may have changed back
+        neighborParentKeys = self.getParentKeys(self.getNeighborKeys(keys)) - parentKeys
+        drawUpdatedBricks(cm, self.bricksDict, list(parentKeys | neighborParentKeys), action="restoring bricks", selectCreated=False)
+        if self.brickPool is not None:
+            self.brickPool.freeReplacedMeshes()
+        self.recordEdit("restored", keys)
+        self.shareQueuedMeshes()
+        if self.bvhEngine is not None:
+            self.bvhEngine.markDirty(parentKeys | oldParentKeys | neighborParentKeys | set(keys))
+        self.tagRedraw()
+
+    def getNeighborKeys(self, keys):
+        """ keys of cells in bricksDict next to cells at keys (not including keys) """
+        keys = set(keys)
+        neighborKeys = set()
+        for key in keys:
+            x, y, z = getDictLoc(self.bricksDict, key)
+            neighborKeys.update("%d,%d,%d" % (x + dx, y + dy, z + dz) for dx, dy, dz in NEIGHBOR_LOCS)
+        return [k for k in neighborKeys - keys if k in self.bricksDict]
+
+    def getAutosaveJournal(self):
+        if self.autosaveJournal is None:
+            scn, cm, n = getActiveContextInfo()
+            self.autosaveJournal = AutosaveJournal(self.autosaveTo, n, self.autosaveCompactEvery, continueJournal=self.autosaveRecovered)
+        return self.autosaveJournal
+
+    def autosaveEdits(self):
+        """ queue bricksDict entries edited since the last call for the autosave journal """
+        if self.autosaveJournal is not None:
+            self.autosaveJournal.endStroke(self.bricksDict)
+
+    def recoverAutosave(self):
+        """ replay the autosave journal left by an interrupted session of the active model; returns number of recovered entries """
+        # once this session's journal is started it has replaced the one left behind
+        if self.autosaveTo is None or self.autosaveJournal is not None or not os.path.exists(self.autosaveTo):
+            return 0
+        scn, cm, n = getActiveContextInfo()
+        model, entries = readAutosave(self.autosaveTo)
+        if model != n or not entries:
+            return 0
+        # set first, so the journal started by 'restoreBricks' continues the recovered one
+        self.autosaveRecovered = True
+        self.restoreBricks(list(entries), lambda: applyAutosave(self.bricksDict, entries))
+        # the recovered entries are in the journal already
+        if self.autosaveJournal is not None:
+            self.autosaveJournal.marked.clear()
+        return len(entries)
+
+    def commitSessionChanges(self):
+        """ commit changes with plain dict bricksDict, and drop the autosave journal they replace """
+        if self.autosaveJournal is not None:
+            self.autosaveJournal.discard()
+            self.autosaveJournal = None
+        if self.incrementalCommit:
+            self.commitEditedChanges()
+        else:
+            self.unloadSessionStore()
+            self.commitChanges()
+        self.editedKeys = None
+
+    def commitEditedChanges(self):
+        """ commit changes to the cells edited this session and their neighbors: fix parents, update exposure and redraw bricks whose exposure changed """
+        scn, cm, n = getActiveContextInfo()
+        deselectAll()
+        self.unSoloBrickLayer()
+        keys = self.getEditedNeighborhood()
+        # parents of edited cells may lie outside the neighborhood, and their exposure is updated too
+        keys = set(keys) | set(k for k in self.getParentKeys(keys) if k in self.bricksDict)
+        self.unloadSessionStore(keys)
+        orphanKeys = self.updateParents(keys)
+        redrawKeys = self.updateExposures(self.getParentKeys(keys))
+        drawUpdatedBricks(cm, self.bricksDict, redrawKeys, action="committing", selectCreated=False)
+        for key in keys:
+            if "attempted_merge" in self.bricksDict[key]:
+                self.bricksDict[key]["attempted_merge"] = False
+        if orphanKeys or self.editedKeys:
+            cm.customized = True
+
+    def getEditedNeighborhood(self):
+        """ keys of cells edited this session and the cells next to them """
+        editedKeys = [k for k in self.editedKeys or () if k in self.bricksDict]
+        return editedKeys + self.getNeighborKeys(editedKeys)
+
+    def updateParents(self, keys):
+        """ clear cells at keys whose parent brick no longer covers them; returns their keys """
+        orphanKeys = []
+        for key in keys:
+            brickD = self.bricksDict[key]
+            parentKey = brickD["parent"]
+            if parentKey in (None, "self"):
+                continue
+            parentD = self.bricksDict.get(parentKey)
+            if parentD is not None and parentD["draw"] and parentD["parent"] == "self":
+                loc, parentLoc = getDictLoc(self.bricksDict, key), getDictLoc(self.bricksDict, parentKey)
+                if all(0 <= loc[i] - parentLoc[i] < parentD["size"][i] for i in range(3)):
+                    continue
+            brickD["draw"] = False
+            brickD["parent"] = None
+            orphanKeys.append(key)
+        return orphanKeys
+
+    def updateExposures(self, parentKeys):
+        """ set 'top_exposed'/'bot_exposed' of bricks at parentKeys; returns keys of bricks whose exposure changed """
+        changedKeys = []
+        for key in parentKeys:
+            brickD = self.bricksDict[key]
+            (x, y, z), (sx, sy, sz) = getDictLoc(self.bricksDict, key), brickD["size"]
+            topExposed, botExposed = (any(not self.isCellDrawn("%d,%d,%d" % (x + dx, y + dy, z1)) for dx in range(sx) for dy in range(sy)) for z1 in (z + sz, z - 1))
+            if brickD.get("top_exposed") != topExposed or brickD.get("bot_exposed") != botExposed:
+                brickD["top_exposed"] = topExposed
+                brickD["bot_exposed"] = botExposed
+                changedKeys.append(key)
+        return changedKeys
+
+    def isCellDrawn(self, key):
+        brickD = self.bricksDict.get(key)
+        return brickD is not None and brickD["draw"]
+
+    def timePhase(self, name):
+        """ context manager timing a phase of the modal loop (does nothing unless 'profilePhases') """
+        if not self.profilePhases:
+            return NULL_PHASE
+        if self.profiler is None:
+            self.profiler = PhaseProfiler()
+        return self.profiler.phase(name)
+
+    def tagRedraw(self):
+        with self.timePhase("redraw"):
+            tag_redraw_areas("VIEW_3D")
+
+    def getUIPresenter(self):
+        """ get UI state presenter for this session (check 'lastStroke' for UI calls emitted/suppressed per stroke) """
+        if self.uiPresenter is None:
+            self.uiPresenter = UIStatePresenter(self.frameBudget)
+        return self.uiPresenter
+
+    def getEventRecorder(self):
+        """ get event recorder for this session (saved to 'recordEventsTo' when the session ends) """
+        if self.eventRecorder is None:
+            self.eventRecorder = EventRecorder(self.mode, self.getPlainBricksDict())
+        return self.eventRecorder
+
+    def getEventCoalescer(self, context):
+        """ get mouse move coalescer for this session (started on first use) """
+        if self.eventCoalescer is None:
+            self.eventCoalescer = MouseMoveCoalescer(self.frameBudget)
+            self.eventCoalescer.start(context)
+        return self.eventCoalescer
 
     def cancel(self, context):
         if b280():
@@ -233,6 +1034,40 @@ class bricksculpt_framework:
         else:
             context.area.header_text_set()
         bpy.props.running_bricksculpt_tool = False
+        self.unSoloBrickLayer()
+        self.layerIndex = None
+        self.occupancyGrid = None
+        if self.autosaveJournal is not None:
+            # write what's queued; the journal is kept until the changes are committed
+            self.autosaveEdits()
+            self.autosaveJournal.stop()
+        self.autosaveRecovered = False
+        self.bvhEngine = None
+        self.gridEngine = None
+        self.viewRayCache = None
+        self.uiPresenter = None
+        self.mouseInRegion = None
+        if self.brickPool is not None:
+            self.brickPool.unhook()
+            self.brickPool.clear()
+            self.brickPool = None
+        self.meshCache = None
+        self.brickResolver = None
+        if self.strokeProxies is not None:
+            self.strokeProxies.stop()
+            self.strokeProxies = None
+        self.strokeTransaction = None
+        if self.eventCoalescer is not None:
+            self.eventCoalescer.stop(context)
+            self.eventCoalescer = None
+        if self.eventRecorder is not None:
+            self.eventRecorder.save(self.recordEventsTo)
+            self.eventRecorder = None
+        if self.profiler is not None:
+            self.profiler.report()
+            if self.profileExportTo is not None:
+                self.profiler.export(self.profileExportTo)
+            self.profiler = None
         self.ui_end()
 
     ##########################
@@ -0,0 +1,1127 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" in-process stand-ins for the parts of bpy, mathutils and bmesh used by the BrickSculpt hot paths
+
+For running the benchmarks and self tests in plain CPython (no Blender, no
+GPU). This module has no addon imports, so it can be imported by path before
+the addon:
+
+    sys.path.insert(0, "path/to/bricksculpt")
+    import bricksculpt_headless
+    bricksculpt_headless.install()
+    bricksculpt_headless.installAddon("path/to/bricksculpt")
+    benchmarks = importlib.import_module(bricksculpt_headless.ADDON_PACKAGE + ".bricksculpt_benchmarks")
+
+install() only adds modules that can't be imported, so it does nothing inside
+Blender. installAddon() stands in for the Bricker functions the addon imports
+(getDictKey, getDictLoc, drawUpdatedBricks, delete, duplicate, ...). Objects live in the
+stand-in bpy.data; scene.ray_cast and BVHTree intersect triangles by brute
+force (fine for benchmark-sized scenes, and BVH chunking still applies).
+Bricker's sculpt tools are replaced by simple bricksDict edits
+(BrickSculptTools, see makeSculptOperator); other operators and bmesh editing
+are not provided. Running this module as a script runs the hot path self
+tests ('bricksculpt_selftest'); with '--replay [recording.json ...]' it runs
+the replay benchmarks instead (replayRecordings).
+"""
+
+# System imports
+import importlib
+import json
+import math
+import os
+import sys
+import tempfile
+import types
+import numpy as np
+
+# Blender imports
+# NONE!
+
+# Addon imports
+# NONE!
+
+
+#################### MATHUTILS ####################
+
+
+class Vector:
+    """ mathutils.Vector subset (2 to 4 float components) """
+
+    def __init__(self, seq=(0, 0, 0)):
+        self._v = [float(c) for c in seq]
+
+    def __len__(self):
+        return len(self._v)
+
+    def __iter__(self):
+        return iter(self._v)
+
+    def __getitem__(self, i):
+        return self._v[i]
+
+    def __setitem__(self, i, value):
+        self._v[i] = float(value)
+
+    def __repr__(self):
+        return "Vector((%s))" % ", ".join("%.4f" % c for c in self._v)
+
+    def __eq__(self, other):
+        return isinstance(other, Vector) and self._v == other._v
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __add__(self, other):
+        return Vector(a + b for a, b in zip(self._v, other))
+
+    def __sub__(self, other):
+        return Vector(a - b for a, b in zip(self._v, other))
+
+    def __mul__(self, other):
+        if isinstance(other, (Vector, Matrix)):
+            raise TypeError("element-wise Vector multiplication is not supported, use dot() or @")
+        return Vector(a * other for a in self._v)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        return Vector(a / other for a in self._v)
+
+    def __neg__(self):
+        return Vector(-a for a in self._v)
+
+    def __matmul__(self, other):
+        if isinstance(other, Vector):
+            return self.dot(other)
+        return NotImplemented
+
+    def _get(i):
+        return property(lambda self: self._v[i], lambda self, value: self.__setitem__(i, value))
+
+    x, y, z, w = _get(0), _get(1), _get(2), _get(3)
+    del _get
+
+    @property
+    def xyz(self):
+        return Vector(self._v[:3])
+
+    @property
+    def length(self):
+        return math.sqrt(self.length_squared)
+
+    @property
+    def length_squared(self):
+        return sum(a * a for a in self._v)
+
+    def dot(self, other):
+        return sum(a * b for a, b in zip(self._v, other))
+
+    def cross(self, other):
+        ax, ay, az = self._v[:3]
+        bx, by, bz = tuple(other)[:3]
+        return Vector((ay * bz - az * by, az * bx - ax * bz, ax * by - ay * bx))
+
+    def normalize(self):
+        length = self.length
+        if length != 0:
+            self._v = [a / length for a in self._v]
+
+    def normalized(self):
+        v = self.copy()
+        v.normalize()
+        return v
+
+    def lerp(self, other, factor:float):
+        return Vector(a + (b - a) * factor for a, b in zip(self._v, other))
+
+    def copy(self):
+        return Vector(self._v)
+
+    def to_tuple(self, precision:int=None):
+        return tuple(self._v if precision is None else (round(a, precision) for a in self._v))
+
+
+class Matrix:
+    """ mathutils.Matrix subset (square, row major) """
+
+    def __init__(self, rows=None):
+        self._m = [[float(c) for c in row] for row in rows] if rows is not None else Matrix.Identity(4)._m
+
+    @classmethod
+    def Identity(cls, size:int):
+        m = cls.__new__(cls)
+        m._m = [[float(i == j) for j in range(size)] for i in range(size)]
+        return m
+
+    @classmethod
+    def Translation(cls, vector):
+        m = cls.Identity(4)
+        for i, c in enumerate(tuple(vector)[:3]):
+            m._m[i][3] = float(c)
+        return m
+
+    def __len__(self):
+        return len(self._m)
+
+    def __iter__(self):
+        return (Vector(row) for row in self._m)
+
+    def __getitem__(self, i):
+        return Vector(self._m[i])
+
+    def __repr__(self):
+        return "Matrix((%s))" % ", ".join("(%s)" % ", ".join("%.4f" % c for c in row) for row in self._m)
+
+    def __eq__(self, other):
+        return isinstance(other, Matrix) and self._m == other._m
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __matmul__(self, other):
+        if isinstance(other, Matrix):
+            return Matrix((np.array(self._m) @ np.array(other._m)).tolist())
+        v = list(other)
+        size = len(self._m)
+        if len(v) == size - 1:
+            # points are transformed with an implicit w of 1
+            return Vector(sum(row[j] * c for j, c in enumerate(v + [1.0])) for row in self._m[:size - 1])
+        return Vector(sum(row[j] * c for j, c in enumerate(v)) for row in self._m)
+
+    # Blender 2.79 uses '*' for matrix multiplication
+    __mul__ = __matmul__
+
+    @property
+    def col(self):
+        return [Vector(row[j] for row in self._m) for j in range(len(self._m))]
+
+    @property
+    def translation(self):
+        return Vector(row[3] for row in self._m[:3])
+
+    def inverted(self):
+        return Matrix(np.linalg.inv(np.array(self._m)).tolist())
+
+    def transposed(self):
+        return Matrix(np.array(self._m).T.tolist())
+
+    def to_3x3(self):
+        return Matrix([row[:3] for row in self._m[:3]])
+
+    def copy(self):
+        return Matrix(self._m)
+
+
+class Euler:
+    """ mathutils.Euler placeholder (rotation values only) """
+
+    def __init__(self, angles=(0, 0, 0), order:str="XYZ"):
+        self.x, self.y, self.z = angles
+        self.order = order
+
+
+class BVHTree:
+    """ mathutils.bvhtree.BVHTree subset (brute force ray/triangle intersection in numpy) """
+
+    @classmethod
+    def FromPolygons(cls, vertices, polygons, all_triangles:bool=False, epsilon:float=0.0):
+        tree = cls()
+        verts = np.array(vertices, dtype=np.float64).reshape((-1, 3))
+        # fan-triangulate polygons, remembering the polygon of each triangle
+        tris, polyIdxs = [], []
+        for polyIdx, poly in enumerate(polygons):
+            for i in range(1, len(poly) - 1):
+                tris.append((poly[0], poly[i], poly[i + 1]))
+                polyIdxs.append(polyIdx)
+        tris = np.array(tris, dtype=np.int64).reshape((-1, 3))
+        tree.v0 = verts[tris[:, 0]]
+        tree.e1 = verts[tris[:, 1]] - tree.v0
+        tree.e2 = verts[tris[:, 2]] - tree.v0
+        tree.polyIdxs = np.array(polyIdxs, dtype=np.int64)
+        return tree
+
+    def ray_cast(self, origin, direction, distance:float=sys.float_info.max):
+        """ returns (location, normal, index, distance) of nearest hit, or four Nones """
+        miss = (None, None, None, None)
+        if len(self.polyIdxs) == 0:
+            return miss
+        o = np.array(tuple(origin), dtype=np.float64)
+        d = np.array(tuple(direction), dtype=np.float64)
+        d /= np.linalg.norm(d)
+        # Moller-Trumbore against all triangles at once
+        p = np.cross(d, self.e2)
+        det = np.einsum("ij,ij->i", self.e1, p)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            invDet = 1 / det
+            s = o - self.v0
+            u = np.einsum("ij,ij->i", s, p) * invDet
+            q = np.cross(s, self.e1)
+            v = (q @ d) * invDet
+            t = np.einsum("ij,ij->i", self.e2, q) * invDet
+            hit = (np.abs(det) > 1e-12) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0) & (t <= distance)
+        if not hit.any():
+            return miss
+        i = int(np.argmin(np.where(hit, t, np.inf)))
+        normal = Vector(np.cross(self.e1[i], self.e2[i]))
+        normal.normalize()
+        return Vector(o + d * t[i]), normal, int(self.polyIdxs[i]), float(t[i])
+
+
+#################### BPY DATA ####################
+
+
+# bpy.data of the installed stand-in bpy
+_data = None
+
+
+class _MeshVertex:
+    def __init__(self, co):
+        self.co = Vector(co)
+
+
+class _MeshVertices(list):
+    def foreach_get(self, attr:str, seq):
+        seq[:] = [c for v in self for c in getattr(v, attr)]
+
+
+class _MeshPolygon:
+    def __init__(self, index:int, vertices):
+        self.index = index
+        self.vertices = tuple(vertices)
+
+
+class Mesh:
+    def __init__(self, name:str):
+        self.name = name
+        self.vertices = _MeshVertices()
+        self.polygons = []
+        self.materials = []
+
+    def as_pointer(self):
+        return id(self)
+
+    @property
+    def users(self):
+        return sum(1 for obj in _data.objects if obj.data is self) if _data is not None else 0
+
+    def from_pydata(self, vertices, edges, faces):
+        self.vertices = _MeshVertices(_MeshVertex(co) for co in vertices)
+        self.polygons = [_MeshPolygon(i, f) for i, f in enumerate(faces)]
+
+    def copy(self):
+        mesh = _data.meshes.new(self.name)
+        mesh.from_pydata([v.co for v in self.vertices], [], [p.vertices for p in self.polygons])
+        mesh.materials = list(self.materials)
+        return mesh
+
+    def update(self, *args, **kwargs):
+        pass
+
+
+class Collection:
+    def __init__(self, name:str):
+        self.name = name
+        self.objects = _ObjectLinks(self)
+        self.hide_viewport = False
+
+
+class Object:
+    def __init__(self, name:str, data=None):
+        self._name = name
+        self._owner = None
+        self.data = data
+        self.type = "MESH" if isinstance(data, Mesh) else "EMPTY"
+        self.parent = None
+        self.location = Vector((0, 0, 0))
+        self._matrix = None
+        self.hide = self.hide_viewport = self.hide_render = self.hide_select = False
+        self.select = False
+        self.users_collection = []
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name:str):
+        # renaming re-keys the object in bpy.data.objects (made unique like Blender does)
+        if self._owner is None:
+            self._name = name
+        else:
+            self._owner.rename(self, name)
+
+    @property
+    def matrix_world(self):
+        if self._matrix is not None:
+            return self._matrix
+        local = Matrix.Translation(self.location)
+        return self.parent.matrix_world @ local if self.parent is not None else local
+
+    @matrix_world.setter
+    def matrix_world(self, mx):
+        self._matrix = mx.copy()
+
+    def copy(self):
+        """ unlinked copy sharing data (named like Blender would) """
+        obj = _data.objects.new(self.name, self.data)
+        obj.parent = self.parent
+        obj.location = self.location.copy()
+        obj._matrix = self._matrix.copy() if self._matrix is not None else None
+        return obj
+
+    def select_set(self, state:bool):
+        self.select = state
+
+    def select_get(self):
+        return self.select
+
+    def hide_set(self, state:bool):
+        self.hide = self.hide_viewport = state
+
+    def hide_get(self):
+        return self.hide_viewport
+
+    def as_pointer(self):
+        return id(self)
+
+
+class _DataCollection:
+    """ bpy.data.<type> stand-in, keyed by name """
+
+    def __init__(self, new):
+        self._items = {}
+        self._new = new
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(list(self._items.values()))
+
+    def __contains__(self, name):
+        return name in self._items
+
+    def __getitem__(self, name):
+        return self._items[name]
+
+    def get(self, name, default=None):
+        return self._items.get(name, default)
+
+    def keys(self):
+        return list(self._items.keys())
+
+    def uniqueName(self, name:str):
+        baseName, i = name, 0
+        while name in self._items:
+            i += 1
+            name = "%s.%03d" % (baseName, i)
+        return name
+
+    def new(self, name:str, *args):
+        name = self.uniqueName(name)
+        item = self._new(name, *args)
+        item._owner = self
+        self._items[name] = item
+        return item
+
+    def rename(self, item, name:str):
+        if name == item._name:
+            return
+        del self._items[item._name]
+        item._name = self.uniqueName(name)
+        self._items[item._name] = item
+
+    def remove(self, item, do_unlink:bool=True):
+        self._items.pop(item.name, None)
+        item._owner = None
+        if do_unlink and isinstance(item, Object):
+            for cn in item.users_collection:
+                cn.objects.unlink(item)
+
+
+class _ObjectLinks:
+    """ objects linked to a scene (2.79) or collection (2.80) """
+
+    def __init__(self, owner):
+        self.owner = owner
+        self._objects = []
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __iter__(self):
+        return iter(list(self._objects))
+
+    def __contains__(self, obj):
+        return obj in self._objects
+
+    def link(self, obj):
+        if obj not in self._objects:
+            self._objects.append(obj)
+            obj.users_collection.append(self.owner)
+
+    def unlink(self, obj):
+        if obj in self._objects:
+            self._objects.remove(obj)
+            obj.users_collection.remove(self.owner)
+
+
+#################### BPY CONTEXT ####################
+
+
+def _isVisible(obj):
+    return not (obj.hide or obj.hide_viewport or any(cn.hide_viewport for cn in obj.users_collection))
+
+
+class Scene:
+    def __init__(self, name:str="Scene"):
+        self.name = name
+        self.collection = Collection("Scene Collection")
+        # 2.79 links objects to the scene itself, so both share one list of objects
+        self.objects = self.collection.objects
+        self.frame_current = 1
+
+    def update(self):
+        pass
+
+    def ray_cast(self, *args, distance:float=None):
+        """ 2.79 signature (origin, end) or 2.80 signature (view_layer, origin, direction, distance) """
+        if len(args) == 2:
+            origin, end = Vector(args[0]), Vector(args[1])
+            direction = end - origin
+            distance = direction.length
+            direction.normalize()
+        else:
+            origin, direction = Vector(args[1]), Vector(args[2]).normalized()
+            distance = distance if distance is not None else (args[3] if len(args) > 3 else 1.70141e+38)
+        best = None
+        for obj in self.objects:
+            if obj.type != "MESH" or not _isVisible(obj) or len(obj.data.polygons) == 0:
+                continue
+            mx = obj.matrix_world
+            tree = BVHTree.FromPolygons([mx @ v.co for v in obj.data.vertices], [p.vertices for p in obj.data.polygons])
+            loc, normal, idx, dist = tree.ray_cast(origin, direction, distance)
+            if loc is not None and (best is None or dist < best[3]):
+                best = (loc, normal, idx, dist, obj)
+        if best is None:
+            return False, Vector((0, 0, 0)), Vector((0, 0, 0)), -1, None, Matrix.Identity(4)
+        loc, normal, idx, dist, obj = best
+        return True, loc, normal, idx, obj, obj.matrix_world.copy()
+
+
+class ViewLayer:
+    def __init__(self, name:str="View Layer"):
+        self.name = name
+        self.objects = None
+
+    def update(self):
+        pass
+
+
+class Region:
+    def __init__(self, width:int=1920, height:int=1080, type:str="WINDOW"):
+        self.type = type
+        self.x = self.y = 0
+        self.width, self.height = width, height
+
+    def tag_redraw(self):
+        pass
+
+
+class RegionView3D:
+    def __init__(self):
+        self.view_matrix = Matrix.Identity(4)
+        self.perspective_matrix = Matrix.Identity(4)
+        self.view_perspective = "PERSP"
+        self.is_perspective = True
+
+
+class SpaceView3D:
+    type = "VIEW_3D"
+
+    def __init__(self, rv3d):
+        self.region_3d = rv3d
+        self.region_quadviews = ()
+
+    @classmethod
+    def draw_handler_add(cls, callback, args, region_type:str, draw_type:str):
+        return (callback, args)
+
+    @classmethod
+    def draw_handler_remove(cls, handle, region_type:str):
+        pass
+
+
+class _Spaces(list):
+    @property
+    def active(self):
+        return self[0]
+
+
+class Area:
+    def __init__(self, region, space):
+        self.type = space.type
+        self.regions = [region]
+        self.spaces = _Spaces([space])
+        self.header_text = None
+
+    def header_text_set(self, text=None):
+        self.header_text = text
+
+    def tag_redraw(self):
+        pass
+
+
+class Screen:
+    def __init__(self, areas):
+        self.areas = areas
+
+    def as_pointer(self):
+        return id(self)
+
+
+class Window:
+    def __init__(self, screen, view_layer):
+        self.screen = screen
+        self.view_layer = view_layer
+        self.cursor = "DEFAULT"
+
+    def cursor_set(self, cursor:str):
+        self.cursor = cursor
+
+
+class WindowManager:
+    def event_timer_add(self, time_step:float, window=None):
+        return types.SimpleNamespace(time_step=time_step, window=window)
+
+    def event_timer_remove(self, timer):
+        pass
+
+
+class Context:
+    """ bpy.context with a single 3D viewport filling the window """
+
+    def __init__(self):
+        self.scene = Scene()
+        self.view_layer = ViewLayer()
+        self.region = Region()
+        self.region_data = RegionView3D()
+        self.space_data = SpaceView3D(self.region_data)
+        self.area = Area(self.region, self.space_data)
+        self.screen = Screen([self.area])
+        self.window = Window(self.screen, self.view_layer)
+        self.window_manager = WindowManager()
+        self.object = self.active_object = None
+        self.selected_objects = []
+        self.preferences = self.user_preferences = types.SimpleNamespace(addons={})
+
+
+#################### BRICKER ####################
+
+
+class BrickerModel:
+    """ Bricker model settings (cmlist item) stand-in """
+
+    def __init__(self, name:str="headless"):
+        self.name = self.source_name = name
+        self.customized = False
+
+
+activeModel = BrickerModel()
+
+
+def getDictKey(name:str):
+    """ get bricksDict key from brick name ('Bricker_<model>__x,y,z') """
+    return name.split("__")[-1]
+
+
+def getDictLoc(bricksDict:dict, key:str):
+    return [int(c) for c in key.split(",")]
+
+
+def b280():
+    return sys.modules["bpy"].app.version >= (2, 80, 0)
+
+
+def getActiveContextInfo(cm=None):
+    cm = cm or activeModel
+    return sys.modules["bpy"].context.scene, cm, cm.source_name
+
+
+def bricker_handle_exception():
+    """ re-raise the exception being handled, so headless runs fail loudly """
+    raise
+
+
+def drawUpdatedBricks(cm, bricksDict:dict, keysToUpdate:iter, action:str="redrawing", selectCreated:bool=True, tempBrick:bool=False):
+    """ draw bricks with parent keys in keysToUpdate as boxes spanning their cells (unit cells centered at 'co')
+
+    Like Bricker, an existing object of the brick's name is drawn into and
+    given a new mesh (the old mesh is left to its other users or orphaned).
+    """
+    bpy = sys.modules["bpy"]
+    for key in keysToUpdate:
+        brickD = bricksDict[key]
+        if not brickD["draw"] or brickD["parent"] != "self":
+            continue
+        sx, sy, sz = brickD["size"]
+        verts = [(x - 0.5, y - 0.5, z - 0.5) for x in (0, sx) for y in (0, sy) for z in (0, sz)]
+        faces = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+        mesh = bpy.data.meshes.new(brickD["name"])
+        mesh.from_pydata(verts, [], faces)
+        obj = bpy.data.objects.get(brickD["name"])
+        if obj is None:
+            obj = bpy.data.objects.new(brickD["name"], mesh)
+        else:
+            obj.data = mesh
+        obj.location = Vector(brickD["co"])
+        if bpy.context.scene.collection not in obj.users_collection:
+            bpy.context.scene.collection.objects.link(obj)
+        obj.select = selectCreated
+
+
+def _brickerFunction(name:str):
+    """ function of the installed Bricker stand-in, looked up on each call like Bricker's modules do (so hooks apply) """
+    return getattr(sys.modules[ADDON_PACKAGE.split(".")[0] + ".functions.common.blender"], name)
+
+
+class BrickSculptTools:
+    """ Bricker's BrickSculpt tools (addBrick, removeBrick, ... and the operator state they use) stand-in
+
+    Mixed into an operator with the framework by makeSculptOperator(). Bricks
+    are edited in bricksDict and redrawn with drawUpdatedBricks: adding fills
+    the cell on the hit face with a 1x1x1 brick, splitting makes 1x1x1 bricks
+    of every cell, and merging on release joins pairs of 1x1x1 bricks queued
+    in 'keysToMergeOnRelease' along x into 2x1x1 bricks.
+    """
+
+    def __init__(self, bricksDict:dict, mode:str="DRAW", matName:str="ABS Plastic Blue"):
+        self.bricksDict = bricksDict
+        self.mode = mode
+        self.matName = matName
+        self.obj = self.loc = self.normal = None
+        self.region = self.r3d = None
+        self.mouse = self.lastMouse = Vector((0, 0))
+        self.mouseTravel = 0
+        self.left_click = False
+        self.layerSolod = None
+        self.possibleCtrlDisable = False
+        self.ctrlClickTime = self.releaseTime = 0
+        self.numCommits = 0
+
+    def drawBricks(self, cm, keys:iter):
+        drawUpdatedBricks(cm, self.bricksDict, list(keys), selectCreated=False)
+
+    def removeBrickObject(self, key:str):
+        obj = sys.modules["bpy"].data.objects.get(self.bricksDict[key]["name"])
+        if obj is not None:
+            _brickerFunction("delete")(obj)
+
+    def getBrickKeys(self, curKey:str, curLoc:list, objSize:list):
+        x, y, z = curLoc
+        return ["%d,%d,%d" % (x + dx, y + dy, z + dz) for dx in range(objSize[0]) for dy in range(objSize[1]) for dz in range(objSize[2])]
+
+    def addBrick(self, cm, n, curKey:str, curLoc:list, objSize:list):
+        cell, size = self.getGridEngine().getAdjacentCell(self.loc, self.normal, curLoc, objSize)
+        key = "%d,%d,%d" % tuple(cell)
+        brickD = self.bricksDict.get(key)
+        if brickD is None or brickD["draw"]:
+            return
+        brickD.update(draw=True, parent="self", size=[1, 1, 1], mat_name=self.matName)
+        self.drawBricks(cm, [key])
+        self.addedBricks.append(brickD["name"])
+        self.keysToMergeOnRelease.append(key)
+
+    def removeBrick(self, cm, n, event, curKey:str, curLoc:list, objSize:list):
+        self.removeBrickObject(curKey)
+        for key in self.getBrickKeys(curKey, curLoc, objSize):
+            self.bricksDict[key].update(draw=False, parent=None, size=[1, 1, 1])
+
+    def changeMaterial(self, cm, n, curKey:str, curLoc:list, objSize:list):
+        for key in self.getBrickKeys(curKey, curLoc, objSize):
+            self.bricksDict[key]["mat_name"] = self.matName
+        self.drawBricks(cm, [curKey])
+
+    def splitBrick(self, cm, event, curKey:str, curLoc:list, objSize:list):
+        if list(objSize) == [1, 1, 1]:
+            return
+        self.removeBrickObject(curKey)
+        keys = self.getBrickKeys(curKey, curLoc, objSize)
+        for key in keys:
+            self.bricksDict[key].update(draw=True, parent="self", size=[1, 1, 1])
+        self.drawBricks(cm, keys)
+
+    def mergeBrick(self, cm, n, curKey:str=None, curLoc:list=None, objSize:list=None, mode:str="DRAW", state:str="DRAG"):
+        if state == "DRAG":
+            self.keysToMergeOnRelease.append(curKey)
+            return
+        keys = set(self.keysToMergeOnRelease)
+        merged = []
+        for key in sorted(keys):
+            x, y, z = getDictLoc(self.bricksDict, key)
+            nextKey = "%d,%d,%d" % (x + 1, y, z)
+            if nextKey not in keys or any(not self.bricksDict[k]["draw"] or self.bricksDict[k]["parent"] != "self" or self.bricksDict[k]["size"] != [1, 1, 1] for k in (key, nextKey)):
+                continue
+            self.removeBrickObject(key)
+            self.removeBrickObject(nextKey)
+            self.bricksDict[key]["size"] = [2, 1, 1]
+            self.bricksDict[nextKey]["parent"] = key
+            merged.append(key)
+        self.drawBricks(cm, merged)
+
+    def commitChanges(self):
+        self.numCommits += 1
+
+    def ui_end(self):
+        pass
+
+
+def makeSculptOperator(bricksDict:dict, mode:str="DRAW", **settings):
+    """ BrickSculpt operator for bricksDict made of the framework and the BrickSculptTools stand-in; 'settings' override framework class variables """
+    framework = importlib.import_module(ADDON_PACKAGE + ".bricksculpt_framework").bricksculpt_framework
+    operatorClass = type("BRICKER_OT_bricksculpt_headless", (BrickSculptTools, framework), dict(settings))
+    return operatorClass(bricksDict, mode=mode)
+
+
+def replayRecordings(filepaths:iter=None, realTime:bool=False, **settings):
+    """ replay event recordings through makeSculptOperator and report latency per event by mode (see 'benchmarkReplay'); returns the results
+
+    Bricks of each recording's bricksDict are drawn into the stand-in scene
+    first. Without filepaths, one DRAW, PAINT and MERGE/SPLIT recording is
+    made with 'makeStrokeRecording'. Call install() and installAddon() first.
+    """
+    bpy = sys.modules["bpy"]
+    benchmarks = importlib.import_module(ADDON_PACKAGE + ".bricksculpt_benchmarks")
+    with tempfile.TemporaryDirectory() as tmpDir:
+        if filepaths is None:
+            filepaths = [benchmarks.makeStrokeRecording(os.path.join(tmpDir, mode.replace("/", "_").lower() + ".json"), mode) for mode in ("DRAW", "PAINT", "MERGE/SPLIT")]
+        results = {}
+        for filepath in filepaths:
+            mode, bricksDict, events = benchmarks.loadEventRecording(filepath)
+            drawUpdatedBricks(activeModel, bricksDict, list(bricksDict), selectCreated=False)
+            sculptOp = makeSculptOperator(bricksDict, mode=mode, **settings)
+            try:
+                results.update(benchmarks.benchmarkReplay(sculptOp, [filepath], realTime=realTime))
+            finally:
+                for obj in list(bpy.data.objects):
+                    bpy.data.objects.remove(obj, do_unlink=True)
+    return results
+
+
+# Bricker's 'functions.common' package (installed in place of any copy of it, so the addon is
+# only run against the functions Bricker actually provides)
+
+_VERSION_OPS = {"<": lambda a, b: a < b, ">": lambda a, b: a > b, "<=": lambda a, b: a <= b,
+                "==": lambda a, b: a == b, ">=": lambda a, b: a >= b, "!=": lambda a, b: a != b}
+_versionedFunctions = {}
+
+
+def blender_version_wrapper(op:str, ver:str):
+    """ keep the definition of the decorated function made for the running Blender version """
+    version = "%d.%02d" % tuple(sys.modules["bpy"].app.version[:2])
+    def wrapper(fn):
+        key = (fn.__module__, fn.__qualname__)
+        if _VERSION_OPS[op](version, ver):
+            _versionedFunctions[key] = fn
+        return _versionedFunctions.get(key, fn)
+    return wrapper
+
+
+def confirmIter(object):
+    """ if single item passed, convert to list """
+    try:
+        iter(object)
+    except TypeError:
+        object = [object]
+    return object
+
+
+def confirmList(object):
+    """ if single item passed, convert to list """
+    if type(object) not in (list, tuple):
+        object = [object]
+    return object
+
+
+def deepcopy(object):
+    """ efficient way to deepcopy json loadable object """
+    return json.loads(json.dumps(object))
+
+
+def mathutils_mult(*argv):
+    """ elementwise multiplication for vectors, matrices, etc. """
+    result = argv[0]
+    for arg in argv[1:]:
+        result = result @ arg if b280() else result * arg
+    return result
+
+
+def delete(objs, remove_meshes:bool=False):
+    """ efficient deletion of objects """
+    bpy = sys.modules["bpy"]
+    for obj in confirmIter(objs):
+        if obj is None:
+            continue
+        mesh = obj.data
+        bpy.data.objects.remove(obj, do_unlink=True)
+        if remove_meshes and mesh is not None:
+            bpy.data.meshes.remove(mesh)
+
+
+def duplicate(obj, linked:bool=False, link_to_scene:bool=False):
+    """ efficient duplication of objects """
+    copy = obj.copy()
+    if not linked and copy.data:
+        copy.data = copy.data.copy()
+    unhide(copy, render=False)
+    if link_to_scene:
+        link_object(copy)
+    return copy
+
+
+def deselectAll():
+    for obj in sys.modules["bpy"].context.selected_objects:
+        obj.select = False
+
+
+def hide(obj, viewport:bool=True, render:bool=True):
+    if viewport:
+        if b280():
+            obj.hide_viewport = True
+        else:
+            obj.hide = True
+    if render:
+        obj.hide_render = True
+
+
+def unhide(obj, viewport:bool=True, render:bool=True):
+    if viewport:
+        if b280():
+            obj.hide_viewport = False
+        else:
+            obj.hide = False
+    if render:
+        obj.hide_render = False
+
+
+def isObjVisibleInViewport(obj):
+    return obj is not None and _isVisible(obj)
+
+
+def link_object(o):
+    scn = sys.modules["bpy"].context.scene
+    (scn.collection if b280() else scn).objects.link(o)
+
+
+def tag_redraw_areas(areaTypes:iter=["ALL"]):
+    """ run tag_redraw for given area types """
+    for area in sys.modules["bpy"].context.screen.areas:
+        for areaType in confirmList(areaTypes):
+            if areaType == "ALL" or area.type == areaType:
+                area.tag_redraw()
+
+
+BRICKER_COMMON_FUNCTIONS = {
+    "wrappers": (blender_version_wrapper,),
+    "python_utils": (confirmIter, confirmList, deepcopy),
+    "maths": (mathutils_mult,),
+    "reporting": (b280,),
+    "blender": (delete, duplicate, deselectAll, hide, unhide, isObjVisibleInViewport, link_object, tag_redraw_areas,
+                confirmIter, confirmList, blender_version_wrapper),
+}
+
+
+#################### MODULES ####################
+
+
+class _Namespace(types.ModuleType):
+    """ module whose unknown attributes are produced by 'default(name)' """
+
+    def __init__(self, name:str, default=None, **attrs):
+        super().__init__(name)
+        self.__dict__.update(attrs)
+        self._default = default
+
+    def __getattr__(self, attr):
+        if attr.startswith("__") or self._default is None:
+            raise AttributeError(attr)
+        value = self._default(attr)
+        setattr(self, attr, value)
+        return value
+
+
+class _Operators:
+    """ bpy.ops stand-in; every operator does nothing and reports success """
+
+    def __getattr__(self, attr):
+        return self
+
+    def __call__(self, *args, **kwargs):
+        return {"FINISHED"}
+
+    def poll(self):
+        return True
+
+
+class _BpyStruct:
+    """ base of bpy.types classes not modelled above """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+def _makeProperty(name:str):
+    return lambda *args, **kwargs: (name, kwargs)
+
+
+def _makeBpy(version:tuple):
+    bpy = _Namespace("bpy")
+    bpy.app = _Namespace("bpy.app", version=tuple(version), background=True, binary_path="", version_string=".".join(str(v) for v in version))
+    bpy.app.handlers = _Namespace("bpy.app.handlers", default=lambda name: [], persistent=lambda fn: fn)
+    bpy.data = types.SimpleNamespace(
+        objects=_DataCollection(Object),
+        meshes=_DataCollection(Mesh),
+        collections=_DataCollection(Collection),
+        materials=_DataCollection(lambda name: types.SimpleNamespace(name=name)),
+        groups=_DataCollection(Collection),
+        scenes=_DataCollection(Scene),
+    )
+    global _data
+    _data = bpy.data
+    bpy.context = Context()
+    bpy.data.scenes._items[bpy.context.scene.name] = bpy.context.scene
+    bpy.types = _Namespace("bpy.types", default=lambda name: type(name, (_BpyStruct,), {}),
+                           Object=Object, Mesh=Mesh, Collection=Collection, Scene=Scene, ViewLayer=ViewLayer,
+                           Region=Region, RegionView3D=RegionView3D, SpaceView3D=SpaceView3D, Area=Area,
+                           Screen=Screen, Window=Window, WindowManager=WindowManager, Context=Context)
+    # property functions are listed explicitly for 'from bpy.props import *'
+    propNames = ("BoolProperty", "BoolVectorProperty", "CollectionProperty", "EnumProperty", "FloatProperty", "FloatVectorProperty",
+                 "IntProperty", "IntVectorProperty", "PointerProperty", "StringProperty", "RemoveProperty")
+    bpy.props = _Namespace("bpy.props", **{name: _makeProperty(name) for name in propNames})
+    bpy.utils = _Namespace("bpy.utils", register_class=lambda cls: None, unregister_class=lambda cls: None,
+                           user_resource=lambda *args, **kwargs: "", script_path_user=lambda: "")
+    bpy.ops = _Operators()
+    bpy.path = _Namespace("bpy.path", abspath=lambda path, **kwargs: path, basename=lambda path: path.replace("\\", "/").split("/")[-1])
+    return bpy
+
+
+def _makeModules(version:tuple):
+    """ stand-in modules by name """
+    bpy = _makeBpy(version)
+    mathutils = _Namespace("mathutils", Vector=Vector, Matrix=Matrix, Euler=Euler, Color=Vector)
+    mathutils.bvhtree = _Namespace("mathutils.bvhtree", BVHTree=BVHTree)
+    noop = lambda *args, **kwargs: None
+    return {
+        "bpy": bpy,
+        "bpy.app": bpy.app,
+        "bpy.app.handlers": bpy.app.handlers,
+        "bpy.types": bpy.types,
+        "bpy.props": bpy.props,
+        "bpy.utils": bpy.utils,
+        "bpy.path": bpy.path,
+        "mathutils": mathutils,
+        "mathutils.bvhtree": mathutils.bvhtree,
+        "bmesh": _Namespace("bmesh"),
+        "bgl": _Namespace("bgl", default=lambda name: 0 if name.startswith("GL_") else noop),
+        "addon_utils": _Namespace("addon_utils", modules=lambda *args, **kwargs: [], check=lambda name: (False, False)),
+    }
+
+
+def install(version:tuple=(2, 80, 0)):
+    """ add stand-in modules to sys.modules for any of them that can't be imported; returns names of installed modules """
+    installed = []
+    modules = None
+    for name in ("bpy", "mathutils", "bmesh", "bgl", "addon_utils"):
+        try:
+            __import__(name)
+        except ImportError:
+            modules = modules or _makeModules(version)
+            for fullName, module in modules.items():
+                if fullName == name or fullName.startswith(name + "."):
+                    sys.modules[fullName] = module
+                    installed.append(fullName)
+    return installed
+
+
+# package BrickSculpt is installed as in Bricker (its modules import Bricker's modules from four levels up)
+ADDON_PACKAGE = "bricker.operators.customization_tools.bricksculpt"
+
+
+def _makePackage(name:str, path:list):
+    package = types.ModuleType(name)
+    package.__path__ = path
+    return package
+
+
+def _makeModule(name:str, fns:iter):
+    module = types.ModuleType(name)
+    for fn in fns:
+        setattr(module, fn.__name__, fn)
+    return module
+
+
+def installAddon(addonPath:str, package:str=ADDON_PACKAGE):
+    """ make the BrickSculpt modules at addonPath importable as 'package' inside a stand-in Bricker; returns names of installed modules
+
+    Bricker's 'functions.common' and 'lib.bricksDict.functions' are served
+    from the Bricker stand-ins above (never from BrickSculpt's own copy of
+    'functions.common'). Call install() first.
+    """
+    parts = package.split(".")
+    root = parts[0]
+    modules = {".".join(parts[:i]): _makePackage(".".join(parts[:i]), []) for i in range(1, len(parts))}
+    modules[package] = _makePackage(package, [addonPath])
+    modules[root + ".functions"] = _makePackage(root + ".functions", [])
+    common = modules[root + ".functions.common"] = _makePackage(root + ".functions.common", [])
+    for name, fns in BRICKER_COMMON_FUNCTIONS.items():
+        module = modules[common.__name__ + "." + name] = _makeModule(common.__name__ + "." + name, fns)
+        # like 'from .<name> import *' in the package's __init__
+        setattr(common, name, module)
+        for fn in fns:
+            setattr(common, fn.__name__, fn)
+    modules[root + ".lib"] = _makePackage(root + ".lib", [])
+    modules[root + ".lib.bricksDict"] = _makePackage(root + ".lib.bricksDict", [])
+    modules[root + ".lib.bricksDict.functions"] = _makeModule(root + ".lib.bricksDict.functions",
+                                                             (getDictKey, getDictLoc, b280, getActiveContextInfo, bricker_handle_exception, drawUpdatedBricks))
+    for name, module in modules.items():
+        sys.modules.setdefault(name, module)
+    return list(modules)
+
+
+def uninstall(names:iter):
+    """ remove modules returned by install() (or installAddon()) from sys.modules """
+    for name in names:
+        sys.modules.pop(name, None)
+
+
+if __name__ == "__main__":
+    # run the hot path self tests: python bricksculpt_headless.py
+    # (the tests build operators with this module, imported by name)
+    sys.modules.setdefault("bricksculpt_headless", sys.modules[__name__])
+    install()
+    installAddon(os.path.dirname(os.path.abspath(__file__)))
+    if sys.argv[1:2] == ["--replay"]:
+        # replay benchmarks: python bricksculpt_headless.py --replay [recording.json ...]
+        replayRecordings(sys.argv[2:] or None)
+        sys.exit(0)
+    selftest = importlib.import_module(ADDON_PACKAGE + ".bricksculpt_selftest")
+    sys.exit(0 if selftest.runSelfTests() else 1)
@@ -0,0 +1,264 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# System imports
+import time
+
+# Blender imports
+import bpy
+import bgl
+try:
+    import gpu
+    from gpu_extras.batch import batch_for_shader
+except ImportError:
+    gpu = None
+
+# Addon imports
+from ....functions.common.wrappers import blender_version_wrapper
+
+
+# vertex index pairs for the 12 edges of a box with corners ordered x-major, z-minor
+BOX_EDGES = [(i, i | bit) for bit in (1, 2, 4) for i in range(8) if not i & bit]
+
+
+@blender_version_wrapper('<=','2.79')
+def draw_lines(coords:list, color:tuple, batch=None):
+    """ draw line segments between pairs of 3D coords (returns cached batch for next draw) """
+    bgl.glEnable(bgl.GL_BLEND)
+    bgl.glColor4f(*color)
+    bgl.glBegin(bgl.GL_LINES)
+    for co in coords:
+        bgl.glVertex3f(*co)
+    bgl.glEnd()
+    bgl.glDisable(bgl.GL_BLEND)
+    return None
+@blender_version_wrapper('>=','2.80')
+def draw_lines(coords:list, color:tuple, batch=None):
+    """ draw line segments between pairs of 3D coords (returns cached batch for next draw) """
+    shader = gpu.shader.from_builtin("3D_UNIFORM_COLOR")
+    batch = batch or batch_for_shader(shader, "LINES", {"pos": coords})
+    bgl.glEnable(bgl.GL_BLEND)
+    shader.bind()
+    shader.uniform_float("color", color)
+    batch.draw(shader)
+    bgl.glDisable(bgl.GL_BLEND)
+    return batch
+
+
+@blender_version_wrapper('<=','2.79')
+def set_header_text(area, text:str):
+    if text is None:
+        area.header_text_set()
+    else:
+        area.header_text_set(text)
+@blender_version_wrapper('>=','2.80')
+def set_header_text(area, text:str):
+    area.header_text_set(text=text)
+
+
+class UIStatePresenter:
+    """ pushes header text and cursor changes to Blender only when they change, at most once per frame
+
+    Requests matching the shown (or already pending) state are suppressed, and
+    requests arriving within 'frameBudget' seconds of the last push stay pending
+    until the next flush, replacing any earlier pending request. 'emitted' and
+    'suppressed' count UI calls made and avoided since the stroke began (every
+    request not pushed, or still pending, is suppressed exactly once).
+    """
+
+    def __init__(self, frameBudget:float=1 / 60):
+        self.frameBudget = frameBudget
+        self.shown = {}
+        self.pending = {}
+        self.lastPushTime = 0
+        self.requested = 0
+        self.emitted = 0
+        self.lastStroke = None
+
+    @property
+    def suppressed(self):
+        return self.requested - self.emitted - len(self.pending)
+
+    def request(self, attr:str, target, value):
+        self.requested += 1
+        if attr in self.pending:
+            if self.pending[attr][1] == value:
+                return
+            # earlier request is never shown
+            del self.pending[attr]
+        if attr in self.shown and self.shown[attr] == value:
+            return
+        self.pending[attr] = (target, value)
+        self.flush()
+
+    def setHeader(self, area, text:str):
+        self.request("header", area, text)
+
+    def setCursor(self, window, cursor:str):
+        self.request("cursor", window, cursor)
+
+    def flush(self, force:bool=False):
+        """ push pending changes (if a frame has passed since the last push, or 'force') """
+        if not self.pending:
+            return
+        now = time.perf_counter()
+        if not force and now - self.lastPushTime < self.frameBudget:
+            return
+        for attr, (target, value) in self.pending.items():
+            if attr == "header":
+                set_header_text(target, value)
+            else:
+                target.cursor_set(value)
+            self.shown[attr] = value
+            self.emitted += 1
+        self.pending = {}
+        self.lastPushTime = now
+
+    def reset(self):
+        """ forget shown state, so the next requests are pushed (e.g. after Blender changed the cursor itself) """
+        self.shown = {}
+
+    def beginStroke(self):
+        self.requested = len(self.pending)
+        self.emitted = 0
+
+    def endStroke(self):
+        """ store UI call counts for the finished stroke in 'lastStroke' """
+        self.lastStroke = {"emitted": self.emitted, "suppressed": self.suppressed}
+        return self.lastStroke
+
+
+class RegionIndex:
+    """ spatial hash of VIEW_3D window regions for constant time point-in-region lookups
+
+    Region rectangles are bucketed into square cells of 'cellSize' pixels. Areas
+    and regions are stored by index (never by reference) and re-fetched on a hit
+    to verify the rectangle still matches. Misses are checked against the layout
+    signature (type and rect of every area's regions) and cached by point while
+    the screen pointer and signature stay the same, so the screen is only walked
+    again to rebuild the index after the layout actually changes.
+    """
+
+    def __init__(self, cellSize:int=128, maxMisses:int=4096):
+        self.cellSize = cellSize
+        self.maxMisses = maxMisses
+        self.screenPointer = None
+        self.signature = None
+        self.buckets = {}
+        self.missedPoints = set()
+        self.hits = 0
+        self.missHits = 0
+        self.rebuilds = 0
+
+    @staticmethod
+    def getLayoutSignature(screen):
+        """ get hashable summary of the area/region layout of screen """
+        return tuple((area.type, tuple((region.type, region.x, region.y, region.width, region.height) for region in area.regions)) for area in screen.areas)
+
+    def rebuild(self, screen, signature:tuple=None):
+        """ index window regions of all VIEW_3D areas in screen """
+        self.rebuilds += 1
+        self.screenPointer = screen.as_pointer()
+        self.signature = signature or self.getLayoutSignature(screen)
+        self.buckets = {}
+        self.missedPoints = set()
+        cs = self.cellSize
+        for areaIdx, area in enumerate(screen.areas):
+            if area.type != "VIEW_3D":
+                continue
+            is_quadview = len(area.spaces.active.region_quadviews) == 0
+            i = -1
+            for regionIdx, region in enumerate(area.regions):
+                if region.type != "WINDOW":
+                    continue
+                i += 1
+                x0, y0 = region.x, region.y
+                x1, y1 = x0 + region.width, y0 + region.height
+                entry = (x0, y0, x1, y1, areaIdx, regionIdx, None if is_quadview else i)
+                for bx in range(x0 // cs, (x1 - 1) // cs + 1):
+                    for by in range(y0 // cs, (y1 - 1) // cs + 1):
+                        self.buckets.setdefault((bx, by), []).append(entry)
+
+    def find(self, screen, x:int, y:int):
+        """ find (space, quadview index) in current index; None if missed, False if stale """
+        for x0, y0, x1, y1, areaIdx, regionIdx, i in self.buckets.get((x // self.cellSize, y // self.cellSize), ()):
+            if not (x0 <= x < x1 and y0 <= y < y1):
+                continue
+            try:
+                area = screen.areas[areaIdx]
+                region = area.regions[regionIdx]
+            except IndexError:
+                return False
+            if area.type != "VIEW_3D" or (region.x, region.y, region.x + region.width, region.y + region.height) != (x0, y0, x1, y1):
+                return False
+            return (area.spaces.active, i)
+        return None
+
+    def lookup(self, screen, x:int, y:int):
+        """ get (space, quadview index) of VIEW_3D window region under window coordinate x,y """
+        signature = None
+        if screen.as_pointer() == self.screenPointer:
+            result = self.find(screen, x, y)
+            if result:
+                self.hits += 1
+                return result
+            if result is None:
+                if (x, y) in self.missedPoints:
+                    self.missHits += 1
+                    return (None, None)
+                signature = self.getLayoutSignature(screen)
+                if signature == self.signature:
+                    # layout unchanged, so the point is outside every VIEW_3D window region
+                    if len(self.missedPoints) >= self.maxMisses:
+                        self.missedPoints = set()
+                    self.missedPoints.add((x, y))
+                    self.missHits += 1
+                    return (None, None)
+        self.rebuild(screen, signature)
+        return self.find(screen, x, y) or (None, None)
+
+
+class StrokeProxyDrawer:
+    """ draws wireframe boxes in the 3D viewport as stand-ins for bricks that don't exist yet """
+
+    def __init__(self, color:tuple=(0.1, 0.6, 1.0, 0.9)):
+        self.color = color
+        self.coords = []
+        self.batch = None
+        self.handle = None
+
+    def start(self):
+        if self.handle is None:
+            self.handle = bpy.types.SpaceView3D.draw_handler_add(self.draw, (), "WINDOW", "POST_VIEW")
+
+    def stop(self):
+        if self.handle is not None:
+            bpy.types.SpaceView3D.draw_handler_remove(self.handle, "WINDOW")
+            self.handle = None
+
+    def addBox(self, corners:list):
+        """ add box from its 8 world space corners (ordered x-major, z-minor) """
+        self.coords += [tuple(corners[i]) for edge in BOX_EDGES for i in edge]
+        self.batch = None
+
+    def clear(self):
+        self.coords = []
+        self.batch = None
+
+    def draw(self):
+        if self.coords:
+            self.batch = draw_lines(self.coords, self.color, self.batch)
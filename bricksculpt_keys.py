@@ -0,0 +1,149 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# System imports
+# NONE!
+
+# Blender imports
+# NONE!
+
+# Addon imports
+# NONE!
+
+
+# bits per packed coordinate; coordinates are biased so -2^20 <= c < 2^20 packs as a non-negative field
+KEY_BITS = 21
+KEY_BIAS = 1 << (KEY_BITS - 1)
+KEY_MASK = (1 << KEY_BITS) - 1
+
+
+def packKey(x:int, y:int, z:int):
+    """ pack grid location into one int (adding packed offsets moves the location while it stays in range) """
+    return (x + KEY_BIAS) | ((y + KEY_BIAS) << KEY_BITS) | ((z + KEY_BIAS) << (2 * KEY_BITS))
+
+
+def unpackKey(packed:int):
+    """ get (x, y, z) grid location of packed key """
+    return ((packed & KEY_MASK) - KEY_BIAS, ((packed >> KEY_BITS) & KEY_MASK) - KEY_BIAS, (packed >> (2 * KEY_BITS)) - KEY_BIAS)
+
+
+def packOffset(dx:int, dy:int, dz:int):
+    """ packed delta for moving a packed key by (dx, dy, dz) """
+    return dx + (dy << KEY_BITS) + (dz << (2 * KEY_BITS))
+
+
+def strToPacked(key:str):
+    """ pack bricksDict key ('x,y,z') """
+    x, y, z = key.split(",")
+    return packKey(int(x), int(y), int(z))
+
+
+def packedToStr(packed:int):
+    """ get bricksDict key ('x,y,z') of packed key """
+    return "%d,%d,%d" % unpackKey(packed)
+
+
+# grid offsets (and packed offsets) to the six face neighbors of a cell
+NEIGHBOR_LOCS = ((-1, 0, 0), (1, 0, 0), (0, -1, 0), (0, 1, 0), (0, 0, -1), (0, 0, 1))
+NEIGHBOR_OFFSETS = tuple(packOffset(*d) for d in NEIGHBOR_LOCS)
+
+
+class PackedKeyList:
+    """ list of bricksDict keys, or of brick names ending in keys, stored as packed ints
+
+    Behaves like the list of strings it replaces (append, extend, +=, 'in',
+    iteration, indexing and slicing yield strings), so it can be handed to
+    code expecting a list. Names are stored without the shared prefix of the
+    model's brick names ('Bricker_<model>__'), taken from the first name added.
+    Membership tests use a count of each packed key instead of a list scan.
+    """
+
+    def __init__(self, items:iter=(), names:bool=False):
+        self.names = names
+        self.prefix = "" if not names else None
+        self.packed = []
+        self.counts = {}
+        self.extend(items)
+
+    def pack(self, item:str):
+        if not self.names:
+            return strToPacked(item)
+        i = item.rindex("__") + 2
+        if self.prefix is None:
+            self.prefix = item[:i]
+        elif item[:i] != self.prefix:
+            raise ValueError("Brick name '%(item)s' does not belong to the same model as '%(prefix)s'" % {"item": item, "prefix": self.prefix})
+        return strToPacked(item[i:])
+
+    def unpack(self, packed:int):
+        return self.prefix + packedToStr(packed)
+
+    def append(self, item:str):
+        packed = self.pack(item)
+        self.packed.append(packed)
+        self.counts[packed] = self.counts.get(packed, 0) + 1
+
+    def extend(self, items:iter):
+        for item in items:
+            self.append(item)
+
+    def __iadd__(self, items:iter):
+        self.extend(items)
+        return self
+
+    def __contains__(self, item:str):
+        try:
+            return self.pack(item) in self.counts if self.prefix is not None else False
+        except ValueError:
+            return False
+
+    def __len__(self):
+        return len(self.packed)
+
+    def __iter__(self):
+        return (self.unpack(p) for p in self.packed)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.unpack(p) for p in self.packed[i]]
+        return self.unpack(self.packed[i])
+
+    def remove(self, item:str):
+        packed = self.pack(item)
+        self.packed.remove(packed)
+        self.counts[packed] -= 1
+        if self.counts[packed] == 0:
+            del self.counts[packed]
+
+    def clear(self):
+        self.packed = []
+        self.counts = {}
+
+    def keys(self):
+        """ get bricksDict keys of the items """
+        return [packedToStr(p) for p in self.packed]
+
+
+class PackedKeySet(PackedKeyList):
+    """ PackedKeyList that keeps only the first of duplicate items (an insertion ordered set) """
+
+    def append(self, item:str):
+        packed = self.pack(item)
+        if packed in self.counts:
+            return
+        self.packed.append(packed)
+        self.counts[packed] = 1
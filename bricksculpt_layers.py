@@ -0,0 +1,106 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# System imports
+# NONE!
+
+# Blender imports
+import bpy
+
+# Addon imports
+from ....lib.bricksDict.functions import *
+from ....functions.common.blender import *
+
+
+class BrickLayerIndex:
+    """ bricksDict keys by z layer, so a layer can be soloed by toggling whole layers
+
+    The bricksDict grid doesn't change during a sculpt session, so the index is
+    built once and bricks drawn in a layer are looked up when it is toggled. Once
+    a layer is soloed, switching to another layer only hides the bricks of the
+    old layer and shows the bricks of the new one, so bricks drawn in other
+    layers while a layer is soloed must be hidden with 'hideOutsideSolo'.
+    """
+
+    def __init__(self, bricksDict:dict):
+        self.bricksDict = bricksDict
+        self.layers = {}
+        for key in bricksDict.keys():
+            self.layers.setdefault(getDictLoc(bricksDict, key)[2], []).append(key)
+        self.soloed = None
+        self.numToggled = 0
+
+    def getLayerBricks(self, z:int):
+        """ get brick objects with their lowest cells in layer z """
+        for key in self.layers.get(z, ()):
+            brickD = self.bricksDict[key]
+            if brickD["draw"] and brickD["parent"] == "self":
+                obj = bpy.data.objects.get(brickD["name"])
+                if obj is not None:
+                    yield obj
+
+    def setLayerHidden(self, z:int, hidden:bool):
+        for obj in self.getLayerBricks(z):
+            if hidden:
+                hide(obj, render=False)
+            else:
+                unhide(obj, render=False)
+        self.numToggled += 1
+
+    def solo(self, z:int):
+        """ show only the bricks in layer z; returns list of layers whose visibility changed """
+        if z == self.soloed:
+            return []
+        if self.soloed is None:
+            changed = [l for l in self.layers if l != z]
+            for l in changed:
+                self.setLayerHidden(l, True)
+        else:
+            changed = [self.soloed, z]
+            self.setLayerHidden(self.soloed, True)
+            self.setLayerHidden(z, False)
+        self.soloed = z
+        return changed
+
+    def hideOutsideSolo(self, keys:iter):
+        """ hide bricks drawn at keys whose lowest cells aren't in the soloed layer; returns list of their layers """
+        if self.soloed is None:
+            return []
+        changed = set()
+        for key in keys:
+            brickD = self.bricksDict.get(key)
+            if brickD is None or not brickD["draw"]:
+                continue
+            parentKey = key if brickD["parent"] == "self" else brickD["parent"]
+            z = getDictLoc(self.bricksDict, parentKey)[2]
+            if z == self.soloed:
+                continue
+            obj = bpy.data.objects.get(self.bricksDict[parentKey]["name"])
+            if obj is not None:
+                hide(obj, render=False)
+                changed.add(z)
+        return sorted(changed)
+
+    def unsolo(self):
+        """ show bricks in all layers again; returns list of layers whose visibility changed """
+        if self.soloed is None:
+            return []
+        changed = [l for l in self.layers if l != self.soloed]
+        for l in changed:
+            self.setLayerHidden(l, False)
+        self.soloed = None
+        return changed
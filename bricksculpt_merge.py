@@ -0,0 +1,107 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# System imports
+import time
+from collections import OrderedDict, deque
+
+# Blender imports
+# NONE!
+
+# Addon imports
+from .bricksculpt_keys import *
+
+
+def groupAdjacentBricks(bricksDict:dict, keys:iter, maxKeys:int=None):
+    """ split keys of bricks into groups of bricks touching each other (bricks in different groups can't merge)
+
+    Groups are grown breadth first from their first brick, so with 'maxKeys'
+    a large connected group is cut into spatially compact pieces of at most
+    that many bricks (bricks in different pieces aren't merged together).
+    """
+    keys = list(OrderedDict.fromkeys(k for k in keys if k in bricksDict))
+    # packed cell -> index of the brick covering it
+    cellOwners = {}
+    for i, key in enumerate(keys):
+        x, y, z = (int(c) for c in key.split(","))
+        sx, sy, sz = bricksDict[key]["size"] if bricksDict[key]["parent"] == "self" else (1, 1, 1)
+        for dx in range(sx):
+            for dy in range(sy):
+                for dz in range(sz):
+                    cellOwners[packKey(x + dx, y + dy, z + dz)] = i
+    brickCells = {}
+    for cell, i in cellOwners.items():
+        brickCells.setdefault(i, []).append(cell)
+    groups = []
+    seen = set()
+    for i in range(len(keys)):
+        if i in seen:
+            continue
+        seen.add(i)
+        group = []
+        queue = deque((i,))
+        while queue:
+            j = queue.popleft()
+            group.append(keys[j])
+            if maxKeys is not None and len(group) >= maxKeys:
+                # leave bricks reached but not taken for the next pieces
+                seen.difference_update(queue)
+                break
+            for cell in brickCells.get(j, ()):
+                for offset in NEIGHBOR_OFFSETS:
+                    k = cellOwners.get(cell + offset)
+                    if k is not None and k not in seen:
+                        seen.add(k)
+                        queue.append(k)
+        groups.append(group)
+    return groups
+
+
+class MergeQueue:
+    """ merges queued on stroke release, handed to the main thread a group of touching bricks at a time
+
+    Merging itself is left to Bricker's mergeBrick; the queue only spreads
+    one big release merge over several events, so the viewport keeps
+    responding in between. Groups larger than 'maxKeys' bricks (e.g. a long
+    connected stroke) are split into spatially compact pieces, so one event
+    never merges more than 'maxKeys' bricks.
+    """
+
+    def __init__(self, maxKeys:int=64):
+        self.maxKeys = maxKeys
+        self.pending = deque()
+
+    def submit(self, bricksDict:dict, keys:list, mode:str):
+        """ queue merge of bricks at given keys """
+        self.pending.extend((group, mode) for group in groupAdjacentBricks(bricksDict, keys, self.maxKeys) if len(group) > 1)
+
+    def busy(self):
+        return len(self.pending) > 0
+
+    def pop(self, bricksDict:dict, timeBudget:float=None):
+        """ yield queued (keys, mode) groups, stopping after 'timeBudget' seconds (at least one group is yielded) """
+        t0 = time.perf_counter()
+        numYielded = 0
+        while self.pending:
+            if numYielded > 0 and timeBudget is not None and time.perf_counter() - t0 >= timeBudget:
+                break
+            keys, mode = self.pending.popleft()
+            # skip bricks removed since the merge was queued
+            keys = [k for k in keys if k in bricksDict and bricksDict[k]["draw"]]
+            if len(keys) > 1:
+                numYielded += 1
+                yield keys, mode
@@ -0,0 +1,187 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# System imports
+import numpy as np
+
+# Blender imports
+# NONE!
+
+# Addon imports
+from ....lib.bricksDict.functions import *
+from .bricksculpt_keys import *
+from .bricksculpt_store import *
+
+
+# footprints (in cells) of bricks 1x1 bricks may be merged into, largest first
+MERGE_BRICK_SIZES = sorted(set(s for w, d in ((1, 1), (1, 2), (1, 3), (1, 4), (1, 6), (1, 8), (2, 2), (2, 3), (2, 4), (2, 6), (2, 8), (2, 10)) for s in ((w, d), (d, w))), key=lambda s: (-s[0] * s[1], s))
+
+
+class OccupancyGrid:
+    """ dense NumPy mirror of which brick (if any) is drawn in each bricksDict cell
+
+    'parent' holds the packed key of the brick occupying each cell (-1 where
+    nothing is drawn), 'mat' and 'height' hold the material index (into
+    'matNames') and height of that brick, and 'single' whether it has a 1x1
+    footprint. The bricksDict grid doesn't change
+    shape during a session, so arrays are allocated once and edited cells
+    are refreshed with 'update'. Columnar (and chunked) bricksDicts fill the
+    arrays straight from their columns, without reading entries.
+    """
+
+    def __init__(self, bricksDict:dict):
+        self.bricksDict = bricksDict
+        store = getBackingStore(bricksDict)
+        if store is not None:
+            locs = store.getLocs(store.getLiveRows())
+        else:
+            locs = np.array([getDictLoc(bricksDict, k) for k in bricksDict.keys()], dtype=np.int64).reshape((-1, 3))
+        self.min = locs.min(axis=0) if len(locs) else np.zeros(3, dtype=np.int64)
+        shape = tuple(locs.max(axis=0) - self.min + 1) if len(locs) else (0, 0, 0)
+        self.parent = np.full(shape, -1, dtype=np.int64)
+        self.mat = np.full(shape, -1, dtype=np.int32)
+        self.height = np.zeros(shape, dtype=np.int16)
+        self.single = np.zeros(shape, dtype=bool)
+        self.matNames = []
+        self.matIndices = {}
+        if store is not None:
+            self.fillFromStore(store)
+        else:
+            for key in bricksDict.keys():
+                self.updateCell(key)
+
+    def fillFromStore(self, store:ColumnarBricksDict):
+        """ fill cells of all drawn entries of store at once """
+        rows = store.getLiveRows()
+        rows = rows[store.draw[rows]]
+        idx = tuple((store.getLocs(rows) - self.min).T)
+        parentRows = store.getParentRows(rows)
+        # map material indices of the store to ours
+        storeMats = store.mat[parentRows]
+        matIndices = np.full(len(store.matNames), -1, dtype=np.int32)
+        for i in np.unique(storeMats):
+            matIndices[i] = self.getMatIndex(store.matNames[i])
+        sizes = store.size[parentRows]
+        self.parent[idx] = store.key[parentRows]
+        self.mat[idx] = matIndices[storeMats]
+        self.height[idx] = sizes[:, 2]
+        self.single[idx] = (sizes[:, 0] == 1) & (sizes[:, 1] == 1)
+
+    def getMatIndex(self, matName:str):
+        idx = self.matIndices.get(matName)
+        if idx is None:
+            idx = self.matIndices[matName] = len(self.matNames)
+            self.matNames.append(matName)
+        return idx
+
+    def toIndex(self, loc:list):
+        """ array index of grid location (None if outside the grid) """
+        idx = tuple(int(c - m) for c, m in zip(loc, self.min))
+        return idx if all(0 <= i < s for i, s in zip(idx, self.parent.shape)) else None
+
+    def updateCell(self, key:str):
+        idx = self.toIndex(getDictLoc(self.bricksDict, key))
+        brickD = self.bricksDict[key]
+        if not brickD["draw"]:
+            self.parent[idx], self.mat[idx], self.height[idx], self.single[idx] = -1, -1, 0, False
+            return
+        parentKey = key if brickD["parent"] in ("self", None) else brickD["parent"]
+        parentD = self.bricksDict[parentKey]
+        self.parent[idx] = strToPacked(parentKey)
+        self.mat[idx] = self.getMatIndex(parentD["mat_name"])
+        self.height[idx] = parentD["size"][2]
+        self.single[idx] = parentD["size"][0] == 1 and parentD["size"][1] == 1
+
+    def update(self, keys:iter):
+        """ refresh cells at keys from bricksDict (with all cells of the bricks drawn there) """
+        cells = set()
+        for key in keys:
+            brickD = self.bricksDict.get(key)
+            if brickD is None:
+                continue
+            cells.add(key)
+            if brickD["draw"] and brickD["parent"] == "self":
+                x, y, z = getDictLoc(self.bricksDict, key)
+                sx, sy, sz = brickD["size"]
+                cells.update(k for k in ("%d,%d,%d" % (x + i, y + j, z + l) for i in range(sx) for j in range(sy) for l in range(sz)) if k in self.bricksDict)
+        for key in cells:
+            self.updateCell(key)
+
+    def isOccupied(self, loc:list):
+        idx = self.toIndex(loc)
+        return idx is not None and self.parent[idx] != -1
+
+    def getNeighborhood(self, loc:list, radius:int=1):
+        """ boolean occupancy of the cube of cells within 'radius' of loc (cells outside the grid are empty) """
+        size = 2 * radius + 1
+        out = np.zeros((size,) * 3, dtype=bool)
+        lo = np.array(loc) - self.min - radius
+        src0 = np.maximum(lo, 0)
+        src1 = np.minimum(lo + size, self.parent.shape)
+        if np.any(src1 <= src0):
+            return out
+        dst0 = src0 - lo
+        dst1 = dst0 + (src1 - src0)
+        out[dst0[0]:dst1[0], dst0[1]:dst1[1], dst0[2]:dst1[2]] = self.parent[src0[0]:src1[0], src0[1]:src1[1], src0[2]:src1[2]] != -1
+        return out
+
+    def getOccupiedNeighbors(self, loc:list):
+        """ locations of the occupied cells among the 26 neighbors of loc """
+        occupied = self.getNeighborhood(loc)
+        occupied[1, 1, 1] = False
+        return [tuple(int(c) for c in np.array(loc) + offset - 1) for offset in np.argwhere(occupied)]
+
+    def getLargestMergeableSize(self, loc:list, brickSizes:list=MERGE_BRICK_SIZES):
+        """ largest footprint (loc, [w, d]) from brickSizes of 1x1 bricks like the one at loc, covering it (None if loc holds no 1x1 brick) """
+        idx = self.toIndex(loc)
+        if idx is None or not self.single[idx] or self.parent[idx] != packKey(*loc):
+            return None
+        x, y, z = idx
+        # 1x1 bricks starting in layer z with the same material and height
+        xs, ys = np.indices(self.parent.shape[:2])
+        mask = self.single[:, :, z] & (self.parent[:, :, z] == packKey(xs + self.min[0], ys + self.min[1], z + self.min[2]))
+        mask &= (self.mat[:, :, z] == self.mat[idx]) & (self.height[:, :, z] == self.height[idx])
+        for w, d in brickSizes:
+            for x0 in range(max(0, x - w + 1), min(x, mask.shape[0] - w) + 1):
+                for y0 in range(max(0, y - d + 1), min(y, mask.shape[1] - d) + 1):
+                    if mask[x0:x0 + w, y0:y0 + d].all():
+                        return [int(x0 + self.min[0]), int(y0 + self.min[1]), int(z + self.min[2])], [w, d]
+        return None
+
+    def getBricksInBrush(self, center:list, radius:float, shape:str="SPHERE", height:int=1):
+        """ keys of bricks with cells within 'radius' of center, nearest first
+
+        shape -- 'SPHERE' (distance in all three axes) or 'CYLINDER' (distance in
+                 x/y, over the 'height' layers starting at center)
+        """
+        r = int(np.floor(radius))
+        lo = np.array(center) - self.min - [r, r, 0 if shape == "CYLINDER" else r]
+        hi = np.array(center) - self.min + [r + 1, r + 1, height if shape == "CYLINDER" else r + 1]
+        lo = np.maximum(lo, 0)
+        hi = np.minimum(hi, self.parent.shape)
+        if np.any(hi <= lo):
+            return []
+        parents = self.parent[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+        # squared distance of each cell in the box from center
+        dx, dy, dz = (np.arange(lo[i], hi[i]) - (center[i] - self.min[i]) for i in range(3))
+        dist2 = dx[:, None, None] ** 2 + dy[None, :, None] ** 2 + (0 if shape == "CYLINDER" else dz[None, None, :] ** 2)
+        dist2 = np.broadcast_to(dist2, parents.shape)
+        mask = (dist2 <= radius ** 2) & (parents != -1)
+        hits = parents[mask][np.argsort(dist2[mask], kind="stable")]
+        # first (nearest) cell of each brick
+        first = np.unique(hits, return_index=True)[1]
+        return [packedToStr(int(p)) for p in hits[np.sort(first)]]
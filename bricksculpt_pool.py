@@ -0,0 +1,297 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# System imports
+import sys
+from collections import OrderedDict
+
+# Blender imports
+import bpy
+
+# Addon imports
+from ....functions.common import blender as common_blender
+from ....functions.common.blender import *
+from ....functions.common.wrappers import blender_version_wrapper
+
+
+@blender_version_wrapper('<=','2.79')
+def getObjLinks(obj):
+    """ get scenes and groups obj is linked to (each has 'objects.link'/'objects.unlink') """
+    return list(obj.users_scene) + list(obj.users_group)
+@blender_version_wrapper('>=','2.80')
+def getObjLinks(obj):
+    """ get collections obj is linked to (each has 'objects.link'/'objects.unlink') """
+    return list(obj.users_collection)
+
+
+class BrickObjectPool:
+    """ recycles removed brick objects for bricks of the same signature
+
+    Released objects are hidden, unlinked and renamed out of the way of the
+    model's brick names; acquiring one renames it and links it back where it
+    was. Beyond 'maxSize' pooled objects, the longest pooled ones are removed.
+    While hooked ('hook'), Bricker's 'delete'/'duplicate' are wrapped, so the
+    pool takes brick objects deleted by Bricker, for which
+    'getSignature(obj)' returns a signature, and hands them out again as
+    duplicates. Bricker draws new meshes into acquired objects, so their
+    pooled meshes are removed once replaced ('freeReplacedMeshes').
+    """
+
+    def __init__(self, maxSize:int=256, getSignature=None):
+        self.maxSize = maxSize
+        self.getSignature = getSignature
+        # pool name -> (signature, links), oldest first
+        self.free = OrderedDict()
+        self.bySignature = {}
+        # name -> pooled mesh of objects acquired for Bricker to draw into
+        self.acquiredMeshes = {}
+        self.numReleased = 0
+        # (module, name, original, wrapper) of the functions replaced by 'hook'
+        self.hooked = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def release(self, obj, signature:tuple):
+        """ take removed brick object into the pool instead of deleting it """
+        links = getObjLinks(obj)
+        for link in links:
+            link.objects.unlink(obj)
+        hide(obj)
+        self.numReleased += 1
+        obj.name = "Bricker_pooled_%d" % self.numReleased
+        name = obj.name
+        self.free[name] = (signature, links)
+        self.bySignature.setdefault(signature, OrderedDict())[name] = None
+        while len(self.free) > self.maxSize:
+            self.evict(next(iter(self.free)))
+
+    def acquire(self, signature:tuple, name:str, relink:bool=True):
+        """ get pooled object for brick with given signature, renamed to 'name' and relinked (None if pool has none) """
+        names = self.bySignature.get(signature)
+        while names:
+            poolName, _ = names.popitem(last=False)
+            signature, links = self.free.pop(poolName)
+            obj = bpy.data.objects.get(poolName)
+            if obj is None:
+                # removed outside of the pool
+                continue
+            obj.name = name
+            if relink:
+                for link in links:
+                    link.objects.link(obj)
+                if obj.data is not None:
+                    self.acquiredMeshes[obj.name] = obj.data
+            unhide(obj)
+            self.hits += 1
+            return obj
+        self.misses += 1
+        return None
+
+    def recycle(self, obj):
+        """ pool obj instead of deleting it (returns False if it isn't a brick the pool takes) """
+        signature = self.getSignature(obj) if self.getSignature is not None else None
+        if signature is None:
+            return False
+        self.release(obj, signature)
+        return True
+
+    def reuse(self, obj, linked:bool=False):
+        """ get pooled object set up as an unlinked copy of obj (None if the pool has none) """
+        signature = self.getSignature(obj) if self.getSignature is not None else None
+        copy = self.acquire(signature, obj.name, relink=False) if signature is not None else None
+        if copy is None:
+            return None
+        self.replaceMesh(copy, obj.data if linked or obj.data is None else obj.data.copy())
+        copy.parent = obj.parent
+        copy.matrix_world = obj.matrix_world.copy()
+        return copy
+
+    def replaceMesh(self, obj, mesh):
+        """ switch obj to mesh, removing its old mesh if nothing else uses it """
+        oldMesh = obj.data
+        obj.data = mesh
+        if oldMesh is not None and oldMesh is not mesh and oldMesh.users == 0:
+            bpy.data.meshes.remove(oldMesh)
+
+    def freeReplacedMeshes(self):
+        """ remove pooled meshes of acquired objects that were drawn with new meshes (if nothing else uses them) """
+        for name, mesh in self.acquiredMeshes.items():
+            obj = bpy.data.objects.get(name)
+            if (obj is None or obj.data is not mesh) and bpy.data.meshes.get(mesh.name) is mesh and mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+        self.acquiredMeshes.clear()
+
+    def evict(self, poolName:str):
+        """ remove pooled object and its mesh (if nothing else uses it) """
+        signature, links = self.free.pop(poolName)
+        del self.bySignature[signature][poolName]
+        obj = bpy.data.objects.get(poolName)
+        if obj is not None:
+            # removed directly, since a hooked 'delete' would hand it back to the pool
+            mesh = obj.data
+            bpy.data.objects.remove(obj, do_unlink=True)
+            if mesh is not None and mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+        self.evictions += 1
+
+    def hook(self):
+        """ wrap Bricker's 'delete'/'duplicate' with the pool, in every loaded module of the addon that imported them
+
+        Returns False (hooking nothing) if Bricker doesn't have both functions.
+        Modules imported later keep the originals; 'unhook' restores them.
+        """
+        if self.hooked is not None:
+            return True
+        originals = {name: getattr(common_blender, name, None) for name in ("delete", "duplicate")}
+        if None in originals.values():
+            return False
+        wrappers = {"delete": self.wrapDelete(originals["delete"]), "duplicate": self.wrapDuplicate(originals["duplicate"])}
+        self.hooked = []
+        root = __name__.split(".")[0]
+        for moduleName, module in list(sys.modules.items()):
+            if module is None or moduleName.split(".")[0] != root:
+                continue
+            moduleVars = vars(module)
+            for attr, value in list(moduleVars.items()):
+                for name, fn in originals.items():
+                    if value is fn:
+                        moduleVars[attr] = wrappers[name]
+                        self.hooked.append((module, attr, fn, wrappers[name]))
+        return True
+
+    def unhook(self):
+        """ restore the functions wrapped by 'hook' """
+        for module, attr, fn, wrapper in self.hooked or ():
+            if getattr(module, attr, None) is wrapper:
+                setattr(module, attr, fn)
+        self.hooked = None
+
+    def wrapDelete(self, delete):
+        def pooledDelete(objs, remove_meshes:bool=False):
+            """ efficient deletion of objects (brick objects are pooled instead) """
+            delete([obj for obj in confirmIter(objs) if obj is not None and not self.recycle(obj)], remove_meshes)
+        return pooledDelete
+
+    def wrapDuplicate(self, duplicate):
+        def pooledDuplicate(obj, linked:bool=False, link_to_scene:bool=False):
+            """ efficient duplication of objects (pooled brick objects are reused) """
+            copy = self.reuse(obj, linked)
+            if copy is None:
+                return duplicate(obj, linked=linked, link_to_scene=link_to_scene)
+            unhide(copy, render=False)
+            if link_to_scene:
+                link_object(copy)
+            return copy
+        return pooledDuplicate
+
+    def clear(self):
+        while self.free:
+            self.evict(next(iter(self.free)))
+        self.acquiredMeshes.clear()
+
+    def stats(self):
+        return {"pooled": len(self.free), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def __len__(self):
+        return len(self.free)
+
+
+# model settings that change the geometry of every brick
+MESH_SETTINGS = ("brickHeight", "gap", "studDetail", "logoType", "logoResolution", "logoDecimate", "logoScale", "logoInset", "hiddenUndersideDetail", "exposedUndersideDetail", "circleVerts", "bevelAdded", "bevelWidth", "bevelSegments", "bevelProfile")
+
+# bricksDict fields that change the geometry (or mesh materials) of a single brick
+MESH_FIELDS = ("size", "type", "mat_name", "top_exposed", "bot_exposed", "flipped", "rotated")
+
+
+def getMeshSignature(cm, brickD:dict):
+    """ signature of brick geometry; None if bricks of the model can't share meshes (random offsets) """
+    if getattr(cm, "randomLoc", 0) or getattr(cm, "randomRot", 0):
+        return None
+    return tuple(getattr(cm, s, None) for s in MESH_SETTINGS) + tuple(tuple(brickD[f]) if f == "size" else brickD.get(f) for f in MESH_FIELDS)
+
+
+class SharedMeshCache:
+    """ least recently used meshes by brick signature, so bricks with identical geometry share one mesh
+
+    The first brick drawn with a signature donates its mesh to the cache; later
+    bricks with that signature are switched to the cached mesh and their own
+    mesh is removed once unused. Beyond 'maxSize' signatures, the least recently
+    used ones are forgotten (their meshes stay with the bricks using them).
+    """
+
+    def __init__(self, maxSize:int=128):
+        self.maxSize = maxSize
+        # signature -> (mesh name, mesh pointer), least recently used first
+        self.meshes = OrderedDict()
+        self.pending = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.numFreed = 0
+
+    def queue(self, keys:iter):
+        """ queue bricksDict keys whose bricks should be checked on the next 'shareMeshes' """
+        for key in keys:
+            self.pending[key] = None
+
+    def getMesh(self, signature:tuple):
+        name, pointer = self.meshes.get(signature, (None, None))
+        mesh = bpy.data.meshes.get(name) if name is not None else None
+        # a removed mesh's name may have been taken by a new mesh
+        if mesh is None or mesh.as_pointer() != pointer:
+            return None
+        self.meshes.move_to_end(signature)
+        return mesh
+
+    def share(self, obj, signature:tuple):
+        """ switch obj to cached mesh for signature (or cache obj's mesh); returns True if switched """
+        mesh = self.getMesh(signature)
+        if mesh is None:
+            self.misses += 1
+            self.meshes[signature] = (obj.data.name, obj.data.as_pointer())
+            while len(self.meshes) > self.maxSize:
+                self.meshes.popitem(last=False)
+                self.evictions += 1
+            return False
+        if obj.data is mesh:
+            return False
+        oldMesh = obj.data
+        obj.data = mesh
+        self.hits += 1
+        if oldMesh.users == 0:
+            bpy.data.meshes.remove(oldMesh)
+            self.numFreed += 1
+        return True
+
+    def shareMeshes(self, cm, bricksDict:dict):
+        """ share meshes of bricks drawn at queued keys """
+        parentKeys = OrderedDict()
+        for key in self.pending:
+            brickD = bricksDict.get(key)
+            if brickD is not None and brickD["draw"]:
+                parentKeys[key if brickD["parent"] == "self" else brickD["parent"]] = None
+        self.pending.clear()
+        for key in parentKeys:
+            brickD = bricksDict[key]
+            obj = bpy.data.objects.get(brickD["name"])
+            signature = getMeshSignature(cm, brickD)
+            if obj is not None and obj.data is not None and signature is not None:
+                self.share(obj, signature)
+
+    def stats(self):
+        return {"meshes": len(self.meshes), "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "freed": self.numFreed}
@@ -0,0 +1,120 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# System imports
+import json
+import math
+import time
+from collections import OrderedDict
+
+# Blender imports
+# NONE!
+
+# Addon imports
+# NONE!
+
+
+# nanosecond timer (perf_counter_ns is new in Python 3.7)
+perf_counter_ns = getattr(time, "perf_counter_ns", None) or (lambda: int(time.perf_counter() * 1000000000))
+
+
+def percentile(sortedSamples:list, p:float):
+    """ nearest-rank percentile of sorted list """
+    return sortedSamples[max(0, int(math.ceil(p / 100 * len(sortedSamples))) - 1)]
+
+
+class _NullPhase:
+    """ stands in for PhaseTimer while profiling is disabled """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_PHASE = _NullPhase()
+
+
+class PhaseTimer:
+    """ times one run of a phase and adds it to the profiler """
+
+    def __init__(self, profiler, name:str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = perf_counter_ns()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.add(self.name, perf_counter_ns() - self.t0)
+        return False
+
+
+class PhaseProfiler:
+    """ per-phase timings (in ns) of the modal loop, summarized as percentiles and log2 histograms """
+
+    def __init__(self):
+        self.samples = OrderedDict()
+
+    def phase(self, name:str):
+        return PhaseTimer(self, name)
+
+    def add(self, name:str, ns:int):
+        self.samples.setdefault(name, []).append(ns)
+
+    def histogram(self, name:str):
+        """ counts of samples per power of two bucket, keyed by bucket upper bound (in ns) """
+        counts = {}
+        for ns in self.samples[name]:
+            bucket = 1 << max(0, int(ns)).bit_length()
+            counts[bucket] = counts.get(bucket, 0) + 1
+        return OrderedDict(sorted(counts.items()))
+
+    def summary(self):
+        """ count, total, mean and p50/p95/p99/max (in ns) per phase """
+        summary = OrderedDict()
+        for name, samples in self.samples.items():
+            s = sorted(samples)
+            summary[name] = OrderedDict((
+                ("count", len(s)),
+                ("total", sum(s)),
+                ("mean", sum(s) / len(s)),
+                ("p50", percentile(s, 50)),
+                ("p95", percentile(s, 95)),
+                ("p99", percentile(s, 99)),
+                ("max", s[-1]),
+            ))
+        return summary
+
+    def report(self):
+        """ print summary table (in ms) """
+        print("%16s %8s %10s %10s %10s %10s %10s" % ("phase", "count", "total (ms)", "p50 (ms)", "p95 (ms)", "p99 (ms)", "max (ms)"))
+        for name, stats in self.summary().items():
+            print("%16s %8d %10.3f %10.4f %10.4f %10.4f %10.4f" % (name, stats["count"], stats["total"] / 1e6, stats["p50"] / 1e6, stats["p95"] / 1e6, stats["p99"] / 1e6, stats["max"] / 1e6))
+
+    def export(self, filepath:str):
+        """ write summary and histograms of all phases to JSON file """
+        summary = self.summary()
+        for name in summary:
+            summary[name]["histogram"] = [[bucket, count] for bucket, count in self.histogram(name).items()]
+        with open(filepath, "w") as f:
+            json.dump({"units": "ns", "phases": summary}, f, indent=2)
+
+    def clear(self):
+        self.samples.clear()
@@ -0,0 +1,438 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# System imports
+import bisect
+import numpy as np
+
+# Blender imports
+import bpy
+from mathutils import Vector
+from mathutils.bvhtree import BVHTree
+
+# Addon imports
+from ....lib.bricksDict.functions import *
+from ....functions.common.blender import *
+from ....functions.common.maths import mathutils_mult
+from .bricksculpt_store import *
+
+
+def ray_box_intersect(origin:Vector, inv_dir:tuple, box_min:tuple, box_max:tuple):
+    """ slab test; returns distance to entry point of box along ray (or None if missed) """
+    t_min = 0
+    t_max = float("inf")
+    for i in range(3):
+        t1 = (box_min[i] - origin[i]) * inv_dir[i]
+        t2 = (box_max[i] - origin[i]) * inv_dir[i]
+        if t1 > t2:
+            t1, t2 = t2, t1
+        t_min = max(t_min, t1)
+        t_max = min(t_max, t2)
+        if t_min > t_max:
+            return None
+    return t_min
+
+
+def safe_inverse(direction:Vector):
+    """ componentwise inverse of ray direction (axis-parallel rays get infinity) """
+    return tuple(1 / d if d != 0 else float("inf") for d in direction)
+
+
+@blender_version_wrapper('<=','2.79')
+def isBrickVisible(obj):
+    return not obj.hide
+@blender_version_wrapper('>=','2.80')
+def isBrickVisible(obj):
+    return isObjVisibleInViewport(obj)
+
+
+def getModelMatrix(bricksDict:dict):
+    """ get matrix from model-local space (bricksDict 'co') to world space """
+    for brickD in bricksDict.values():
+        if brickD["draw"] and brickD["parent"] == "self":
+            obj = bpy.data.objects.get(brickD["name"])
+            if obj is not None:
+                return obj.parent.matrix_world.copy() if obj.parent else None
+    return None
+
+
+class ViewRayCache:
+    """ mouse ray construction from inverted view matrices cached per view change
+
+    Mirrors bpy_extras.view3d_utils.region_2d_to_origin_3d/region_2d_to_vector_3d,
+    but the matrix inversions only rerun when the region size or the view or
+    perspective matrices change.
+    """
+
+    def __init__(self):
+        self.viewMatrix = None
+        self.perspectiveMatrix = None
+        self.viewPerspective = None
+        self.size = None
+        self.hits = 0
+        self.misses = 0
+
+    def update(self, region, rv3d):
+        """ recompute inverted matrices if the view changed """
+        viewMatrix = rv3d.view_matrix
+        perspectiveMatrix = rv3d.perspective_matrix
+        size = (region.width, region.height)
+        if (size == self.size and rv3d.view_perspective == self.viewPerspective and
+            viewMatrix == self.viewMatrix and perspectiveMatrix == self.perspectiveMatrix):
+            self.hits += 1
+            return
+        self.misses += 1
+        self.size = size
+        self.viewPerspective = rv3d.view_perspective
+        self.viewMatrix = viewMatrix.copy()
+        self.perspectiveMatrix = perspectiveMatrix.copy()
+        self.isPerspective = rv3d.is_perspective
+        viewInv = viewMatrix.inverted()
+        self.persInv = perspectiveMatrix.inverted()
+        self.viewOrigin = viewInv.translation.copy()
+        self.orthoVector = -viewInv.col[2].xyz.normalized()
+        # ortho rays start behind the view (this value is scaled to the far clip already)
+        self.orthoOffset = self.persInv.col[2].xyz if self.viewPerspective != "CAMERA" else Vector((0, 0, 0))
+
+    def getRay(self, region, rv3d, coord:tuple):
+        """ get origin and direction of ray through region coordinate """
+        self.update(region, rv3d)
+        dx = (2 * coord[0] / self.size[0]) - 1
+        dy = (2 * coord[1] / self.size[1]) - 1
+        if self.isPerspective:
+            out = Vector((dx, dy, -0.5))
+            w = out.dot(self.persInv[3].xyz) + self.persInv[3][3]
+            viewVector = (mathutils_mult(self.persInv, out) / w) - self.viewOrigin
+            viewVector.normalize()
+            return self.viewOrigin.copy(), viewVector
+        else:
+            origin = (self.persInv.col[0].xyz * dx) + (self.persInv.col[1].xyz * dy) + self.persInv.translation - self.orthoOffset
+            return origin, self.orthoVector.copy()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class BrickBVHChunk:
+    """ BVH tree over the visible bricks whose parent key falls in one grid chunk """
+
+    def __init__(self):
+        self.tree = None
+        self.names = []
+        self.polyOffsets = []
+        self.min = None
+        self.max = None
+
+    def build(self, names:list):
+        """ build world space BVH tree from the geometry of bricks with given names """
+        allVerts = []
+        allPolys = []
+        self.names = []
+        self.polyOffsets = []
+        for name in names:
+            obj = bpy.data.objects.get(name)
+            if obj is None or obj.type != "MESH" or not isBrickVisible(obj):
+                continue
+            mesh = obj.data
+            numVerts = len(mesh.vertices)
+            if numVerts == 0:
+                continue
+            # transform verts to world space
+            co = np.empty(numVerts * 3, dtype=np.float32)
+            mesh.vertices.foreach_get("co", co)
+            mx = np.array(obj.matrix_world)
+            co = co.reshape((numVerts, 3)) @ mx[:3, :3].T + mx[:3, 3]
+            # store polygons with vert indices offset into the chunk's vert list
+            vertOffset = len(allVerts)
+            self.names.append(name)
+            self.polyOffsets.append(len(allPolys))
+            allVerts += co.tolist()
+            allPolys += [[vertOffset + i for i in p.vertices] for p in mesh.polygons]
+        if len(allPolys) == 0:
+            self.tree = None
+            return
+        co = np.array(allVerts)
+        self.min = tuple(co.min(axis=0))
+        self.max = tuple(co.max(axis=0))
+        self.tree = BVHTree.FromPolygons(allVerts, allPolys)
+
+    def lookup(self, polyIdx:int):
+        """ get object name and object-local polygon index for chunk polygon index """
+        i = bisect.bisect_right(self.polyOffsets, polyIdx) - 1
+        return self.names[i], polyIdx - self.polyOffsets[i]
+
+
+class BrickBVH:
+    """ ray-cast engine over the geometry of a single Bricker model
+
+    Bricks are bucketed into cubic chunks of the bricksDict grid (by parent key),
+    each with its own BVH tree. Edits only mark the affected chunks dirty, and
+    dirty chunks are rebuilt lazily on the next ray cast. For columnar (and
+    chunked) bricksDicts, 'invalidate' buckets the brick names of all chunks
+    from the columns at once, so a full rebuild doesn't read every entry.
+    """
+
+    def __init__(self, bricksDict:dict, chunkSize:int=8):
+        self.bricksDict = bricksDict
+        self.chunkSize = chunkSize
+        self.chunks = {}
+        self.dirty = set()
+        # chunk -> brick names, for dirty chunks bucketed by 'invalidate'
+        self.dirtyNames = {}
+        self.invalidate()
+
+    def getChunkKey(self, loc:list):
+        return tuple(c // self.chunkSize for c in loc)
+
+    def invalidate(self):
+        """ mark every chunk containing a drawn brick as dirty """
+        self.dirty = set(self.chunks.keys())
+        store = getBackingStore(self.bricksDict)
+        if store is not None:
+            rows = store.getLiveRows()
+            rows = rows[store.draw[rows] & (store.parent[rows] == PARENT_SELF)]
+            self.dirtyNames = {}
+            for chunkKey, row in zip(map(tuple, (store.getLocs(rows) // self.chunkSize).tolist()), rows):
+                self.dirtyNames.setdefault(chunkKey, []).append(store.getField(row, "name"))
+            # built chunks left without bricks
+            for chunkKey in self.chunks:
+                self.dirtyNames.setdefault(chunkKey, [])
+            self.dirty.update(self.dirtyNames)
+            return
+        for key, brickD in self.bricksDict.items():
+            if brickD["draw"] and brickD["parent"] == "self":
+                self.dirty.add(self.getChunkKey(getDictLoc(self.bricksDict, key)))
+
+    def markDirty(self, keys:iter):
+        """ mark chunks owning the bricks at given keys (and their parents) as dirty """
+        for key in keys:
+            brickD = self.bricksDict.get(key)
+            if brickD is None:
+                continue
+            chunkKey = self.getChunkKey(getDictLoc(self.bricksDict, key))
+            self.dirty.add(chunkKey)
+            self.dirtyNames.pop(chunkKey, None)
+            parentKey = brickD["parent"]
+            if parentKey not in ("self", None):
+                chunkKey = self.getChunkKey(getDictLoc(self.bricksDict, parentKey))
+                self.dirty.add(chunkKey)
+                self.dirtyNames.pop(chunkKey, None)
+
+    def markDirtyAround(self, loc:list, size:list, margin:int=1):
+        """ mark chunks owning the bricks in the box covering a brick and its neighbors as dirty """
+        x0, y0, z0 = loc[0] - margin, loc[1] - margin, loc[2] - margin
+        x1, y1, z1 = loc[0] + size[0] + margin, loc[1] + size[1] + margin, loc[2] + size[2] + margin
+        self.markDirty("%(x)s,%(y)s,%(z)s" % locals() for x in range(x0, x1) for y in range(y0, y1) for z in range(z0, z1))
+
+    def getChunkBrickNames(self, chunkKey:tuple):
+        """ get names of parent bricks stored in the cells of given chunk """
+        names = []
+        s = self.chunkSize
+        cx, cy, cz = chunkKey
+        for x in range(cx * s, (cx + 1) * s):
+            for y in range(cy * s, (cy + 1) * s):
+                for z in range(cz * s, (cz + 1) * s):
+                    brickD = self.bricksDict.get("%(x)s,%(y)s,%(z)s" % locals())
+                    if brickD is not None and brickD["draw"] and brickD["parent"] == "self":
+                        names.append(brickD["name"])
+        return names
+
+    def rebuildDirty(self):
+        """ rebuild BVH trees for dirty chunks """
+        for chunkKey in self.dirty:
+            chunk = self.chunks.get(chunkKey) or BrickBVHChunk()
+            names = self.dirtyNames.get(chunkKey)
+            chunk.build(names if names is not None else self.getChunkBrickNames(chunkKey))
+            if chunk.tree is None:
+                self.chunks.pop(chunkKey, None)
+            else:
+                self.chunks[chunkKey] = chunk
+        self.dirty.clear()
+        self.dirtyNames = {}
+
+    def ray_cast(self, origin:Vector, direction:Vector, distance:float=1000000):
+        """ cast ray against model; returns (result, location, normal, index, object, matrix) like scene.ray_cast """
+        if self.dirty:
+            self.rebuildDirty()
+        # gather chunks whose bounds the ray passes through, nearest first
+        invDir = safe_inverse(direction)
+        candidates = []
+        for chunk in self.chunks.values():
+            t = ray_box_intersect(origin, invDir, chunk.min, chunk.max)
+            if t is not None and t <= distance:
+                candidates.append((t, id(chunk), chunk))
+        candidates.sort()
+        # find nearest hit, stopping once remaining chunks start beyond it
+        best = None
+        for t, _, chunk in candidates:
+            if best is not None and t > best[3]:
+                break
+            loc, normal, idx, dist = chunk.tree.ray_cast(origin, direction, distance)
+            if loc is not None and (best is None or dist < best[3]):
+                best = (loc, normal, idx, dist, chunk)
+        if best is None:
+            return False, None, None, None, None, None
+        loc, normal, idx, dist, chunk = best
+        name, idx = chunk.lookup(idx)
+        obj = bpy.data.objects.get(name)
+        if obj is None:
+            # brick was removed without the engine being notified
+            self.invalidate()
+            return False, None, None, None, None, None
+        return True, loc, normal, idx, obj, obj.matrix_world.copy()
+
+
+class BrickGrid:
+    """ ray-cast engine marching voxel-by-voxel (3D DDA) through bricksDict occupancy
+
+    Grid space is derived from the 'co' (cell center) of the bricksDict entries, so
+    no brick geometry is touched. Hit locations lie on the boundary of the first
+    drawn cell along the ray and normals are aligned with the grid axes.
+    """
+
+    def __init__(self, bricksDict:dict, matrix=None):
+        self.bricksDict = bricksDict
+        self.setMatrix(matrix)
+        # get grid locations and cell centers of all entries (from the columns of a columnar bricksDict)
+        store = getBackingStore(bricksDict)
+        if store is not None:
+            rows = store.getLiveRows()
+            locs = store.getLocs(rows)
+            cos = store.getFieldArray("co", rows, dtype=np.float64)
+        else:
+            keys = list(bricksDict.keys())
+            locs = np.array([getDictLoc(bricksDict, k) for k in keys], dtype=np.int64)
+            cos = np.array([bricksDict[k]["co"] for k in keys], dtype=np.float64)
+        # derive cell spacing per axis from entries at the extremes of each axis
+        spacing = np.ones(3)
+        for i in range(3):
+            lo, hi = locs[:, i].argmin(), locs[:, i].argmax()
+            if locs[hi, i] != locs[lo, i]:
+                spacing[i] = (cos[hi, i] - cos[lo, i]) / (locs[hi, i] - locs[lo, i])
+        self.spacing = spacing
+        self.origin = cos[0] - locs[0] * spacing
+        self.min = locs.min(axis=0)
+        self.max = locs.max(axis=0) + 1
+
+    def setMatrix(self, matrix):
+        """ set model-local to world space matrix """
+        mx = np.identity(4) if matrix is None else np.array(matrix, dtype=np.float64)
+        self.matrix = mx
+        self.matrixInv = np.linalg.inv(mx)
+        self.normalMatrix = self.matrixInv[:3, :3].T
+
+    def toGrid(self, co:Vector):
+        """ convert world space point to continuous grid coordinates (cell k spans [k, k+1)) """
+        local = self.matrixInv[:3, :3] @ np.array(co) + self.matrixInv[:3, 3]
+        return (local - self.origin) / self.spacing + 0.5
+
+    def toWorld(self, g:np.ndarray):
+        """ convert continuous grid coordinates to world space point """
+        local = (g - 0.5) * self.spacing + self.origin
+        return Vector(self.matrix[:3, :3] @ local + self.matrix[:3, 3])
+
+    def getCellCorners(self, loc:list, size:list):
+        """ get world space corners of box of cells starting at 'loc' (ordered x-major, z-minor) """
+        return [self.toWorld(np.array((loc[0] + dx * size[0], loc[1] + dy * size[1], loc[2] + dz * size[2]), dtype=np.float64)) for dx in (0, 1) for dy in (0, 1) for dz in (0, 1)]
+
+    def getAdjacentCell(self, hitLoc:Vector, normal:Vector, brickLoc:list, brickSize:list):
+        """ get loc and size of one brick's worth of cells adjacent to a brick face hit at 'hitLoc' """
+        g = self.toGrid(hitLoc)
+        gridNormal = self.matrix[:3, :3].T @ np.array(normal) * self.spacing
+        axis = int(np.argmax(np.abs(gridNormal)))
+        sign = 1 if gridNormal[axis] > 0 else -1
+        loc = [int(np.floor(c)) for c in g]
+        loc[axis] = int(np.floor(g[axis] + sign * 0.5))
+        # keep new brick in the same layer as the hit brick unless stacking on top/bottom
+        if axis == 2:
+            loc[2] = brickLoc[2] + brickSize[2] if sign > 0 else brickLoc[2] - brickSize[2]
+        else:
+            loc[2] = brickLoc[2]
+        return loc, [1, 1, brickSize[2]]
+
+    def getLineCells(self, start:list, end:list):
+        """ get grid cells on the line from cell 'start' to cell 'end' (both excluded), one per step along the longest axis """
+        start, end = np.array(start, dtype=np.int64), np.array(end, dtype=np.int64)
+        numSteps = int(np.abs(end - start).max())
+        if numSteps < 2:
+            return []
+        t = np.arange(1, numSteps)[:, None] / numSteps
+        return np.floor(start + (end - start) * t + 0.5).astype(np.int64).tolist()
+
+    def getBrickName(self, key:str):
+        """ get name of drawn brick occupying cell at key (None if empty) """
+        if isinstance(self.bricksDict, ColumnarBricksDict):
+            return self.bricksDict.getDrawnBrickName(key)
+        brickD = self.bricksDict.get(key)
+        if brickD is None or not brickD["draw"]:
+            return None
+        parentKey = brickD["parent"]
+        if parentKey not in ("self", None):
+            brickD = self.bricksDict[parentKey]
+        return brickD["name"]
+
+    def getVisibleBrick(self, name:str):
+        """ get brick object with given name if it is visible (hidden bricks are skipped by rays) """
+        obj = bpy.data.objects.get(name)
+        return obj if obj is not None and isBrickVisible(obj) else None
+
+    def ray_cast(self, origin:Vector, direction:Vector, distance:float=1000000, includeHidden:bool=False):
+        """ cast ray against model; returns (result, location, normal, index, object, matrix) like scene.ray_cast """
+        miss = (False, None, None, None, None, None)
+        g0 = self.toGrid(origin)
+        dg = (self.matrixInv[:3, :3] @ np.array(direction)) / self.spacing
+        # 'distance' is measured along 'direction', so t is shared between world and grid space
+        invDir = safe_inverse(dg)
+        t = ray_box_intersect(g0, invDir, self.min, self.max)
+        if t is None or t > distance:
+            return miss
+        # axis of the box face the ray entered through
+        entryAxis = None
+        if t > 0:
+            entryAxis = int(np.argmin([abs(g0[i] + dg[i] * t - (self.min[i] if dg[i] > 0 else self.max[i])) for i in range(3)]))
+        p = g0 + dg * t
+        cell = [min(max(int(np.floor(p[i])), self.min[i]), self.max[i] - 1) for i in range(3)]
+        step = [1 if dg[i] > 0 else -1 for i in range(3)]
+        # distance along ray to next cell boundary, and between boundaries, per axis
+        tMax = [t + ((cell[i] + (step[i] > 0) - p[i]) * invDir[i] if dg[i] != 0 else float("inf")) for i in range(3)]
+        tDelta = [abs(invDir[i]) for i in range(3)]
+        axis = entryAxis
+        while True:
+            name = self.getBrickName("%d,%d,%d" % tuple(cell))
+            if name is None:
+                obj = None
+            else:
+                obj = bpy.data.objects.get(name) if includeHidden else self.getVisibleBrick(name)
+            if obj is not None:
+                if axis is None:
+                    # ray started inside an occupied cell
+                    normal = -Vector(direction)
+                else:
+                    gridNormal = np.zeros(3)
+                    gridNormal[axis] = -step[axis]
+                    normal = Vector(self.normalMatrix @ (gridNormal / self.spacing))
+                normal.normalize()
+                return True, self.toWorld(g0 + dg * t), normal, 0, obj, obj.matrix_world.copy()
+            # step to next cell along axis with nearest boundary
+            axis = tMax.index(min(tMax))
+            t = tMax[axis]
+            if t > distance:
+                return miss
+            cell[axis] += step[axis]
+            if not self.min[axis] <= cell[axis] < self.max[axis]:
+                return miss
+            tMax[axis] += tDelta[axis]
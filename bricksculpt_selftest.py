@@ -0,0 +1,513 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" self tests for the BrickSculpt hot paths, run in plain CPython with 'python bricksculpt_headless.py' (they draw bricks into the scene, so don't run them in a Blender session) """
+
+# System imports
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+import numpy as np
+
+# Blender imports
+import bpy
+from mathutils import Vector
+
+# Addon imports
+from ....lib.bricksDict.functions import *
+from ....functions.common.blender import *
+from ....functions.common.python_utils import deepcopy
+from .bricksculpt_autosave import *
+from .bricksculpt_benchmarks import ReplayContext, getTopView, loadEventRecording, makeStrokeRecording, replaySession
+from .bricksculpt_events import *
+from .bricksculpt_framework import *
+from .bricksculpt_interface import *
+from .bricksculpt_keys import *
+from .bricksculpt_layers import *
+from .bricksculpt_merge import *
+from .bricksculpt_occupancy import *
+from .bricksculpt_pool import *
+from .bricksculpt_raycast import *
+from .bricksculpt_session import *
+from .bricksculpt_store import *
+
+
+def makeTestBricksDict(side:int=4, height:int=2):
+    """ bricksDict with a side x side x height block of cells, 1x1 bricks drawn in the bottom layer only """
+    scn, cm, n = getActiveContextInfo()
+    bricksDict = {}
+    for x in range(side):
+        for y in range(side):
+            for z in range(height):
+                key = "%(x)s,%(y)s,%(z)s" % locals()
+                bricksDict[key] = {"name": "Bricker_%(n)s__%(key)s" % locals(), "draw": z == 0, "parent": "self" if z == 0 else None,
+                                   "size": [1, 1, 1], "mat_name": "ABS Plastic Red", "co": [x, y, z], "type": "BRICK"}
+    drawUpdatedBricks(cm, bricksDict, list(bricksDict), selectCreated=False)
+    return bricksDict
+
+
+def makeTestOperator(bricksDict:dict, mode:str="DRAW", **settings):
+    """ BrickSculpt operator with the headless harness's stand-in Bricker tools """
+    return sys.modules["bricksculpt_headless"].makeSculptOperator(bricksDict, mode=mode, **settings)
+
+
+def makeTopViewContext(pixelsPerCell:int=10):
+    """ context of an orthographic view looking down on the grid, with cell x,y centered at pixel x,y * pixelsPerCell """
+    context = ReplayContext()
+    context.setView(getTopView((0, 0, context.region.width, context.region.height), pixelsPerCell))
+    return context
+
+
+def makeEvent(type:str, value:str="NOTHING", cell:tuple=(0, 0), pixelsPerCell:int=10, **modifiers):
+    """ event at the pixel over grid cell x,y of a view from makeTopViewContext """
+    x, y = cell[0] * pixelsPerCell, cell[1] * pixelsPerCell
+    data = {"type": type, "value": value, "alt": False, "shift": False, "ctrl": False, "oskey": False,
+            "mouse_x": x, "mouse_y": y, "mouse_region_x": x, "mouse_region_y": y}
+    data.update(modifiers)
+    return RecordedEvent(data)
+
+
+def checkRayCast():
+    bricksDict = makeTestBricksDict()
+    grid = BrickGrid(bricksDict, getModelMatrix(bricksDict))
+    bvh = BrickBVH(bricksDict)
+    down = Vector((0, 0, -1))
+    for engine in (grid, bvh):
+        result, loc, normal, idx, obj, mx = engine.ray_cast(Vector((1, 2, 10)), down)
+        assert result and obj.name.endswith("__1,2,0"), obj
+        assert abs(loc.z - 0.5) < 1e-6 and normal.z > 0.99, (loc, normal)
+        assert not engine.ray_cast(Vector((10, 10, 10)), down)[0]
+    # hidden bricks are skipped unless asked for
+    bpy.data.objects[bricksDict["1,2,0"]["name"]].hide_viewport = True
+    assert grid.ray_cast(Vector((1, 2, 10)), down)[0] is False
+    assert grid.ray_cast(Vector((1, 2, 10)), down, includeHidden=True)[4].name.endswith("__1,2,0")
+    assert grid.getLineCells([0, 0, 0], [4, 2, 0]) == [[1, 1, 0], [2, 1, 0], [3, 2, 0]]
+
+
+def checkMergeQueue():
+    bricksDict = makeTestBricksDict()
+    queue = MergeQueue()
+    queue.submit(bricksDict, ["0,0,0", "1,0,0", "3,3,0", "3,2,0", "0,3,0"], "DRAW")
+    # the lone brick at 0,3,0 has nothing to merge with
+    assert list(queue.pending) == [(["0,0,0", "1,0,0"], "DRAW"), (["3,3,0", "3,2,0"], "DRAW")], queue.pending
+    # at least one group per call, even without a time budget
+    assert len(list(queue.pop(bricksDict, 0))) == 1 and queue.busy()
+    bricksDict["3,2,0"]["draw"] = False
+    assert list(queue.pop(bricksDict, 0)) == [] and not queue.busy()
+    # a connected stroke over the whole layer is cut into pieces of at most 'maxKeys' bricks
+    bricksDict["3,2,0"]["draw"] = True
+    strokeKeys = ["%d,%d,0" % (x, y) for x in range(4) for y in range(4)]
+    groups = groupAdjacentBricks(bricksDict, strokeKeys, maxKeys=5)
+    assert [len(group) for group in groups] == [5, 5, 5, 1], groups
+    assert sorted(k for group in groups for k in group) == sorted(strokeKeys)
+    queue = MergeQueue(maxKeys=5)
+    queue.submit(bricksDict, strokeKeys, "DRAW")
+    assert all(len(keys) <= 5 for keys, mode in queue.pop(bricksDict)) and not queue.busy()
+
+
+def checkPackedKeys():
+    assert unpackKey(packKey(-5, 7, 1 << 19)) == (-5, 7, 1 << 19)
+    assert packKey(1, 2, 3) + NEIGHBOR_OFFSETS[1] == packKey(2, 2, 3)
+    names = PackedKeyList(["Bricker_m__1,2,3", "Bricker_m__-1,0,2"], names=True)
+    names += ["Bricker_m__1,2,3"]
+    assert list(names) == ["Bricker_m__1,2,3", "Bricker_m__-1,0,2", "Bricker_m__1,2,3"]
+    assert "Bricker_m__-1,0,2" in names and "Bricker_other__-1,0,2" not in names
+    assert names[1:] == ["Bricker_m__-1,0,2", "Bricker_m__1,2,3"] and names.keys()[1] == "-1,0,2"
+    names.remove("Bricker_m__1,2,3")
+    assert "Bricker_m__1,2,3" in names and len(names) == 2
+    keys = PackedKeySet(["0,0,0", "1,0,0", "0,0,0"])
+    assert list(keys) == ["0,0,0", "1,0,0"]
+
+
+def checkUndoJournal():
+    bricksDict = makeTestBricksDict()
+    journal = UndoJournal(maxSteps=2)
+    for matName in ("ABS Plastic Blue", "ABS Plastic Green", "ABS Plastic Black"):
+        journal.capture(bricksDict, ["0,0,0", "1,0,0"])
+        bricksDict["0,0,0"]["mat_name"] = matName
+        journal.end(bricksDict)
+    # unchanged entries aren't stored, and the oldest step was dropped
+    assert len(journal.undoStack) == 2 and all(len(delta) == 1 for delta, numBytes in journal.undoStack)
+    for key, state in journal.pop():
+        setUndoState(bricksDict[key], state)
+    assert bricksDict["0,0,0"]["mat_name"] == "ABS Plastic Green"
+    for key, state in journal.pop(redo=True):
+        setUndoState(bricksDict[key], state)
+    assert bricksDict["0,0,0"]["mat_name"] == "ABS Plastic Black"
+    # exposure and custom material are restored, and fields set since the capture are removed
+    bricksDict["1,0,0"]["top_exposed"] = True
+    journal.capture(bricksDict, ["1,0,0"])
+    bricksDict["1,0,0"].update(top_exposed=False, bot_exposed=True, custom_mat_name=True)
+    journal.end(bricksDict)
+    for key, state in journal.pop():
+        setUndoState(bricksDict[key], state)
+    assert bricksDict["1,0,0"]["top_exposed"] and "bot_exposed" not in bricksDict["1,0,0"] and "custom_mat_name" not in bricksDict["1,0,0"]
+
+
+def checkBrickListMutations():
+    store = ColumnarBricksDict(makeTestBricksDict())
+    filepath = os.path.join(tempfile.mkdtemp(), "bricksDict.bin")
+    saveBricksDict(store, filepath)
+    loaded = loadBricksDict(filepath)
+    # every in place change of a list field reaches the store
+    size = loaded["1,1,0"]["size"]
+    size[0] = 2
+    size.sort(reverse=True)
+    size.reverse()
+    assert loaded["1,1,0"]["size"] == [1, 1, 2]
+    co = loaded["1,1,0"]["co"]
+    co += [7]
+    co.append(8)
+    co.extend([9])
+    co.insert(0, 6)
+    assert co.pop() == 9 and loaded["1,1,0"]["co"] == [6, 1, 1, 0, 7, 8]
+    co.remove(7)
+    del co[0]
+    co *= 2
+    assert loaded["1,1,0"]["co"] == [1, 1, 0, 8] * 2
+    co.clear()
+    assert loaded["1,1,0"]["co"] == [] and loaded["0,0,0"]["co"] == [0, 0, 0]
+    # 'size' rows keep three values
+    try:
+        loaded["0,0,0"]["size"].append(1)
+        assert False, "size grew past three values"
+    except ValueError:
+        pass
+    # entries convert to plain dicts for JSON and Bricker's deepcopy
+    brickD = loaded["1,1,0"]
+    assert type(brickD.toDict()) is dict and json.loads(json.dumps(brickD.toDict())) == brickD.toDict()
+    assert copy.deepcopy(brickD) == brickD.toDict() and deepcopy(brickD.toDict()) == brickD.toDict()
+
+
+def checkStoreRoundTrip():
+    bricksDict = makeTestBricksDict()
+    bricksDict["1,1,0"]["size"] = [2, 2, 1]
+    bricksDict["2,1,0"]["parent"] = "1,1,0"
+    bricksDict["0,1,0"]["top_exposed"] = True
+    store = ColumnarBricksDict(bricksDict)
+    assert store.toDict() == bricksDict
+    store["0,0,0"]["mat_name"] = "ABS Plastic Blue"
+    # sizes changed in place reach the store
+    store["1,1,0"]["size"][2] = 3
+    assert getBrickField(store, "1,1,0", "size") == [2, 2, 3] and type(store.toDict()["1,1,0"]["size"]) is list
+    assert store.getDrawnBrickName("2,1,0") == store["1,1,0"]["name"] and store.getDrawnBrickName("2,1,1") is None
+    filepath = os.path.join(tempfile.mkdtemp(), "bricksDict.bin")
+    saveBricksDict(store, filepath)
+    loaded = loadBricksDict(filepath)
+    assert loaded.toDict() == store.toDict()
+    # loaded keys are looked up in the sorted key column, not decoded into 'rows'
+    assert not loaded.rows and list(loaded) == sorted(store, key=strToPacked) and "1,2" not in loaded
+    del loaded["0,0,0"]
+    assert "0,0,0" not in loaded and len(loaded) == len(store) - 1 and loaded.getRows(["0,0,0"])[0] == -1
+    assert loaded.getKey(int(loaded.getRows(["0,0,1"])[0])) == "0,0,1"
+    loaded["0,0,0"] = store["0,0,0"]
+    loaded["9,9,9"] = {"draw": True}
+    assert loaded.toDict() == dict(store.toDict(), **{"9,9,9": loaded["9,9,9"].toDict()}) and len(loaded.getLiveRows()) == len(store) + 1
+    loaded = loadBricksDict(filepath)
+    # chunked store sees (and writes back) the same entries
+    chunked = ChunkedBricksDict(loaded, chunkSize=2, maxChunks=1)
+    chunked["3,3,1"]["draw"] = True
+    assert chunked.toDict() == dict(store.toDict(), **{"3,3,1": dict(store["3,3,1"], draw=True)})
+    # numeric extra fields are memory mapped columns, written through in place too
+    loaded = loadBricksDict(filepath)
+    assert isinstance(loaded.extra["co"], NumericColumn) and isinstance(loaded.extra["top_exposed"], NumericColumn) and "type" in loaded.pendingExtra
+    assert "top_exposed" not in loaded["0,0,0"] and loaded["0,1,0"]["top_exposed"] is True
+    loaded["1,1,0"]["co"][2] = 5
+    assert getBrickField(loaded, "1,1,0", "co") == [1, 1, 5]
+    loaded["0,0,0"]["co"] = None
+    assert loaded["0,0,0"]["co"] is None and loaded["1,1,0"]["co"] == [1, 1, 5]
+
+
+def checkChunkedEngines():
+    bricksDict = makeTestBricksDict()
+    bricksDict["1,1,0"]["size"] = [2, 1, 1]
+    bricksDict["2,1,0"]["parent"] = "1,1,0"
+    chunked = ChunkedBricksDict(ColumnarBricksDict(bricksDict), chunkSize=2, maxChunks=1)
+    # engines are built from the columns, without loading chunks
+    occupancy, grid, bvh = OccupancyGrid(chunked), BrickGrid(chunked), BrickBVH(chunked)
+    assert chunked.loads == 0, chunked.stats()
+    expected = OccupancyGrid(bricksDict)
+    for attr in ("parent", "height", "single"):
+        assert np.array_equal(getattr(occupancy, attr), getattr(expected, attr)), attr
+    assert [occupancy.matNames[i] for i in occupancy.mat.flat if i != -1] == [expected.matNames[i] for i in expected.mat.flat if i != -1]
+    expected = BrickGrid(bricksDict)
+    assert np.allclose(grid.origin, expected.origin) and np.allclose(grid.spacing, expected.spacing)
+    assert bvh.dirty == BrickBVH(bricksDict).dirty
+    assert bvh.ray_cast(Vector((1, 1, 10)), Vector((0, 0, -1)))[4].name.endswith("__1,1,0")
+    # pinned chunks aren't evicted, so edits through entries held in the block are kept
+    with chunked.pinned(["0,0,0"]):
+        brickD = chunked["0,0,0"]
+        chunked["3,3,0"]
+        assert len(chunked.chunks) == 2 and chunked.pinnedSkips == 1
+        brickD["mat_name"] = "ABS Plastic Blue"
+    assert len(chunked.chunks) == 1 and chunked.toDict()["0,0,0"]["mat_name"] == "ABS Plastic Blue"
+    with chunked.pinned():
+        chunked["0,0,0"], chunked["0,3,0"], chunked["3,3,0"]
+        assert len(chunked.chunks) == 3
+    assert len(chunked.chunks) == 1
+    # only entries changed while resident (including lists changed in place) are written back
+    brickD = chunked["1,0,0"]
+    brickD["size"][0] = 2
+    brickD.update(top_exposed=True)
+    assert chunked.chunks[chunked.getChunkKey("1,0,0")].dirty == {"1,0,0"} and type(copy.deepcopy(brickD)["size"]) is list
+    chunked.store.setField(chunked.store.getRow("0,0,0"), "mat_name", "ABS Plastic Green")
+    chunked.clear()
+    assert chunked.store["1,0,0"]["size"] == [2, 1, 1] and chunked.store["1,0,0"]["top_exposed"] and chunked.store["0,0,0"]["mat_name"] == "ABS Plastic Green"
+
+
+def checkAutosaveJournal():
+    bricksDict = makeTestBricksDict()
+    filepath = os.path.join(tempfile.mkdtemp(), "autosave.jsonl")
+    for continueJournal, expected in ((False, ["0,0,0"]), (False, ["1,0,0"]), (True, ["1,0,0", "2,0,0"])):
+        journal = AutosaveJournal(filepath, "m", continueJournal=continueJournal)
+        journal.mark([expected[-1]])
+        journal.endStroke(bricksDict)
+        journal.stop()
+        # a leftover journal is only continued when asked to (after recovering it)
+        assert readAutosave(filepath) == ("m", {key: bricksDict[key] for key in expected}), readAutosave(filepath)
+
+
+def checkObjectPool():
+    bricksDict = makeTestBricksDict()
+    pool = BrickObjectPool(maxSize=2, getSignature=lambda obj: "BRICK" if obj.name.startswith("Bricker_") else None)
+    # Bricker's 'delete'/'duplicate', as its modules call them
+    brickerBlender = sys.modules[__name__.split(".")[0] + ".functions.common.blender"]
+    originalDelete = brickerBlender.delete
+    assert pool.hook()
+    try:
+        assert brickerBlender.delete is not originalDelete and delete is brickerBlender.delete
+        obj = bpy.data.objects[bricksDict["0,0,0"]["name"]]
+        mesh = obj.data
+        brickerBlender.delete(obj)
+        assert len(pool) == 1 and obj.name.startswith("Bricker_pooled_") and bpy.data.objects.get(bricksDict["0,0,0"]["name"]) is None
+        # a duplicate gets the pooled object, whose own mesh is freed
+        template = bpy.data.objects[bricksDict["1,0,0"]["name"]]
+        copy = brickerBlender.duplicate(template)
+        assert copy is obj and copy.data is not template.data and mesh.name not in bpy.data.meshes and len(pool) == 0
+        # objects acquired for Bricker to draw into lose their pooled mesh once it's replaced
+        brickerBlender.delete(copy)
+        obj = pool.acquire("BRICK", bricksDict["0,0,0"]["name"])
+        mesh = obj.data
+        drawUpdatedBricks(None, bricksDict, ["0,0,0"], selectCreated=False)
+        pool.freeReplacedMeshes()
+        assert obj.data is not mesh and bpy.data.meshes.get(mesh.name) is not mesh
+        # other objects are deleted, and pooled ones beyond 'maxSize' evicted
+        for key in ("0,0,0", "1,0,0", "2,0,0"):
+            brickerBlender.delete(bpy.data.objects[bricksDict[key]["name"]])
+        assert len(pool) == 2 and pool.evictions == 1
+        brickerBlender.delete(bpy.data.objects.new("Cube", None))
+        assert "Cube" not in bpy.data.objects
+    finally:
+        pool.unhook()
+    assert brickerBlender.delete is originalDelete and delete is originalDelete
+
+
+def checkIncrementalCommit():
+    bricksDict = makeTestBricksDict()
+    sculptOp = bricksculpt_framework()
+    sculptOp.bricksDict = bricksDict
+    sculptOp.columnarBricksDict = True
+    sculptOp.loadSessionStore()
+    # remove the brick at 1,1,0 and stack one on 2,2,0
+    sculptOp.bricksDict["1,1,0"]["draw"] = False
+    sculptOp.bricksDict["2,2,1"]["draw"] = True
+    sculptOp.bricksDict["2,2,1"]["parent"] = "self"
+    sculptOp.recordEdit("removed", ["1,1,0"])
+    sculptOp.recordEdit("added", ["2,2,1"])
+    sculptOp.commitSessionChanges()
+    # edits are written back into the model's bricksDict
+    assert sculptOp.bricksDict is bricksDict and sculptOp.editedKeys is None
+    assert not bricksDict["1,1,0"]["draw"] and bricksDict["2,2,1"]["draw"]
+    assert not bricksDict["2,2,0"]["top_exposed"] and bricksDict["2,2,1"]["top_exposed"] and bricksDict["2,1,0"]["bot_exposed"]
+    # cells away from the edits aren't examined
+    assert "top_exposed" not in bricksDict["3,3,0"]
+
+
+def checkLayerSolo():
+    bricksDict = makeTestBricksDict(height=3)
+    layerIndex = BrickLayerIndex(bricksDict)
+    assert layerIndex.solo(0) == [1, 2] and layerIndex.solo(0) == []
+    # brick drawn in layer 1 while layer 0 is soloed
+    bricksDict["0,0,1"].update(draw=True, parent="self")
+    drawUpdatedBricks(None, bricksDict, ["0,0,1"], selectCreated=False)
+    assert layerIndex.hideOutsideSolo(["0,0,1", "1,1,0"]) == [1]
+    # switching to layer 2 only toggles layers 0 and 2, and the new brick stays hidden
+    assert layerIndex.solo(2) == [0, 2]
+    assert not isObjVisibleInViewport(bpy.data.objects[bricksDict["0,0,1"]["name"]])
+    assert not isObjVisibleInViewport(bpy.data.objects[bricksDict["1,1,0"]["name"]])
+    assert layerIndex.unsolo() == [0, 1]
+    assert all(isObjVisibleInViewport(obj) for z in (0, 1) for obj in layerIndex.getLayerBricks(z))
+
+
+def checkModalStroke():
+    bricksDict = makeTestBricksDict()
+    sculptOp = makeTestOperator(bricksDict, frameBudget=0, maxMergeKeys=8)
+    context = makeTopViewContext()
+    stroke = [makeEvent("MOUSEMOVE", cell=(0, 0)), makeEvent("LEFTMOUSE", "PRESS", cell=(0, 0)),
+              makeEvent("MOUSEMOVE", cell=(1, 0)), makeEvent("MOUSEMOVE", cell=(2, 0)), makeEvent("LEFTMOUSE", "RELEASE", cell=(2, 0))]
+    for event in stroke:
+        sculptOp.modal(context, event)
+    # bricks were added on top of the stroke, and their merge is queued with the undo step still open
+    assert [bricksDict["%d,0,1" % x]["draw"] for x in range(3)] == [True, True, True]
+    assert sculptOp.mergeQueue.busy() and not sculptOp.getUndoJournal().undoStack
+    sculptOp.modal(context, makeEvent("TIMER", cell=(2, 0)))
+    assert not sculptOp.mergeQueue.busy() and bricksDict["0,0,1"]["size"] == [2, 1, 1] and bricksDict["1,0,1"]["parent"] == "0,0,1"
+    assert len(sculptOp.getUndoJournal().undoStack) == 1
+    # one undo reverts the stroke and its merge
+    sculptOp.modal(context, makeEvent("Z", "PRESS", cell=(2, 0), ctrl=True))
+    assert not any(bricksDict["%d,0,1" % x]["draw"] for x in range(3)) and bricksDict["0,0,1"]["size"] == [1, 1, 1]
+    assert not any(bpy.data.objects.get(bricksDict["%d,0,1" % x]["name"]) for x in range(3))
+    assert sculptOp.modal(context, makeEvent("RET", "PRESS")) == {"FINISHED"}
+    assert sculptOp.bricksDict is bricksDict and sculptOp.numCommits == 0
+
+
+def checkSpreadStoreBuild():
+    bricksDict = makeTestBricksDict()
+    sculptOp = makeTestOperator(bricksDict, frameBudget=0, chunkedBricksDict=True, storeBuildBudget=0, bricksDictChunkSize=2, maxResidentChunks=1)
+    sculptOp.storeBuilder = SessionStoreBuilder(bricksDict)
+    sculptOp.storeBuilder.sliceSize = 8
+    context = makeTopViewContext()
+    # the stroke edits the plain bricksDict while the store is built, and the store isn't switched to before its merges are done
+    stroke = [makeEvent("MOUSEMOVE", cell=(0, 0)), makeEvent("LEFTMOUSE", "PRESS", cell=(0, 0)),
+              makeEvent("MOUSEMOVE", cell=(1, 0)), makeEvent("LEFTMOUSE", "RELEASE", cell=(1, 0)), makeEvent("TIMER", cell=(1, 0))]
+    for event in stroke:
+        sculptOp.modal(context, event)
+        assert sculptOp.bricksDict is bricksDict
+    assert sculptOp.storeBuilder.done() and bricksDict["0,0,1"]["size"] == [2, 1, 1]
+    sculptOp.modal(context, makeEvent("TIMER", cell=(1, 0)))
+    # entries copied before the stroke edited them were copied again
+    assert isinstance(sculptOp.bricksDict, ChunkedBricksDict) and sculptOp.bricksDict.toDict() == bricksDict
+    assert sculptOp.modal(context, makeEvent("RET", "PRESS")) == {"FINISHED"} and sculptOp.bricksDict is bricksDict
+
+
+def checkEventCoalescer():
+    coalescer = MouseMoveCoalescer(frameBudget=60)
+    move = makeEvent("MOUSEMOVE", cell=(1, 1))
+    assert coalescer.filter(move) is move
+    # moves within the frame budget are folded into the next timer tick
+    assert coalescer.filter(makeEvent("MOUSEMOVE", cell=(2, 1))) is None and coalescer.filter(makeEvent("INBETWEEN_MOUSEMOVE", cell=(3, 1))) is None
+    event = coalescer.filter(makeEvent("TIMER", cell=(3, 1)))
+    assert event.type == "MOUSEMOVE" and event.mouse_region_x == 30
+    assert coalescer.filter(makeEvent("TIMER")) is None
+    key = makeEvent("D", "PRESS")
+    assert coalescer.filter(key) is key
+    assert (coalescer.numReceived, coalescer.numProcessed) == (3, 2)
+
+
+def checkRegionIndex():
+    context = makeTopViewContext()
+    screen, region = context.screen, context.region
+    index = RegionIndex()
+    assert index.lookup(screen, 10, 10) == (context.space_data, None)
+    # misses against an unchanged layout don't rebuild
+    for x in range(5):
+        assert index.lookup(screen, region.width + x, 10) == (None, None)
+    assert index.lookup(screen, region.width, 10) == (None, None)
+    assert (index.rebuilds, index.missHits) == (1, 6)
+    # resized regions are picked up
+    region.width += 100
+    assert index.lookup(screen, region.width - 50, 10) == (context.space_data, None) and index.rebuilds == 2
+
+
+def checkUIStatePresenter():
+    area, window = bpy.context.area, bpy.context.window
+    presenter = UIStatePresenter(frameBudget=60)
+    presenter.beginStroke()
+    presenter.setHeader(area, "a")
+    presenter.setCursor(window, "PAINT_BRUSH")
+    assert area.header_text == "a" and window.cursor == "DEFAULT"
+    # unchanged requests are suppressed, and requests within the frame budget held back (the latest wins)
+    presenter.setHeader(area, "a")
+    presenter.setHeader(area, "b")
+    presenter.setHeader(area, "c")
+    assert area.header_text == "a" and presenter.pending["header"][1] == "c"
+    presenter.flush(force=True)
+    assert area.header_text == "c" and window.cursor == "PAINT_BRUSH"
+    assert presenter.endStroke() == {"emitted": 3, "suppressed": 2}
+
+
+def checkBrushBatch():
+    bricksDict = makeTestBricksDict()
+    sculptOp = makeTestOperator(bricksDict, mode="PAINT", brushRadius=1, brushShape="CYLINDER")
+    context = makeTopViewContext()
+    sculptOp.modal(context, makeEvent("MOUSEMOVE", cell=(1, 1)))
+    sculptOp.modal(context, makeEvent("LEFTMOUSE", "PRESS", cell=(1, 1)))
+    sculptOp.modal(context, makeEvent("LEFTMOUSE", "RELEASE", cell=(1, 1)))
+    recolored = sorted(k for k, brickD in bricksDict.items() if brickD["mat_name"] == sculptOp.matName)
+    assert recolored == ["0,1,0", "1,0,0", "1,1,0", "1,2,0", "2,1,0"], recolored
+    # the batch is one undo step
+    journal = sculptOp.getUndoJournal()
+    assert len(journal.undoStack) == 1 and len(journal.undoStack[0][0]) == 5
+    sculptOp.undoSculpt()
+    assert not any(brickD["mat_name"] == sculptOp.matName for brickD in bricksDict.values())
+    sculptOp.cancel(context)
+
+    # bricks stacked above an empty cell both target it from below; it is filled once
+    bricksDict = makeTestBricksDict(height=5)
+    bricksDict["0,0,2"].update(draw=True, parent="self")
+    bricksDict["0,0,3"].update(draw=True, parent="self", size=[1, 1, 2])
+    bricksDict["0,0,4"].update(draw=True, parent="0,0,3", size=[1, 1, 2])
+    scn, cm, n = getActiveContextInfo()
+    drawUpdatedBricks(cm, bricksDict, ["0,0,2", "0,0,3"], selectCreated=False)
+    sculptOp = makeTestOperator(bricksDict, brushRadius=2)
+    grid = sculptOp.getGridEngine()
+    sculptOp.obj = bpy.data.objects[bricksDict["0,0,2"]["name"]]
+    sculptOp.loc, sculptOp.normal = grid.toWorld(np.array([0.5, 0.5, 2.0])), Vector((0, 0, -1))
+    filled = []
+    addBrick = sculptOp.addBrick
+    def recordingAddBrick(cm, n, curKey, curLoc, objSize):
+        filled.append(grid.getAdjacentCell(sculptOp.loc, sculptOp.normal, curLoc, objSize)[0])
+        addBrick(cm, n, curKey, curLoc, objSize)
+    sculptOp.addBrick = recordingAddBrick
+    sculptOp.runBrushAction(cm, n, makeEvent("LEFTMOUSE", "PRESS"), "ADD", [0, 0, 2], [1, 1, 1])
+    assert filled.count([0, 0, 1]) == 1 and bricksDict["0,0,1"]["draw"], filled
+    sculptOp.cancel(makeTopViewContext())
+
+
+def checkReplay():
+    # synthetic recording replayed through the stand-in operator
+    with tempfile.TemporaryDirectory() as tmpDir:
+        filepath = makeStrokeRecording(os.path.join(tmpDir, "paint.json"), "PAINT", side=8, numStrokes=2)
+        mode, bricksDict, events = loadEventRecording(filepath)
+        sculptOp = makeTestOperator(bricksDict, mode="PAINT")
+        times = replaySession(sculptOp, filepath, realTime=False)
+    assert list(times) == ["PAINT"] and len(times["PAINT"]) == len(events), times
+    assert sculptOp.undoJournal.undoStack, "replayed strokes left no undo steps"
+
+
+SELF_TESTS = (checkRayCast, checkMergeQueue, checkPackedKeys, checkUndoJournal, checkBrickListMutations, checkStoreRoundTrip, checkChunkedEngines, checkAutosaveJournal, checkObjectPool, checkIncrementalCommit, checkLayerSolo,
+              checkModalStroke, checkSpreadStoreBuild, checkEventCoalescer, checkRegionIndex, checkUIStatePresenter, checkBrushBatch, checkReplay)
+
+
+def runSelfTests(tests:iter=SELF_TESTS):
+    """ run tests, printing a line per test; returns True if all passed """
+    numFailed = 0
+    for test in tests:
+        t0 = time.perf_counter()
+        try:
+            test()
+            status = "ok"
+        except Exception:
+            traceback.print_exc()
+            status = "FAILED"
+            numFailed += 1
+        print("%30s %8s %10.2f ms" % (test.__name__, status, (time.perf_counter() - t0) * 1000))
+    return numFailed == 0
@@ -0,0 +1,224 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# System imports
+import json
+from collections import OrderedDict, deque, namedtuple
+
+# Blender imports
+# NONE!
+
+# Addon imports
+from ....lib.bricksDict.functions import *
+from .bricksculpt_keys import *
+from .bricksculpt_store import *
+
+
+# hover state and arguments needed to replay a DRAW action on release
+PendingAction = namedtuple("PendingAction", ["action", "cell", "objName", "loc", "normal", "event", "key", "curLoc", "objSize"])
+
+
+class StrokeTransaction:
+    """ DRAW actions recorded during a stroke, to be committed to Bricker geometry in one batch """
+
+    def __init__(self):
+        self.actions = []
+        self.cells = set()
+
+    def record(self, action:str, cell:list, *args):
+        """ record action on cell; returns False if an action on that cell is already pending """
+        cellKey = (action, tuple(cell))
+        if cellKey in self.cells:
+            return False
+        self.cells.add(cellKey)
+        self.actions.append(PendingAction(action, cell, *args))
+        return True
+
+    def clear(self):
+        self.actions = []
+        self.cells = set()
+
+    def __len__(self):
+        return len(self.actions)
+
+
+class StrokeState:
+    """ brick names and keys collected during strokes, as insertion ordered sets of packed keys
+
+    'addedBricks' and 'addedBricksFromDelete' hold names of bricks created by
+    the stroke and 'keysToMergeOnRelease' holds bricksDict keys queued for
+    merging. Membership tests are constant time however long the stroke gets.
+    """
+
+    attrs = ("addedBricks", "addedBricksFromDelete", "keysToMergeOnRelease")
+
+    def __init__(self):
+        self.addedBricks = PackedKeySet(names=True)
+        self.addedBricksFromDelete = PackedKeySet(names=True)
+        self.keysToMergeOnRelease = PackedKeySet()
+        self.peakSize = 0
+        self.lastStroke = None
+
+    def set(self, attr:str, items:iter):
+        """ replace set 'attr' with items (a PackedKeySet is used as is) """
+        if not isinstance(items, PackedKeySet):
+            items = PackedKeySet(items, names=attr != "keysToMergeOnRelease")
+        setattr(self, attr, items)
+
+    def clear(self, attrs:iter=None):
+        for attr in attrs or self.attrs:
+            getattr(self, attr).clear()
+
+    def size(self):
+        return sum(len(getattr(self, attr)) for attr in self.attrs)
+
+    def endStroke(self):
+        """ store sizes of the sets at the end of the stroke in 'lastStroke' """
+        self.lastStroke = {attr: len(getattr(self, attr)) for attr in self.attrs}
+        self.peakSize = max(self.peakSize, self.size())
+        return self.lastStroke
+
+
+# bricksDict fields recorded in undo deltas (when present in the entry)
+UNDO_FIELDS = ("name", "draw", "size", "parent", "mat_name", "custom_mat_name", "type", "flipped", "rotated", "top_exposed", "bot_exposed")
+
+
+def getUndoState(brickD:dict):
+    """ compact copy of the bricksDict entry fields restored by undo, as (field, value) pairs """
+    if brickD is None:
+        return None
+    return tuple((f, list(brickD[f]) if f == "size" else brickD[f]) for f in UNDO_FIELDS if f in brickD)
+
+
+def setUndoState(brickD:dict, state:tuple):
+    """ write compact state from getUndoState back into bricksDict entry (undo fields missing from state are removed) """
+    fields = set()
+    for f, value in state:
+        brickD[f] = list(value) if f == "size" else value
+        fields.add(f)
+    for f in UNDO_FIELDS:
+        if f not in fields and f in brickD:
+            del brickD[f]
+
+
+class UndoJournal:
+    """ in-session undo/redo stack of per-stroke bricksDict deltas
+
+    Entries are captured before the first edit that may touch them in a step,
+    and compared against their state when the step ends, so each step only
+    stores (key, old state, new state) for entries that actually changed.
+    Steps beyond 'maxSteps' or 'maxBytes' (estimated from the JSON size of
+    the deltas) are dropped, oldest first.
+    """
+
+    def __init__(self, maxSteps:int=100, maxBytes:int=16 * 1024 * 1024):
+        self.maxSteps = maxSteps
+        self.maxBytes = maxBytes
+        self.undoStack = deque()
+        self.redoStack = []
+        self.numBytes = 0
+        self.before = None
+
+    def capture(self, bricksDict:dict, keys:iter):
+        """ store pre-edit state of entries at keys (first capture in a step wins) """
+        if self.before is None:
+            self.before = OrderedDict()
+        for key in keys:
+            if key not in self.before and key in bricksDict:
+                self.before[key] = getUndoState(bricksDict[key])
+
+    def end(self, bricksDict:dict):
+        """ close current step, keeping only the entries that changed """
+        if not self.before:
+            self.before = None
+            return
+        delta = []
+        for key, oldState in self.before.items():
+            newState = getUndoState(bricksDict.get(key))
+            if newState != oldState:
+                delta.append((key, oldState, newState))
+        self.before = None
+        if not delta:
+            return
+        numBytes = len(json.dumps(delta))
+        self.undoStack.append((delta, numBytes))
+        self.numBytes += numBytes
+        self.redoStack = []
+        # drop oldest steps beyond the limits
+        while len(self.undoStack) > self.maxSteps or (self.numBytes > self.maxBytes and len(self.undoStack) > 1):
+            self.numBytes -= self.undoStack.popleft()[1]
+
+    def pop(self, redo:bool=False):
+        """ get list of (key, state) to restore for undo (or redo); None if nothing to undo """
+        if redo:
+            if not self.redoStack:
+                return None
+            step = self.redoStack.pop()
+            self.undoStack.append(step)
+            self.numBytes += step[1]
+            return [(key, newState) for key, oldState, newState in step[0]]
+        else:
+            if not self.undoStack:
+                return None
+            step = self.undoStack.pop()
+            self.numBytes -= step[1]
+            self.redoStack.append(step)
+            return [(key, oldState) for key, oldState, newState in step[0]]
+
+
+class BrickResolver:
+    """ memoized brick object name -> (bricksDict key, loc, size) lookups
+
+    Entries are dropped with 'invalidate' when the bricks at their keys are
+    edited (merged, split, redrawn or restored), so the key and loc parsing
+    only reruns for bricks that changed.
+    """
+
+    def __init__(self, bricksDict:dict):
+        self.bricksDict = bricksDict
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, name:str):
+        """ get (key, loc, size) of brick object with given name """
+        entry = self.cache.get(name)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        key = getDictKey(name)
+        entry = (key, getDictLoc(self.bricksDict, key), getBrickField(self.bricksDict, key, "size"))
+        self.cache[name] = entry
+        return entry
+
+    def invalidate(self, keys:iter):
+        """ drop entries for bricks at keys (and the bricks they belong to) """
+        for key in keys:
+            brickD = self.bricksDict.get(key)
+            if brickD is None:
+                continue
+            self.cache.pop(brickD["name"], None)
+            if brickD["parent"] not in ("self", None):
+                self.cache.pop(self.bricksDict[brickD["parent"]]["name"], None)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hitRate": self.hits / total if total else 0}
@@ -0,0 +1,1109 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# System imports
+import copy
+import json
+import struct
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+import numpy as np
+
+# Blender imports
+# NONE!
+
+# Addon imports
+from .bricksculpt_keys import *
+
+
+# bricksDict fields stored in NumPy columns (all other fields go to per-field lists)
+COLUMN_FIELDS = ("name", "draw", "size", "mat_name", "parent")
+
+# 'parent' column values for parents that aren't keys
+PARENT_NONE = -1
+PARENT_SELF = -2
+
+# 'name' column value for the default brick name (name prefix + key)
+NAME_DEFAULT = -1
+
+# marks entries without a value in a per-field list
+MISSING = object()
+
+
+class StringTable:
+    """ interned strings, each stored once and referenced by index """
+
+    def __init__(self):
+        self.strings = []
+        self.indices = {}
+
+    def intern(self, s):
+        idx = self.indices.get(s)
+        if idx is None:
+            idx = self.indices[s] = len(self.strings)
+            self.strings.append(s)
+        return idx
+
+    def __getitem__(self, idx:int):
+        return self.strings[idx]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class TrackedList(list):
+    """ list calling 'onChange' after every in place change ('l[i] = v', '+=', 'append', 'pop', 'sort', ...)
+
+    Copies (copy.copy, copy.deepcopy) are plain lists.
+    """
+
+    __slots__ = ()
+
+    def onChange(self):
+        pass
+
+    def __setitem__(self, i, value):
+        super().__setitem__(i, value)
+        self.onChange()
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self.onChange()
+
+    def __iadd__(self, values):
+        super().__iadd__(values)
+        self.onChange()
+        return self
+
+    def __imul__(self, n:int):
+        super().__imul__(n)
+        self.onChange()
+        return self
+
+    def append(self, value):
+        super().append(value)
+        self.onChange()
+
+    def extend(self, values):
+        super().extend(values)
+        self.onChange()
+
+    def insert(self, i:int, value):
+        super().insert(i, value)
+        self.onChange()
+
+    def pop(self, i:int=-1):
+        value = super().pop(i)
+        self.onChange()
+        return value
+
+    def remove(self, value):
+        super().remove(value)
+        self.onChange()
+
+    def clear(self):
+        super().clear()
+        self.onChange()
+
+    def sort(self, **kwargs):
+        super().sort(**kwargs)
+        self.onChange()
+
+    def reverse(self):
+        super().reverse()
+        self.onChange()
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo:dict):
+        return copy.deepcopy(list(self), memo)
+
+
+class BrickList(TrackedList):
+    """ list field ('size' or a list valued extra column) of an entry in a ColumnarBricksDict
+
+    Every in place change is written back to the store. 'size' rows have
+    three values, so changes to its length raise ValueError.
+    """
+
+    __slots__ = ("store", "row", "field")
+
+    def __init__(self, values:list, store, row:int, field:str):
+        # 'list.__init__' directly, as entries build one on every 'size' read
+        list.__init__(self, values)
+        self.store = store
+        self.row = row
+        self.field = field
+
+    def onChange(self):
+        self.store.setField(self.row, self.field, list(self))
+
+
+def getValueKind(value):
+    """ (dtype, shape) of a NumPy row holding value, if it is a bool, int, float or a list of one of those (None otherwise) """
+    if isinstance(value, bool):
+        return ("?", ())
+    elif isinstance(value, int):
+        return ("<i8", ()) if -2 ** 63 <= value < 2 ** 63 else None
+    elif isinstance(value, float):
+        return ("<f8", ())
+    elif isinstance(value, (list, tuple)) and value:
+        kinds = set(getValueKind(v) for v in value)
+        if len(kinds) == 1:
+            kind = kinds.pop()
+            if kind is not None and kind[1] == ():
+                return (kind[0], (len(value),))
+    return None
+
+
+class NumericColumn:
+    """ values of an extra field that are all bools, ints, floats or equal length lists of one of those
+
+    'data' holds the value of each row (read back as plain Python values)
+    and 'present' which rows have one. Supports the list operations the
+    store uses on extra columns, so it can stand in for their lists.
+    """
+
+    def __init__(self, data:np.ndarray, present:np.ndarray):
+        self.data = data
+        self.present = present
+        self.kind = (data.dtype.str if data.dtype != bool else "?", data.shape[1:])
+
+    @classmethod
+    def fromValues(cls, values:list):
+        """ column with values (MISSING for rows without one); None if they don't share a kind """
+        kinds = set(getValueKind(v) for v in values if v is not MISSING)
+        if len(kinds) != 1 or None in kinds:
+            return None
+        dtype, shape = kinds.pop()
+        present = np.array([v is not MISSING for v in values], dtype=bool)
+        data = np.zeros((len(values),) + shape, dtype=dtype)
+        data[present] = [v for v in values if v is not MISSING]
+        return cls(data, present)
+
+    def accepts(self, value):
+        return value is MISSING or getValueKind(value) == self.kind
+
+    def __getitem__(self, row:int):
+        return self.data[row].tolist() if self.present[row] else MISSING
+
+    def __setitem__(self, row:int, value):
+        if value is MISSING:
+            self.present[row] = False
+        else:
+            self.data[row] = value
+            self.present[row] = True
+
+    def __len__(self):
+        return len(self.present)
+
+    def extend(self, values:list):
+        """ append rows (only MISSING values, as added by 'ColumnarBricksDict.grow') """
+        self.data = np.concatenate((self.data, np.zeros((len(values),) + self.data.shape[1:], dtype=self.data.dtype)))
+        self.present = np.concatenate((self.present, np.zeros(len(values), dtype=bool)))
+
+    def tolist(self):
+        return [self[row] for row in range(len(self))]
+
+
+class BrickEntry(MutableMapping):
+    """ dict-like view of one bricksDict entry in a ColumnarBricksDict
+
+    List fields are read as BrickLists, so 'brickD["size"][2] = 3' style
+    edits reach the store. Hot paths can skip the view with 'getBrickField'.
+    The view isn't a dict: use 'toDict' (or copy.deepcopy) to get one for
+    'json.dumps' or Bricker's 'deepcopy'.
+    """
+
+    __slots__ = ("store", "row")
+
+    def __init__(self, store, row:int):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, field:str):
+        getter = self.store.getters.get(field)
+        return getter(self.row) if getter is not None else self.store.getExtraField(self.row, field)
+
+    def __setitem__(self, field:str, value):
+        self.store.setField(self.row, field, value)
+
+    def __delitem__(self, field:str):
+        self.store.delField(self.row, field)
+
+    def __iter__(self):
+        return self.store.iterFields(self.row)
+
+    def __len__(self):
+        return sum(1 for f in self)
+
+    def __repr__(self):
+        return repr(self.toDict())
+
+    def __copy__(self):
+        return self.toDict()
+
+    def __deepcopy__(self, memo:dict):
+        return self.toDict()
+
+    def toDict(self):
+        """ plain dict copy of the entry (not tied to the store) """
+        return self.store.getEntryDict(self.row)
+
+
+class ColumnarBricksDict(MutableMapping):
+    """ bricksDict stored as columns of NumPy arrays for a sculpt session
+
+    'draw', 'size', 'mat_name' and 'parent' live in arrays with one row per
+    entry (materials interned in 'matNames', parents packed keys), as does
+    the packed key of each row ('key'), and names
+    are only stored (interned in 'names') when they differ from the model's
+    name prefix + key. Any other field is kept in a list per field (or a
+    NumericColumn, for numeric fields loaded from a file). Column
+    fields are always present ('draw' False, 'size' [0, 0, 0], and None for
+    the others if an entry doesn't set them).
+
+    Indexing returns a BrickEntry view, so 'bricksDict[key]["size"]' style
+    code keeps working; vectorized code can use the columns directly.
+
+    Rows loaded from a file (see 'loadBricksDict') come first, sorted by
+    packed key, and are found with a binary search of the key column the
+    first time their key is looked up (then remembered in 'baseRows'), so
+    keys are never decoded up front. Rows added later are found through
+    'rows'.
+    """
+
+    def __init__(self, bricksDict:dict=None):
+        bricksDict = bricksDict or {}
+        # loaded rows: their packed keys in ascending order, key -> row of the ones looked up so far, and rows deleted since
+        self.numBaseRows = 0
+        self.baseKeys = np.zeros(0, dtype=np.int64)
+        self.baseRows = {}
+        self.deletedRows = set()
+        # key -> row, and key of each row, for rows added after loading
+        self.rows = {}
+        self.rowKeys = []
+        self.namePrefix = None
+        self.names = StringTable()
+        self.matNames = StringTable()
+        self.extra = {}
+        # field -> function loading its list on first use (see 'loadBricksDict')
+        self.pendingExtra = {}
+        self.key = np.zeros(len(bricksDict), dtype=np.int64)
+        self.draw = np.zeros(len(bricksDict), dtype=bool)
+        self.size = np.zeros((len(bricksDict), 3), dtype=np.int16)
+        self.mat = np.zeros(len(bricksDict), dtype=np.int32)
+        self.parent = np.full(len(bricksDict), PARENT_NONE, dtype=np.int64)
+        self.name = np.full(len(bricksDict), NAME_DEFAULT, dtype=np.int32)
+        # column field -> function reading it at a row
+        self.getters = {"draw": self.getDraw, "size": self.getSize, "mat_name": self.getMatName, "parent": self.getParent, "name": self.getName}
+        for key, brickD in bricksDict.items():
+            self[key] = brickD
+
+    # rows
+
+    def getRow(self, key:str):
+        """ row of key (None if not in the store) """
+        row = self.rows.get(key)
+        if row is None and self.numBaseRows:
+            row = self.baseRows.get(key)
+            if row is None:
+                row = self.findBaseRow(key)
+        return row
+
+    def findBaseRow(self, key:str):
+        """ loaded row of key, remembered in 'baseRows' (None if it isn't one, or was deleted) """
+        try:
+            packed = strToPacked(key)
+        except (AttributeError, ValueError, TypeError):
+            return None
+        row = int(self.baseKeys.searchsorted(packed))
+        if row < self.numBaseRows and self.baseKeys.item(row) == packed and row not in self.deletedRows:
+            self.baseRows[key] = row
+            return row
+        return None
+
+    def getKey(self, row:int):
+        if row >= self.numBaseRows:
+            return self.rowKeys[row - self.numBaseRows]
+        return packedToStr(self.key.item(row))
+
+    def getNumRows(self):
+        """ number of rows in use, including rows of deleted keys """
+        return self.numBaseRows + len(self.rowKeys)
+
+    def iterKeyRows(self):
+        """ (key, row) of the keys in the store, loaded rows first """
+        blockSize = 4096
+        for start in range(0, self.numBaseRows, blockSize):
+            for row, packed in enumerate(self.baseKeys[start:start + blockSize].tolist(), start):
+                if row not in self.deletedRows:
+                    yield packedToStr(packed), row
+        yield from self.rows.items()
+
+    def addRow(self, key:str):
+        row = self.getNumRows()
+        if row == len(self.draw):
+            self.grow(max(16, 2 * row))
+        self.rows[key] = row
+        self.rowKeys.append(key)
+        self.key[row] = strToPacked(key)
+        return row
+
+    def grow(self, capacity:int):
+        self.loadExtraColumns()
+        for attr in ("key", "draw", "size", "mat", "parent", "name"):
+            old = getattr(self, attr)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, attr, new)
+        for values in self.extra.values():
+            values.extend([MISSING] * (capacity - len(values)))
+
+    # fields
+
+    def getField(self, row:int, field:str):
+        getter = self.getters.get(field)
+        return getter(row) if getter is not None else self.getExtraField(row, field)
+
+    # column reads use 'item', which skips building NumPy scalars (and the memmap '__getitem__' of loaded stores)
+
+    def getDraw(self, row:int):
+        return self.draw.item(row)
+
+    def getSize(self, row:int):
+        return BrickList(self.size[row].tolist(), self, row, "size")
+
+    def getMatName(self, row:int):
+        return self.matNames.strings[self.mat.item(row)]
+
+    def getParent(self, row:int):
+        parent = self.parent.item(row)
+        # packed keys are non-negative
+        if parent >= 0:
+            return packedToStr(parent)
+        return "self" if parent == PARENT_SELF else None
+
+    def getName(self, row:int):
+        idx = self.name.item(row)
+        return self.namePrefix + self.getKey(row) if idx == NAME_DEFAULT else self.names.strings[idx]
+
+    def getExtraField(self, row:int, field:str):
+        values = self.extra.get(field)
+        if values is None:
+            values = self.getExtraColumn(field)
+        value = values[row] if values is not None else MISSING
+        if value is MISSING:
+            raise KeyError(field)
+        return BrickList(value, self, row, field) if isinstance(value, list) and isinstance(values, NumericColumn) else value
+
+    def setField(self, row:int, field:str, value):
+        if field == "draw":
+            self.draw[row] = value
+        elif field == "size":
+            self.size[row] = value
+        elif field == "mat_name":
+            self.mat[row] = self.matNames.intern(value)
+        elif field == "parent":
+            self.parent[row] = PARENT_SELF if value == "self" else (PARENT_NONE if value is None else strToPacked(value))
+        elif field == "name":
+            self.name[row] = self.internName(row, value)
+        else:
+            values = self.getExtraColumn(field)
+            if values is None:
+                values = self.extra[field] = [MISSING] * len(self.draw)
+            elif isinstance(values, NumericColumn) and not values.accepts(value):
+                values = self.extra[field] = values.tolist()
+            values[row] = value
+
+    def delField(self, row:int, field:str):
+        values = self.getExtraColumn(field) if field not in COLUMN_FIELDS else None
+        if values is None or values[row] is MISSING:
+            raise KeyError(field)
+        values[row] = MISSING
+
+    def getExtraColumn(self, field:str):
+        """ list of values of a field outside the columns (None if no entry has it) """
+        if field in self.pendingExtra:
+            self.extra[field] = self.pendingExtra.pop(field)()
+        return self.extra.get(field)
+
+    def loadExtraColumns(self):
+        for field in list(self.pendingExtra):
+            self.getExtraColumn(field)
+
+    def iterFields(self, row:int):
+        self.loadExtraColumns()
+        for field in COLUMN_FIELDS:
+            yield field
+        for field, values in self.extra.items():
+            if values[row] is not MISSING:
+                yield field
+
+    def internName(self, row:int, name:str):
+        key = self.getKey(row)
+        if self.namePrefix is None and isinstance(name, str) and name.endswith("__" + key):
+            self.namePrefix = name[:-len(key)]
+        if self.namePrefix is not None and name == self.namePrefix + key:
+            return NAME_DEFAULT
+        return self.names.intern(name)
+
+    # mapping
+
+    def __getitem__(self, key:str):
+        row = self.getRow(key)
+        if row is None:
+            raise KeyError(key)
+        return BrickEntry(self, row)
+
+    def __setitem__(self, key:str, brickD:dict):
+        """ store all fields of brickD (a dict or BrickEntry) as the entry for key """
+        brickD = dict(brickD)
+        row = self.getRow(key)
+        if row is None:
+            row = self.addRow(key)
+        else:
+            self.loadExtraColumns()
+            for values in self.extra.values():
+                values[row] = MISSING
+        self.draw[row] = False
+        self.size[row] = 0
+        self.mat[row] = self.matNames.intern(None)
+        self.parent[row] = PARENT_NONE
+        self.name[row] = self.internName(row, None)
+        for field, value in brickD.items():
+            self.setField(row, field, value)
+
+    def __delitem__(self, key:str):
+        # the row stays allocated, unreachable through 'getRow'
+        row = self.rows.pop(key, None)
+        if row is None:
+            row = self.getRow(key)
+            if row is None:
+                raise KeyError(key)
+            self.deletedRows.add(row)
+            del self.baseRows[key]
+
+    def __iter__(self):
+        return (key for key, row in self.iterKeyRows())
+
+    def __len__(self):
+        return self.numBaseRows - len(self.deletedRows) + len(self.rows)
+
+    def __contains__(self, key):
+        return self.getRow(key) is not None
+
+    def getEntryDict(self, row:int):
+        """ plain dict copy of the entry at row (not tied to the store) """
+        brickD = {field: self.getField(row, field) for field in self.iterFields(row)}
+        for field, value in brickD.items():
+            if isinstance(value, BrickList):
+                brickD[field] = list(value)
+        return brickD
+
+    def getValue(self, key:str, field:str):
+        """ field of entry at key read straight from the columns, 'size' as a plain list (raises KeyError like 'bricksDict[key][field]') """
+        row = self.getRow(key)
+        if row is None:
+            raise KeyError(key)
+        if field == "size":
+            return self.size[row].tolist()
+        elif field in COLUMN_FIELDS:
+            return self.getField(row, field)
+        values = self.getExtraColumn(field)
+        value = values[row] if values is not None else MISSING
+        if value is MISSING:
+            raise KeyError(field)
+        return value
+
+    def getDrawnBrickName(self, key:str):
+        """ name of the brick drawn in cell at key (None if nothing is drawn there) """
+        row = self.getRow(key)
+        if row is None or not self.draw[row]:
+            return None
+        parent = int(self.parent[row])
+        # packed keys are non-negative
+        if parent >= 0:
+            row = self.getRow(packedToStr(parent))
+            if row is None:
+                raise KeyError(packedToStr(parent))
+        return self.getField(row, "name")
+
+    def getRows(self, keys:iter):
+        """ rows of keys, as an array (-1 for keys not in the store) """
+        rows = (self.getRow(k) for k in keys)
+        return np.array([-1 if row is None else row for row in rows], dtype=np.int64)
+
+    # vectorized reads
+
+    def getLiveRows(self):
+        """ rows of the keys in the store (deleted keys leave unreachable rows behind) """
+        rows = np.fromiter(self.rows.values(), dtype=np.int64, count=len(self.rows))
+        if not self.numBaseRows:
+            return rows
+        live = np.ones(self.numBaseRows, dtype=bool)
+        live[list(self.deletedRows)] = False
+        return np.concatenate((np.flatnonzero(live), rows))
+
+    def getLocs(self, rows:np.ndarray):
+        """ grid locations of the keys at rows, as an (n, 3) array """
+        return np.stack(unpackKey(self.key[rows]), axis=1)
+
+    def getParentRows(self, rows:np.ndarray):
+        """ rows of the bricks the entries at rows belong to (their own row for parents 'self' and None) """
+        parentRows = rows.copy()
+        parents = self.parent[rows]
+        hasParent = parents >= 0
+        if hasParent.any():
+            live = self.getLiveRows()
+            live = live[np.argsort(self.key[live])]
+            found = live[np.minimum(np.searchsorted(self.key[live], parents[hasParent]), len(live) - 1)]
+            # keep own row for parents missing from the store
+            parentRows[hasParent] = np.where(self.key[found] == parents[hasParent], found, rows[hasParent])
+        return parentRows
+
+    def getFieldArray(self, field:str, rows:np.ndarray, dtype=None):
+        """ values of an extra field (e.g. 'co') at rows as an array, read from a NumericColumn without touching entries """
+        values = self.getExtraColumn(field)
+        if isinstance(values, NumericColumn):
+            return values.data[rows].astype(dtype or values.data.dtype)
+        return np.array([values[r] for r in rows], dtype=dtype)
+
+    def toDict(self):
+        """ plain bricksDict (dict of dicts) with the entries of the store """
+        return {key: self.getEntryDict(row) for key, row in self.iterKeyRows()}
+
+    def nbytes(self):
+        """ bytes used by the NumPy columns """
+        return sum(getattr(self, attr).nbytes for attr in ("key", "draw", "size", "mat", "parent", "name"))
+
+
+def getBrickField(bricksDict, key:str, field:str):
+    """ 'bricksDict[key][field]', read straight from the columns of a ColumnarBricksDict """
+    if isinstance(bricksDict, ColumnarBricksDict):
+        return bricksDict.getValue(key, field)
+    return bricksDict[key][field]
+
+
+def getBackingStore(bricksDict):
+    """ ColumnarBricksDict holding the entries of bricksDict, for vectorized reads (None for a plain bricksDict)
+
+    Resident chunks of a ChunkedBricksDict are written back first, so the
+    store is up to date; nothing is loaded.
+    """
+    if isinstance(bricksDict, ChunkedBricksDict):
+        bricksDict.flush()
+        return bricksDict.store
+    return bricksDict if isinstance(bricksDict, ColumnarBricksDict) else None
+
+
+# binary bricksDict files: magic, version and header length, JSON header
+# (string tables, record count and offsets of the sections), then the records
+# (sorted by packed key) and a contiguous copy of their keys (for binary search), a 'present' mask and fixed-width array per numeric extra field, and one JSON
+# list per other extra field
+BRICKSDICT_MAGIC = b"BSBDICT\0"
+BRICKSDICT_VERSION = 3
+BRICKSDICT_PREFIX = struct.Struct("<8sII")
+RECORD_DTYPE = np.dtype([("key", "<i8"), ("parent", "<i8"), ("mat", "<i4"), ("name", "<i4"), ("size", "<i2", (3,)), ("draw", "?")])
+
+
+def _align(offset:int, alignment:int=16):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def saveBricksDict(bricksDict, filepath:str):
+    """ write bricksDict (plain dict or ColumnarBricksDict) to a binary file for 'loadBricksDict' """
+    store = bricksDict if isinstance(bricksDict, ColumnarBricksDict) else ColumnarBricksDict(bricksDict)
+    store.loadExtraColumns()
+    rows = store.getLiveRows()
+    # records sorted by key, so loaded stores can find rows with a binary search
+    rows = rows[np.argsort(store.key[rows], kind="stable")]
+    records = np.zeros(len(rows), dtype=RECORD_DTYPE)
+    records["key"] = store.key[rows]
+    records["parent"] = store.parent[rows]
+    records["mat"] = store.mat[rows]
+    records["name"] = store.name[rows]
+    records["size"] = store.size[rows]
+    records["draw"] = store.draw[rows]
+    numericColumns = []
+    extraBlobs = []
+    for field, values in store.extra.items():
+        if isinstance(values, NumericColumn):
+            column = NumericColumn(values.data[rows], values.present[rows])
+        else:
+            fieldValues = [values[r] for r in rows]
+            column = NumericColumn.fromValues(fieldValues)
+        if column is not None:
+            numericColumns.append((field, column))
+            continue
+        # missing values are listed by index, since None is a valid value
+        missing = [i for i, v in enumerate(fieldValues) if v is MISSING]
+        for i in missing:
+            fieldValues[i] = None
+        extraBlobs.append((field, json.dumps({"values": fieldValues, "missing": missing}).encode("utf-8")))
+    header = {"numRecords": len(rows), "namePrefix": store.namePrefix, "matNames": store.matNames.strings, "names": store.names.strings, "columns": {}, "extra": {}}
+    # offsets depend on the header length, so size the header with placeholder offsets at least as long as the real ones
+    for field, column in numericColumns:
+        header["columns"][field] = [column.data.dtype.str, list(column.data.shape[1:]), 10 ** 15, 10 ** 15]
+    for field, blob in extraBlobs:
+        header["extra"][field] = [10 ** 15, len(blob)]
+    header["recordsOffset"] = header["keysOffset"] = 10 ** 15
+    headerLen = len(json.dumps(header).encode("utf-8"))
+    offset = header["recordsOffset"] = _align(BRICKSDICT_PREFIX.size + headerLen)
+    offset += records.nbytes
+    header["keysOffset"] = offset = _align(offset)
+    offset += records["key"].nbytes
+    for field, column in numericColumns:
+        header["columns"][field][2] = offset = _align(offset)
+        header["columns"][field][3] = offset = _align(offset + column.present.nbytes)
+        offset += column.data.nbytes
+    for field, blob in extraBlobs:
+        header["extra"][field][0] = offset
+        offset += len(blob)
+    headerBytes = json.dumps(header).encode("utf-8").ljust(headerLen)
+    with open(filepath, "wb") as f:
+        f.write(BRICKSDICT_PREFIX.pack(BRICKSDICT_MAGIC, BRICKSDICT_VERSION, headerLen))
+        f.write(headerBytes)
+        f.seek(header["recordsOffset"])
+        f.write(records.tobytes())
+        f.seek(header["keysOffset"])
+        f.write(np.ascontiguousarray(records["key"]).tobytes())
+        for field, column in numericColumns:
+            dtype, shape, presentOffset, dataOffset = header["columns"][field]
+            f.seek(presentOffset)
+            f.write(column.present.tobytes())
+            f.seek(dataOffset)
+            f.write(column.data.tobytes())
+        for field, blob in extraBlobs:
+            f.seek(header["extra"][field][0])
+            f.write(blob)
+
+
+def _readBricksDictHeader(filepath:str):
+    with open(filepath, "rb") as f:
+        magic, version, headerLen = BRICKSDICT_PREFIX.unpack(f.read(BRICKSDICT_PREFIX.size))
+        if magic != BRICKSDICT_MAGIC:
+            raise ValueError("'%(filepath)s' is not a binary bricksDict file" % locals())
+        if version != BRICKSDICT_VERSION:
+            raise ValueError("Binary bricksDict file '%(filepath)s' has unsupported version %(version)s" % locals())
+        return json.loads(f.read(headerLen).decode("utf-8"))
+
+
+def _extraLoader(filepath:str, offset:int, length:int, numRows:int):
+    def load():
+        with open(filepath, "rb") as f:
+            f.seek(offset)
+            data = json.loads(f.read(length).decode("utf-8"))
+        values = data["values"]
+        for i in data["missing"]:
+            values[i] = MISSING
+        values.extend([MISSING] * (numRows - len(values)))
+        return values
+    return load
+
+
+def loadBricksDict(filepath:str, mode:str="c"):
+    """ open binary bricksDict file from 'saveBricksDict' as a ColumnarBricksDict
+
+    The columns are views of a memory map of the file, so only pages that
+    are accessed get read. With mode 'c' (copy-on-write) edits stay in
+    memory; save them with 'saveBricksDict'. Numeric extra fields (like
+    'co' or exposure flags) are memory mapped NumericColumns too, and other
+    extra fields are parsed from their JSON lists on first use. Keys stay
+    packed in the memory mapped key column; a key's row is found with a
+    binary search when it is first looked up.
+
+    Bricker keeps caching bricksDicts as JSON, so sessions don't read these
+    files on their own; a loaded store can be passed to the BrickSculpt
+    operator as its bricksDict.
+    """
+    header = _readBricksDictHeader(filepath)
+    numRecords = header["numRecords"]
+    if numRecords:
+        records = np.memmap(filepath, dtype=RECORD_DTYPE, mode=mode, offset=header["recordsOffset"], shape=(numRecords,))
+    else:
+        records = np.zeros(0, dtype=RECORD_DTYPE)
+    store = ColumnarBricksDict()
+    store.key = records["key"]
+    store.parent = records["parent"]
+    store.mat = records["mat"]
+    store.name = records["name"]
+    store.size = records["size"]
+    store.draw = records["draw"]
+    # records are sorted by key; rows are found by binary search of the contiguous key copy instead of decoding every key into 'rows'
+    store.numBaseRows = numRecords
+    if numRecords:
+        # plain ndarray view of the map, as the memmap subclass adds overhead to every search
+        store.baseKeys = np.asarray(np.memmap(filepath, dtype="<i8", mode="r", offset=header["keysOffset"], shape=(numRecords,)))
+    store.namePrefix = header["namePrefix"]
+    for s in header["matNames"]:
+        store.matNames.intern(s)
+    for s in header["names"]:
+        store.names.intern(s)
+    for field, (dtype, shape, presentOffset, dataOffset) in header["columns"].items():
+        dtype = np.dtype(dtype)
+        if numRecords:
+            present = np.memmap(filepath, dtype=bool, mode=mode, offset=presentOffset, shape=(numRecords,))
+            data = np.memmap(filepath, dtype=dtype, mode=mode, offset=dataOffset, shape=(numRecords,) + tuple(shape))
+        else:
+            present = np.zeros(0, dtype=bool)
+            data = np.zeros((0,) + tuple(shape), dtype=dtype)
+        store.extra[field] = NumericColumn(data, present)
+    for field, (offset, length) in header["extra"].items():
+        store.pendingExtra[field] = _extraLoader(filepath, offset, length, numRecords)
+    return store
+
+
+def convertBricksDictFile(jsonPath:str, filepath:str):
+    """ convert bricksDict saved as JSON (the format bricksDicts are cached in) to a binary bricksDict file """
+    with open(jsonPath, "r") as f:
+        bricksDict = json.load(f)
+    saveBricksDict(bricksDict, filepath)
+    return filepath
+
+
+class SessionStoreBuilder:
+    """ ColumnarBricksDict copy of a plain bricksDict, built a slice of entries at a time
+
+    Entries changed in the plain bricksDict after they were copied have to
+    be copied again with 'refresh' before the store is used.
+    """
+
+    sliceSize = 256
+
+    def __init__(self, bricksDict:dict):
+        self.bricksDict = bricksDict
+        self.keys = list(bricksDict)
+        self.numCopied = 0
+        self.store = ColumnarBricksDict()
+        if self.keys:
+            self.store.grow(len(self.keys))
+
+    def step(self, budget:float=None):
+        """ copy entries for up to 'budget' seconds (all remaining ones if None); returns True once all are copied """
+        deadline = None if budget is None else time.perf_counter() + budget
+        while not self.done():
+            end = min(self.numCopied + self.sliceSize, len(self.keys))
+            for key in self.keys[self.numCopied:end]:
+                brickD = self.bricksDict.get(key)
+                if brickD is not None:
+                    self.store[key] = brickD
+            self.numCopied = end
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+        return self.done()
+
+    def done(self):
+        return self.numCopied == len(self.keys)
+
+    def refresh(self, keys:iter):
+        """ copy entries at keys again (removing the ones deleted from the plain bricksDict) """
+        for key in keys:
+            brickD = self.bricksDict.get(key)
+            if brickD is not None:
+                self.store[key] = brickD
+            elif key in self.store:
+                del self.store[key]
+
+
+class ChunkList(TrackedList):
+    """ list value of a ChunkEntry, marking the entry changed when it is changed in place """
+
+    __slots__ = ("entry",)
+
+    def __init__(self, values:list, entry):
+        list.__init__(self, values)
+        self.entry = entry
+
+    def onChange(self):
+        self.entry.onChange()
+
+
+class ChunkEntry(dict):
+    """ plain dict entry of a BrickChunk, marking its key dirty in the chunk whenever it (or a list value) changes
+
+    List values are held as ChunkLists. Copies (copy.copy, copy.deepcopy)
+    and 'toDict' are plain dicts.
+    """
+
+    __slots__ = ("chunk", "key")
+
+    def __init__(self, brickD:dict, chunk, key:str):
+        super().__init__((field, self.track(value)) for field, value in brickD.items())
+        self.chunk = chunk
+        self.key = key
+
+    def track(self, value):
+        return ChunkList(value, self) if isinstance(value, list) else value
+
+    def onChange(self):
+        self.chunk.dirty.add(self.key)
+
+    def __setitem__(self, field:str, value):
+        super().__setitem__(field, self.track(value))
+        self.onChange()
+
+    def __delitem__(self, field:str):
+        super().__delitem__(field)
+        self.onChange()
+
+    def update(self, *args, **kwargs):
+        for field, value in dict(*args, **kwargs).items():
+            super().__setitem__(field, self.track(value))
+        self.onChange()
+
+    def setdefault(self, field:str, default=None):
+        if field not in self:
+            self[field] = default
+        return self[field]
+
+    def pop(self, field:str, *default):
+        value = super().pop(field, *default)
+        self.onChange()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self.onChange()
+        return item
+
+    def clear(self):
+        super().clear()
+        self.onChange()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __copy__(self):
+        return self.toDict()
+
+    def __deepcopy__(self, memo:dict):
+        return copy.deepcopy(self.toDict(), memo)
+
+    def toDict(self):
+        """ plain dict copy of the entry (list values copied too) """
+        return {field: list(value) if isinstance(value, list) else value for field, value in self.items()}
+
+
+class BrickChunk:
+    """ ChunkEntry entries of the bricksDict keys in one spatial chunk """
+
+    __slots__ = ("entries", "added", "deleted", "dirty", "pins")
+
+    def __init__(self):
+        self.entries = {}
+        # keys set/deleted while resident that aren't/are in the backing store
+        self.added = set()
+        self.deleted = set()
+        # keys of entries changed while resident (written back on eviction)
+        self.dirty = set()
+        # number of 'ChunkedBricksDict.pinned' blocks keeping the chunk resident
+        self.pins = 0
+
+    def isPinned(self):
+        return self.pins > 0
+
+
+class ChunkedBricksDict(MutableMapping):
+    """ bricksDict backed by a ColumnarBricksDict, materialized as plain dicts one spatial chunk at a time
+
+    Keys are grouped in chunks of 'chunkSize' cells per side. The first
+    access to a key loads the entries of its whole chunk as ChunkEntry
+    dicts (so entries can be changed in place like in a plain bricksDict),
+    which mark themselves dirty when changed. Beyond 'maxChunks' resident
+    chunks, the least recently used one is evicted, writing its dirty
+    entries back to the backing store. Entries held across other lookups
+    (e.g. a 'brickD' kept while neighbors are read) must be looked up in a
+    'pinned' block, so their chunks aren't evicted and edits made through
+    them aren't lost; pinned chunks may keep more than 'maxChunks'
+    resident until the block ends. 'items' and 'values' read chunks that
+    aren't resident straight from the store, so bulk scans don't load (and
+    evict) chunks. 'toDict' and iteration write back all resident chunks
+    first.
+    """
+
+    def __init__(self, store:ColumnarBricksDict, chunkSize:int=16, maxChunks:int=64):
+        self.store = store
+        self.chunkSize = chunkSize
+        self.maxChunks = maxChunks
+        # chunk -> BrickChunk, least recently used first
+        self.chunks = OrderedDict()
+        self.chunkRows = self.getChunkRows()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.pinnedSkips = 0
+        self.writeBacks = 0
+        # number of 'pinned' blocks without keys (no chunk is evicted in them)
+        self.holds = 0
+
+    def getChunkRows(self):
+        """ map packed chunk location -> rows of the store in that chunk """
+        locs = unpackKey(self.store.key[:self.store.getNumRows()])
+        chunkKeys = packKey(*(loc // self.chunkSize for loc in locs))
+        order = np.argsort(chunkKeys, kind="stable")
+        uniqueKeys, starts = np.unique(chunkKeys[order], return_index=True)
+        return {int(c): rows for c, rows in zip(uniqueKeys, np.split(order, starts[1:]))}
+
+    def getChunkKey(self, key:str):
+        x, y, z = key.split(",")
+        return packKey(int(x) // self.chunkSize, int(y) // self.chunkSize, int(z) // self.chunkSize)
+
+    def getChunk(self, chunkKey:int):
+        """ get resident chunk, loading it (and evicting the least recently used ones) if needed """
+        chunk = self.chunks.get(chunkKey)
+        if chunk is not None:
+            self.chunks.move_to_end(chunkKey)
+            self.hits += 1
+            return chunk
+        chunk = self.chunks[chunkKey] = BrickChunk()
+        for row in self.chunkRows.get(chunkKey, ()):
+            key = self.store.getKey(row)
+            if self.store.getRow(key) == row:
+                chunk.entries[key] = ChunkEntry(self.store.getEntryDict(row), chunk, key)
+        self.loads += 1
+        self.evictUnpinned(keep=chunkKey)
+        return chunk
+
+    def evictUnpinned(self, keep:int=None):
+        """ evict least recently used chunks beyond 'maxChunks', skipping pinned ones and chunk 'keep' """
+        numExcess = len(self.chunks) - self.maxChunks
+        if numExcess <= 0 or self.holds:
+            return
+        for chunkKey, chunk in list(self.chunks.items()):
+            if chunkKey == keep:
+                continue
+            if chunk.isPinned():
+                self.pinnedSkips += 1
+                continue
+            self.evict(chunkKey)
+            numExcess -= 1
+            if numExcess == 0:
+                break
+
+    def writeBack(self, chunk:BrickChunk):
+        """ write dirty entries of chunk (and its deletions) back to the backing store """
+        changed = bool(chunk.deleted or chunk.dirty)
+        for key in chunk.deleted:
+            del self.store[key]
+        for key in chunk.dirty:
+            brickD = chunk.entries.get(key)
+            if brickD is None:
+                continue
+            isNew = self.store.getRow(key) is None
+            self.store[key] = brickD.toDict()
+            if isNew:
+                chunkKey = self.getChunkKey(key)
+                self.chunkRows[chunkKey] = np.append(self.chunkRows.get(chunkKey, np.zeros(0, dtype=np.int64)), self.store.getRow(key))
+        chunk.added.clear()
+        chunk.deleted.clear()
+        chunk.dirty.clear()
+        if changed:
+            self.writeBacks += 1
+
+    def evict(self, chunkKey:int):
+        self.writeBack(self.chunks.pop(chunkKey))
+        self.evictions += 1
+
+    @contextmanager
+    def pinned(self, keys:iter=None):
+        """ keep the chunks of keys resident in the block (with no keys, no chunk is evicted in the block) """
+        chunks = []
+        for chunkKey in set(self.getChunkKey(key) for key in keys or ()):
+            # pinned as loaded, so loading the next one can't evict it
+            chunk = self.getChunk(chunkKey)
+            chunk.pins += 1
+            chunks.append(chunk)
+        self.holds += keys is None
+        try:
+            yield
+        finally:
+            for chunk in chunks:
+                chunk.pins -= 1
+            self.holds -= keys is None
+            self.evictUnpinned()
+
+    def flush(self):
+        """ write back all resident chunks (they stay resident) """
+        for chunk in self.chunks.values():
+            self.writeBack(chunk)
+
+    def clear(self):
+        """ write back and evict all resident chunks """
+        while self.chunks:
+            self.evict(next(iter(self.chunks)))
+
+    def __getitem__(self, key:str):
+        return self.getChunk(self.getChunkKey(key)).entries[key]
+
+    def get(self, key:str, default=None):
+        try:
+            return self[key]
+        except (KeyError, ValueError):
+            return default
+
+    def __setitem__(self, key:str, brickD:dict):
+        chunk = self.getChunk(self.getChunkKey(key))
+        if key not in chunk.entries and key not in self.store:
+            chunk.added.add(key)
+        chunk.deleted.discard(key)
+        chunk.entries[key] = ChunkEntry(brickD, chunk, key)
+        chunk.dirty.add(key)
+
+    def __delitem__(self, key:str):
+        chunk = self.getChunk(self.getChunkKey(key))
+        del chunk.entries[key]
+        chunk.dirty.discard(key)
+        if key in chunk.added:
+            chunk.added.remove(key)
+        else:
+            chunk.deleted.add(key)
+
+    def __contains__(self, key):
+        try:
+            chunk = self.chunks.get(self.getChunkKey(key))
+        except (AttributeError, ValueError):
+            return False
+        return key in chunk.entries if chunk is not None else key in self.store
+
+    def __iter__(self):
+        self.flush()
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store) + sum(len(c.added) - len(c.deleted) for c in self.chunks.values())
+
+    def items(self):
+        self.flush()
+        for key, row in self.store.iterKeyRows():
+            chunk = self.chunks.get(self.getChunkKey(key))
+            yield key, chunk.entries[key] if chunk is not None else BrickEntry(self.store, row)
+
+    def values(self):
+        return (brickD for key, brickD in self.items())
+
+    def toDict(self):
+        """ plain bricksDict (dict of dicts) with all entries """
+        self.flush()
+        return self.store.toDict()
+
+    def stats(self):
+        return {"resident": len(self.chunks), "chunks": len(self.chunkRows), "hits": self.hits, "loads": self.loads, "evictions": self.evictions, "pinnedSkips": self.pinnedSkips, "writeBacks": self.writeBacks}